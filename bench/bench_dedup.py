@@ -0,0 +1,136 @@
+"""
+Duplicate detection benchmark and precision/recall check.
+
+First scores dedup.same_business against the hand-labelled pairs in
+bench/dedup_pairs.csv. Then builds a synthetic corpus of leads where a
+share of them are re-listed with typical variations (legal suffix, phone
+format, punctuation, a typo) and compares the DuplicateIndex with exact
+(name, phone) matching for speed, precision and recall.
+
+    python bench/bench_dedup.py --leads 200000 --duplicates 0.2
+"""
+import argparse
+import csv
+import os
+import random
+import string
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'src'))
+
+from dedup import DuplicateIndex, same_business
+
+WORDS = [
+    'bright', 'holiday', 'lighting', 'exterior', 'roofing', 'gutter', 'lawn', 'pest', 'plumbing', 'electric',
+    'pressure', 'window', 'fence', 'patio', 'pool', 'solar', 'security', 'home', 'metro', 'summit', 'valley',
+    'coastal', 'premier', 'elite', 'golden', 'family', 'quality', 'northside', 'apex', 'sparkle',
+]
+SUFFIXES = ['', '', ' LLC', ' Inc', ' Co.', ', Inc.', ' Company']
+PHONE_FORMATS = ['({a}) {b}-{c}', '{a}-{b}-{c}', '{a}.{b}.{c}', '+1 {a} {b} {c}', '{a}{b}{c}']
+
+
+def score(predicted, actual):
+    true_positives = sum(1 for p, a in zip(predicted, actual) if p and a)
+    precision = true_positives / sum(predicted) if sum(predicted) else 1
+    recall = true_positives / sum(actual) if sum(actual) else 1
+    return precision, recall
+
+
+def labelled_pairs():
+    with open(os.path.join(BENCH_DIR, 'dedup_pairs.csv'), newline='', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            yield (
+                {'NAME': row['name_a'], 'PHONE': row['phone_a'], 'STATE/CITY': row['location_a']},
+                {'NAME': row['name_b'], 'PHONE': row['phone_b'], 'STATE/CITY': row['location_b']},
+                row['duplicate'] == '1'
+            )
+
+
+def make_corpus(count, duplicate_share, rng):
+    # Returns (leads, entity of each lead); leads with the same entity are duplicates
+    leads, entities, originals = [], [], []
+    for _ in range(count):
+        if originals and rng.random() < duplicate_share:
+            entity = rng.randrange(len(originals))
+            leads.append(vary(originals[entity], rng))
+        else:
+            entity = len(originals)
+            words = rng.sample(WORDS, rng.randint(1, 3)) + [''.join(rng.choices(string.ascii_lowercase, k=5))]
+            digits = ''.join(rng.choices(string.digits, k=10))
+            originals.append({
+                'name': ' '.join(words).title(),
+                'digits': digits if rng.random() < 0.9 else None,
+                'location': f"ST{rng.randrange(50)}, City {rng.randrange(2000)}",
+            })
+            leads.append(vary(originals[entity], rng, exact=True))
+        entities.append(entity)
+    return leads, entities
+
+
+def vary(original, rng, exact=False):
+    name = original['name']
+    if not exact:
+        name += rng.choice(SUFFIXES)
+        if rng.random() < 0.2:
+            i = rng.randrange(len(name))
+            name = name[:i] + name[i + 1:]
+    digits = original['digits']
+    if digits:
+        phone_format = PHONE_FORMATS[0] if exact else rng.choice(PHONE_FORMATS)
+        phone = phone_format.format(a=digits[:3], b=digits[3:6], c=digits[6:])
+    else:
+        phone = 'N/A'
+    return {'NAME': name, 'PHONE': phone, 'STATE/CITY': original['location']}
+
+
+def exact_duplicates(leads):
+    seen = set()
+    flags = []
+    for lead in leads:
+        identifier = (lead['NAME'].strip().lower(), lead['PHONE'].strip())
+        flags.append(identifier in seen)
+        seen.add(identifier)
+    return flags
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark duplicate detection.")
+    parser.add_argument('--leads', type=int, default=200000, help="Synthetic leads (default: 200000)")
+    parser.add_argument('--duplicates', type=float, default=0.2, help="Share of leads that re-list an earlier one (default: 0.2)")
+    args = parser.parse_args()
+
+    pairs = list(labelled_pairs())
+    predicted = [same_business(a, b) for a, b, _ in pairs]
+    actual = [label for _, _, label in pairs]
+    precision, recall = score(predicted, actual)
+    print(f"Labelled pairs ({len(pairs)}): precision {precision:.2f}, recall {recall:.2f}")
+    for (a, b, label), prediction in zip(pairs, predicted):
+        if prediction != label:
+            print(f"  {'missed' if label else 'false match'}: {a['NAME']!r} / {b['NAME']!r}")
+
+    leads, entities = make_corpus(args.leads, args.duplicates, random.Random(0))
+    seen_entities = set()
+    actual = []
+    for entity in entities:
+        actual.append(entity in seen_entities)
+        seen_entities.add(entity)
+
+    start_time = time.perf_counter()
+    exact = exact_duplicates(leads)
+    exact_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    index = DuplicateIndex()
+    fuzzy = [index.check(lead) for lead in leads]
+    fuzzy_time = time.perf_counter() - start_time
+
+    print(f"\nSynthetic corpus: {args.leads} leads, {sum(actual)} duplicates")
+    for label, flags, elapsed in (('exact (name, phone)', exact, exact_time), ('DuplicateIndex', fuzzy, fuzzy_time)):
+        precision, recall = score(flags, actual)
+        print(f"  {label:<20} {elapsed:6.2f}s ({args.leads / elapsed:>9.0f} leads/sec)  precision {precision:.3f}, recall {recall:.3f}")
+
+
+if __name__ == '__main__':
+    main()
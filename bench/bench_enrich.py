@@ -0,0 +1,78 @@
+"""
+Website enrichment benchmark against the local site stand-in.
+
+Starts bench/fake_server.py with --sites and enriches synthetic leads
+whose websites point at its sites, several leads per site as chain
+locations have. Runs twice over the same leads with one response cache,
+cold and then warm, and reports leads/sec, pages fetched, emails found and
+how the sites that fail, hang, send slowly or serve oversized pages were
+handled.
+
+    python bench/bench_enrich.py --leads 5000 --sites 1000 --site-latency 300 --site-hang-rate 0.02
+    python bench/bench_enrich.py --site-slow-rate 0.05 --timeout 3
+    python bench/bench_enrich.py --max-connections 10 --per-host 1
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'src'))
+
+from bench_pipeline import fetch_server_stats, start_server
+from fake_server import FakePlacesAPI, add_arguments
+
+
+async def enrich_once(args, leads, cache):
+    from enrich import WebsiteEnricher
+
+    async with WebsiteEnricher(cache, max_connections=args.max_connections, per_host=args.per_host,
+                               timeout=args.timeout, max_bytes=args.max_bytes) as enricher:
+        start_time = time.perf_counter()
+        # A city's worth of leads at a time, as LeadSearch.run() hands them over
+        await asyncio.gather(*(enricher.enrich(leads[i:i + 20]) for i in range(0, len(leads), 20)))
+        return time.perf_counter() - start_time, enricher.summary()
+
+
+async def run_benchmark(args, url):
+    from cache import ResponseCache
+    from config import CACHE_TTL
+
+    port = url.rsplit(':', 1)[1]
+    leads = [{'WEBSITE': f"http://{FakePlacesAPI.site_host(i % args.sites)}:{port}/"} for i in range(args.leads)]
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ResponseCache(os.path.join(directory, 'responses.sqlite'), CACHE_TTL, 64 * 1024 * 1024)
+        for label in ('cold', 'warm'):
+            elapsed, summary = await enrich_once(args, [dict(lead) for lead in leads], cache)
+            print(f"{label}: {args.leads} leads in {elapsed:.2f}s ({args.leads / elapsed:.0f} leads/sec), "
+                  f"{summary.get('leads_with_email', 0)} with an email")
+            print(f"  {', '.join(f'{name}={count}' for name, count in sorted(summary.items()))}")
+        cache.close()
+    stats = await fetch_server_stats(url)
+    print(f"server: {', '.join(f'{name}={count}' for name, count in sorted(stats.items()))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark website enrichment against local stand-in sites.")
+    parser.add_argument('--leads', type=int, default=2000, help="Leads to enrich (default: 2000)")
+    parser.add_argument('--max-connections', type=int, default=50, help="Connections overall (default: 50)")
+    parser.add_argument('--per-host', type=int, default=2, help="Connections per site (default: 2)")
+    parser.add_argument('--timeout', type=float, default=5, help="Seconds per page (default: 5)")
+    parser.add_argument('--max-bytes', type=int, default=512 * 1024, help="Bytes read per page (default: 512 KiB)")
+    add_arguments(parser)
+    parser.set_defaults(sites=500, site_large_rate=0.05)
+    args = parser.parse_args()
+
+    server, url = start_server(args)
+    try:
+        asyncio.run(run_benchmark(args, url))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Output format benchmark.
+
+Streams synthetic leads through LeadWriter in each output format, a city
+at a time as runs do, with LeadStats attached, then reads the file back.
+Reports write and read rates and file sizes. Parquet is skipped when
+pyarrow is not installed; for it, reading just the RATING and REVIEWS
+columns is also timed, which is what the per-state rollups downstream do.
+
+Before timing a format, it checks that a run killed before its first
+flush can be resumed: the reopened file must keep every row once and
+still deduplicate on the next reopen.
+
+    python bench/bench_formats.py --rows 500000
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC_DIR)
+
+from data_handler import LeadStats, LeadWriter
+from formats import FORMATS, format_for
+
+CITY_SIZE = 50
+
+
+def make_lead(n, rng):
+    return {
+        'NAME': f"Business {n} Lighting LLC",
+        'PHONE': f"({200 + n % 800}) {n // 10000 % 1000:03d}-{n % 10000:04d}",
+        'WEBSITE': f"https://example.com/{n}" if rng.random() < 0.8 else 'N/A',
+        'STATE/CITY': f"ST{n % 50}, City {n // CITY_SIZE}",
+        'RATING': round(rng.uniform(1, 5), 1) if rng.random() < 0.9 else 'N/A',
+        'REVIEWS': rng.randint(0, 2000) if rng.random() < 0.9 else 'N/A',
+        'REASON': '',
+        'KEYWORD': 'lighting',
+    }
+
+
+def check_resume_after_kill(path, leads):
+    # A process that opens the file, buffers a city and is killed before flushing it
+    subprocess.run([sys.executable, '-c', (
+        f"import os, sys; sys.path.insert(0, {SRC_DIR!r})\n"
+        f"from data_handler import LeadWriter\n"
+        f"writer = LeadWriter({path!r})\n"
+        f"writer.write({leads[:CITY_SIZE]!r})\n"
+        f"os._exit(9)"
+    )], check=False)
+    for _ in range(2):
+        # The resumed run searches the city again, then a later one reopens the finished file
+        with LeadWriter(path, append=True) as writer:
+            writer.write(leads[:2 * CITY_SIZE])
+    format_rows = [row['NAME'] for row in format_for(path).read_rows(path)]
+    if sorted(format_rows) != sorted(lead['NAME'] for lead in leads[:2 * CITY_SIZE]):
+        raise SystemExit(f"{os.path.basename(path)}: resuming after a kill kept {len(format_rows)} rows, expected {2 * CITY_SIZE}")
+    os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the leads file formats.")
+    parser.add_argument('--rows', type=int, default=200000, help="Leads to write (default: 200000)")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    leads = [make_lead(n, rng) for n in range(args.rows)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, output_format in FORMATS.items():
+            if name == 'parquet':
+                try:
+                    import pyarrow.parquet as pq
+                except ImportError:
+                    print(f"{name:<9} skipped (pyarrow is not installed)")
+                    continue
+            path = os.path.join(directory, f"leads{output_format.extension}")
+            check_resume_after_kill(path, leads)
+            stats = LeadStats()
+
+            start_time = time.perf_counter()
+            with LeadWriter(path, on_row=stats.add) as writer:
+                for i in range(0, len(leads), CITY_SIZE):
+                    writer.write(leads[i:i + CITY_SIZE])
+                    writer.flush()
+            stats.summary()
+            write_time = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            rows = sum(1 for _ in output_format.read_rows(path))
+            read_time = time.perf_counter() - start_time
+
+            print(f"{name:<9} {os.path.getsize(path) / 1e6:8.1f} MB  write {args.rows / write_time:>9.0f} rows/sec  "
+                  f"read {rows / read_time:>9.0f} rows/sec", end='')
+            if name == 'parquet':
+                start_time = time.perf_counter()
+                pq.read_table(path, columns=['RATING', 'REVIEWS'])
+                print(f"  (RATING, REVIEWS only: {time.perf_counter() - start_time:.3f}s)", end='')
+            print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Lead store upsert benchmark.
+
+Fills a temporary LeadStore with synthetic leads in batches, as runs do
+one city at a time, and reports the upsert rate as the store grows. With
+the place_id, phone and name+city indexes the rate should stay roughly
+flat from thousands to millions of rows. Half of each later batch repeats
+earlier leads so both the insert and the match paths are measured.
+
+    python bench/bench_lead_store.py --rows 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from lead_store import LeadStore
+
+
+def make_lead(n):
+    return {
+        'NAME': f"Business {n} Lighting LLC",
+        'PHONE': f"({200 + n % 800}) {n // 10000 % 1000:03d}-{n % 10000:04d}",
+        'WEBSITE': f"https://example.com/{n}",
+        'STATE/CITY': f"ST{n % 50}, City {n % 5000}",
+        'PLACE_ID': f"place-{n}",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure LeadStore upsert throughput as the store grows.")
+    parser.add_argument('--rows', type=int, default=1000000, help="Distinct leads to insert (default: 1000000)")
+    parser.add_argument('--batch', type=int, default=200, help="Leads per upsert call, about one city (default: 200)")
+    parser.add_argument('--report', type=int, default=10, help="Number of progress reports (default: 10)")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store = LeadStore(os.path.join(temp_dir, 'leads.sqlite'))
+        inserted = 0
+        report_every = max(args.rows // args.report, args.batch)
+        next_report = report_every
+        window_start, window_leads = time.perf_counter(), 0
+        while inserted < args.rows:
+            fresh = [make_lead(n) for n in range(inserted, min(inserted + args.batch, args.rows))]
+            repeats = [make_lead(rng.randrange(inserted)) for _ in range(len(fresh))] if inserted else []
+            store.upsert(fresh + repeats, f"run{inserted // report_every}")
+            inserted += len(fresh)
+            window_leads += len(fresh) + len(repeats)
+            if inserted >= next_report:
+                elapsed = time.perf_counter() - window_start
+                print(f"{store.count():>10} rows: {window_leads / elapsed:>9.0f} upserts/sec")
+                window_start, window_leads = time.perf_counter(), 0
+                next_report += report_every
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Micro-benchmark for keyword classification.
+
+Compares the original linear scan, `any(keyword in name for keyword in
+keywords)`, with the compiled KeywordMatcher over a synthetic corpus of
+business names, and checks both agree in substring mode.
+
+    python bench/bench_matcher.py --names 200000 --keywords 150
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from matcher import KeywordMatcher
+
+WORDS = [
+    'light', 'lighting', 'holiday', 'christmas', 'exterior', 'contract', 'contractor', 'roof', 'roofing',
+    'gutter', 'landscap', 'lawn', 'tree', 'pest', 'plumb', 'electric', 'paint', 'pressure', 'wash', 'clean',
+    'window', 'door', 'fence', 'deck', 'patio', 'pool', 'solar', 'hvac', 'heat', 'air', 'security', 'alarm',
+    'camera', 'home', 'resident', 'service', 'repair', 'install', 'design', 'decor', 'illumin', 'outdoor',
+]
+SUFFIXES = ['LLC', 'Inc', 'Co', 'Company', 'Services', 'Pros', 'Group', '& Sons', 'Experts', 'Solutions']
+
+
+def make_keywords(count, rng):
+    keywords = list(WORDS)
+    while len(keywords) < count:
+        keywords.append(''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 9))))
+    return keywords[:count]
+
+
+def make_names(count, rng):
+    names = []
+    for _ in range(count):
+        parts = [rng.choice(WORDS).capitalize() if rng.random() < 0.3 else
+                 ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9))).capitalize()
+                 for _ in range(rng.randint(1, 4))]
+        parts.append(rng.choice(SUFFIXES))
+        names.append(' '.join(parts))
+    return names
+
+
+def linear_scan(names, keywords):
+    return [any(keyword in name.lower() for keyword in keywords) for name in names]
+
+
+def compiled(names, matcher):
+    return [matcher.match(name) is not None for name in names]
+
+
+def best_of(repeat, func, *args):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark keyword classification.")
+    parser.add_argument('--names', type=int, default=200000, help="Synthetic business names (default: 200000)")
+    parser.add_argument('--keywords', type=int, nargs='+', default=[15, 50, 150, 300], help="Keyword list sizes to test")
+    parser.add_argument('--repeat', type=int, default=3, help="Repetitions, best time is reported (default: 3)")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    names = make_names(args.names, rng)
+
+    print(f"{'Keywords':<10} {'Linear scan':>14} {'Compiled':>14} {'Speedup':>9}")
+    for count in args.keywords:
+        keywords = make_keywords(count, rng)
+        matcher = KeywordMatcher(keywords)
+
+        linear_time, expected = best_of(args.repeat, linear_scan, names, keywords)
+        compiled_time, actual = best_of(args.repeat, compiled, names, matcher)
+        if expected != actual:
+            raise SystemExit(f"Mismatch between linear scan and compiled matcher with {count} keywords")
+
+        print(f"{count:<10} {linear_time * 1000:>11.1f} ms {compiled_time * 1000:>11.1f} ms {linear_time / compiled_time:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
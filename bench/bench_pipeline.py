@@ -0,0 +1,248 @@
+"""
+End-to-end throughput benchmark against the local API stand-in.
+
+Starts bench/fake_server.py in a subprocess, points the pipeline at it and
+runs query expansion plus a full LeadSearch run over synthetic cities. No
+network access or API keys are needed. Reports cities/sec, leads/sec, API
+calls per valid lead, city latency percentiles and peak RSS.
+
+    python bench/bench_pipeline.py --cities 200 --latency 80 --error-rate 0.02
+    python bench/bench_pipeline.py --burst-every 5 --burst-length 1 --json before.json
+    python bench/bench_pipeline.py --niches 5
+
+With --niches, that many business types are run once as separate runs and
+once as a single batch (LeadBatch), and the two are compared.
+
+With --enrich, the valid leads' websites are enriched as well, served by
+the fake server's local sites (--sites, 200 unless given):
+
+    python bench/bench_pipeline.py --enrich --site-latency 300 --site-hang-rate 0.02
+
+The fake server options (latency, errors, bursts, pages, overlap) are the
+same as fake_server.py's.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'src'))
+
+from fake_server import add_arguments
+
+STATES = ['CA', 'TX', 'FL', 'NY', 'PA', 'IL', 'OH', 'GA', 'NC', 'MI']
+
+
+def start_server(args):
+    command = [sys.executable, os.path.join(BENCH_DIR, 'fake_server.py'), '--port', '0']
+    for option in ('latency', 'jitter', 'error_rate', 'over_limit_rate', 'burst_every', 'burst_length',
+                   'pages', 'token_delay', 'overlap', 'no_phone_rate', 'sparse_rate', 'sites', 'site_latency',
+                   'site_error_rate', 'site_hang_rate', 'site_slow_rate', 'site_large_rate', 'seed'):
+        command += [f"--{option.replace('_', '-')}", str(getattr(args, option))]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = server.stdout.readline()
+    if not line.startswith('Serving on '):
+        server.kill()
+        raise RuntimeError("Fake server failed to start")
+    return server, line[len('Serving on '):].strip()
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def fetch_server_stats(url):
+    import aiohttp
+
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{url}/stats") as response:
+            return await response.json()
+
+
+async def run_benchmark(args, url):
+    # The endpoints are read from the environment when config is imported
+    os.environ['PLACES_API_URL'] = f"{url}/maps/api/place"
+    os.environ['OPENAI_BASE_URL'] = f"{url}/v1"
+    from leadgen import LeadSearch, generate_enhanced_query_and_keywords, start_run
+    from shard import parse_shard, shard_of
+
+    cities = [f"Benchtown {i}, {STATES[i % args.states]}" for i in range(args.cities)]
+    if args.shard:
+        index, count = parse_shard(args.shard)
+        cities = [city for city in cities if shard_of(city, count) == index]
+    cities_by_state = {}
+    for city in cities:
+        cities_by_state.setdefault(city.split(', ')[1], []).append(city)
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        start_time = time.perf_counter()
+        enhanced_query, keywords = await asyncio.to_thread(generate_enhanced_query_and_keywords, args.business_type, api_key='bench')
+        expansion_time = time.perf_counter() - start_time
+
+        journal = start_run('bench', args.business_type, enhanced_query, keywords, cities_by_state,
+                            runs_dir=os.path.join(output_dir, 'runs'))
+        latencies = []
+        search = LeadSearch(
+            args.business_type,
+            enhanced_query,
+            keywords,
+            api_key='bench',
+            max_in_flight=args.max_in_flight,
+            textsearch_qps=args.textsearch_qps,
+            details_qps=args.details_qps,
+            max_pages=args.max_pages,
+            cache=False,
+            places_api_url=os.environ['PLACES_API_URL'],
+            store=False,
+            enrich=args.enrich
+        )
+        async with search:
+            summary = await search.run(journal, output_dir, on_city=lambda result: latencies.append(result.runtime))
+        elapsed = time.perf_counter() - start_time
+
+    requests = sum(counts['calls'] for counts in summary['requests'].values())
+    return {
+        'cities': len(cities),
+        'elapsed': elapsed,
+        'expansion_time': expansion_time,
+        'cities_per_sec': len(cities) / elapsed,
+        'leads_per_sec': summary['valid_leads'] / elapsed,
+        'valid_leads': summary['valid_leads'],
+        'failed_cities': summary['failed_cities'],
+        'api_calls': requests,
+        'calls_per_lead': requests / summary['valid_leads'] if summary['valid_leads'] else None,
+        'city_latency': {
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+        },
+        'requests': summary['requests'],
+        'websites': summary['websites'],
+        'server': await fetch_server_stats(url),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+async def run_batch_comparison(args, url):
+    os.environ['PLACES_API_URL'] = f"{url}/maps/api/place"
+    os.environ['OPENAI_BASE_URL'] = f"{url}/v1"
+    from leadgen import LeadBatch, LeadSearch, generate_enhanced_query_and_keywords, start_batch, start_run
+
+    business_types = [f"{args.business_type} {i}" for i in range(args.niches)]
+    cities_by_state = {}
+    for i in range(args.cities):
+        cities_by_state.setdefault(STATES[i % args.states], []).append(f"Benchtown {i}, {STATES[i % args.states]}")
+    options = dict(
+        api_key='bench',
+        max_in_flight=args.max_in_flight,
+        textsearch_qps=args.textsearch_qps,
+        details_qps=args.details_qps,
+        cache=False,
+        places_api_url=os.environ['PLACES_API_URL'],
+        store=False
+    )
+    niches = []
+    for business_type in business_types:
+        enhanced_query, keywords = await asyncio.to_thread(generate_enhanced_query_and_keywords, business_type, api_key='bench')
+        niches.append({'business_type': business_type, 'enhanced_query': enhanced_query, 'keywords': keywords, 'exclude_keywords': []})
+
+    results = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        runs_dir = os.path.join(output_dir, 'runs')
+        start_time = time.perf_counter()
+        calls = leads = 0
+        for i, niche in enumerate(niches):
+            journal = start_run(f"separate_{i}", niche['business_type'], niche['enhanced_query'],
+                                niche['keywords'], cities_by_state, runs_dir=runs_dir)
+            async with LeadSearch(niche['business_type'], niche['enhanced_query'], niche['keywords'], max_pages=args.max_pages, **options) as search:
+                summary = await search.run(journal, output_dir)
+            calls += sum(counts['calls'] for counts in summary['requests'].values())
+            leads += summary['valid_leads']
+        results['separate'] = {'elapsed': time.perf_counter() - start_time, 'api_calls': calls, 'valid_leads': leads}
+
+        start_time = time.perf_counter()
+        journals = start_batch('batch', niches, cities_by_state, runs_dir=runs_dir)
+        searches = [LeadSearch(niche['business_type'], niche['enhanced_query'], niche['keywords'], api_key='bench', max_pages=args.max_pages)
+                    for niche in niches]
+        async with LeadBatch(searches, **options) as batch:
+            summaries, totals = await batch.run('batch', journals, output_dir)
+        results['batch'] = {
+            'elapsed': time.perf_counter() - start_time,
+            'api_calls': sum(counts['calls'] for counts in totals['requests'].values()),
+            'valid_leads': totals['valid_leads'],
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end throughput benchmark against a local API stand-in.")
+    parser.add_argument('--cities', type=int, default=100, help="Number of synthetic cities (default: 100)")
+    parser.add_argument('--states', type=int, default=5, choices=range(1, len(STATES) + 1), metavar=f"{{1..{len(STATES)}}}",
+                        help="Number of states the cities are spread over (default: 5)")
+    parser.add_argument('--business-type', default="Lighting and Holiday", help="Business type to search for")
+    parser.add_argument('--max-in-flight', type=int, default=20, help="Maximum concurrent requests (default: 20)")
+    parser.add_argument('--textsearch-qps', type=float, default=100, help="Text search requests per second (default: 100)")
+    parser.add_argument('--details-qps', type=float, default=500, help="Place details requests per second (default: 500)")
+    parser.add_argument('--max-pages', type=int, default=1, help="Text search pages per city (default: 1)")
+    parser.add_argument('--niches', type=int, default=1, help="Compare N business types run separately and as one batch")
+    parser.add_argument('--server', metavar='URL', help="Use an already running fake_server.py instead of starting one")
+    parser.add_argument('--shard', metavar='i/N', help="Only run the cities of shard i out of N, as main.py --shard does")
+    parser.add_argument('--enrich', action='store_true', help="Also enrich the valid leads from their websites")
+    parser.add_argument('--json', metavar='FILE', help="Also write the results to FILE, for comparing runs")
+    add_arguments(parser)
+    args = parser.parse_args()
+    if args.enrich and not args.sites:
+        args.sites = 200
+
+    server, url = (None, args.server) if args.server else start_server(args)
+    try:
+        if args.niches > 1:
+            results = asyncio.run(run_batch_comparison(args, url))
+        else:
+            results = asyncio.run(run_benchmark(args, url))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    if args.niches > 1:
+        for mode, result in results.items():
+            print(f"{args.niches} niches x {args.cities} cities, {mode}: {result['elapsed']:.2f}s, "
+                  f"{result['api_calls']} API calls, {result['valid_leads']} valid leads")
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2)
+        return
+
+    print(f"{results['cities']} cities in {results['elapsed']:.2f}s (query expansion {results['expansion_time'] * 1000:.0f} ms)")
+    print(f"  cities/sec:          {results['cities_per_sec']:.1f}")
+    print(f"  leads/sec:           {results['leads_per_sec']:.1f} ({results['valid_leads']} valid leads)")
+    if results['calls_per_lead'] is not None:
+        print(f"  API calls per lead:  {results['calls_per_lead']:.2f} ({results['api_calls']} calls)")
+    latency = results['city_latency']
+    print(f"  city latency:        p50 {latency['p50'] * 1000:.0f} ms, p95 {latency['p95'] * 1000:.0f} ms, p99 {latency['p99'] * 1000:.0f} ms")
+    print(f"  failed cities:       {results['failed_cities']}")
+    print(f"  peak RSS:            {results['peak_rss_mb']:.1f} MB")
+    for endpoint, counts in results['requests'].items():
+        print(f"  {endpoint}: {counts['calls']} calls, {counts['retries']} retries, {counts['throttled']} throttled, {counts['gave_up']} gave up")
+    if results['websites']:
+        print(f"  websites: {', '.join(f'{name}={count}' for name, count in sorted(results['websites'].items()))}")
+    print(f"  server: {', '.join(f'{name}={count}' for name, count in sorted(results['server'].items()))}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
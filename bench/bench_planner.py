@@ -0,0 +1,108 @@
+"""
+Yield-aware planning benchmark against the local API stand-in.
+
+Seeds a temporary lead store by searching the first half of a list of
+synthetic cities, as an earlier run would have. Then searches the whole
+list under the same --max-cost budget twice, once in the given order and
+once ordered by expected yield (LeadSearch(prioritize=True)), each from a
+copy of the seeded store, compares the new leads found per dollar and fails
+if either run spends more than the budget.
+With --min-yield, a third run shows where the marginal-yield floor stops.
+
+    python bench/bench_planner.py --cities 200 --max-cost 3 --min-yield 10
+
+A share of the searches (--sparse-rate, default 0.5) only find a few
+results, so cities differ in yield as they do in practice.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'src'))
+
+from bench_pipeline import STATES, start_server
+from fake_server import add_arguments
+
+
+async def search(args, url, cities, directory, run_id, store_path, prioritize=True, budget=None):
+    from leadgen import LeadSearch, generate_enhanced_query_and_keywords, start_run
+    from planner import estimate_cost
+
+    cities_by_state = {}
+    for city in cities:
+        cities_by_state.setdefault(city.split(', ')[1], []).append(city)
+    enhanced_query, keywords = await asyncio.to_thread(generate_enhanced_query_and_keywords, args.business_type, api_key='bench')
+    journal = start_run(run_id, args.business_type, enhanced_query, keywords, cities_by_state, runs_dir=os.path.join(directory, 'runs'))
+    async with LeadSearch(args.business_type, enhanced_query, keywords, api_key='bench', max_in_flight=args.max_in_flight,
+                          textsearch_qps=args.textsearch_qps, details_qps=args.details_qps, max_pages=args.max_pages,
+                          cache=False, places_api_url=os.environ['PLACES_API_URL'], store_path=store_path,
+                          prioritize=prioritize, budget=budget) as lead_search:
+        summary = await lead_search.run(journal, directory)
+    summary['cost'] = estimate_cost(summary['requests'])
+    return summary
+
+
+async def run_benchmark(args, url):
+    os.environ['PLACES_API_URL'] = f"{url}/maps/api/place"
+    os.environ['OPENAI_BASE_URL'] = f"{url}/v1"
+    from planner import Budget
+
+    # Listed largest first, as get_cities_by_state returns them; the first half was searched before
+    cities = [f"Plantown {i}, {STATES[i % args.states]}" for i in range(args.cities)]
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        seeded_store = os.path.join(directory, 'seeded.sqlite')
+        seed = await search(args, url, cities[:args.cities // 2], directory, 'seed', seeded_store, prioritize=False)
+        print(f"History: {seed['valid_leads']} leads from {args.cities // 2} cities (${seed['cost']:.2f})")
+
+        runs = [
+            ('given order', False, Budget(max_cost=args.max_cost)),
+            ('by yield', True, Budget(max_cost=args.max_cost)),
+        ]
+        if args.min_yield is not None:
+            runs.append((f"by yield, min {args.min_yield:g}/$", True, Budget(min_yield=args.min_yield)))
+        for label, prioritize, budget in runs:
+            store_path = os.path.join(directory, f"{len(results)}.sqlite")
+            shutil.copy(seeded_store, store_path)
+            summary = await search(args, url, cities, directory, f"run{len(results)}", store_path, prioritize, budget)
+            results[label] = summary
+            print(f"{label:<22} {summary['new_leads']:>6} new leads for ${summary['cost']:.2f} "
+                  f"({summary['new_leads'] / summary['cost'] if summary['cost'] else 0:.1f} per dollar), "
+                  f"{summary['cities_not_searched']} cities not searched"
+                  + (f" ({summary['budget_stop']})" if summary['budget_stop'] else ""))
+            # The budget is checked before each city starts, so the cities in flight must not overshoot it
+            assert budget.max_cost is None or summary['cost'] <= budget.max_cost, \
+                f"{label}: spent ${summary['cost']:.2f} of a ${budget.max_cost:.2f} budget"
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare city orderings under an API budget against a local API stand-in.")
+    parser.add_argument('--cities', type=int, default=200, help="Number of synthetic cities (default: 200)")
+    parser.add_argument('--states', type=int, default=5, choices=range(1, len(STATES) + 1), metavar=f"{{1..{len(STATES)}}}",
+                        help="Number of states the cities are spread over (default: 5)")
+    parser.add_argument('--business-type', default="Lighting and Holiday", help="Business type to search for")
+    parser.add_argument('--max-cost', type=float, default=2.0, help="Budget in estimated USD for each compared run (default: 2)")
+    parser.add_argument('--min-yield', type=float, help="Also run with this floor on new leads per dollar and no cost budget")
+    parser.add_argument('--max-in-flight', type=int, default=20, help="Maximum concurrent requests (default: 20)")
+    parser.add_argument('--textsearch-qps', type=float, default=200, help="Text search requests per second (default: 200)")
+    parser.add_argument('--details-qps', type=float, default=1000, help="Place details requests per second (default: 1000)")
+    parser.add_argument('--max-pages', type=int, default=1, help="Text search pages per city (default: 1)")
+    add_arguments(parser)
+    parser.set_defaults(latency=10, sparse_rate=0.5)
+    args = parser.parse_args()
+
+    server, url = start_server(args)
+    try:
+        asyncio.run(run_benchmark(args, url))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Sharding scalability benchmark.
+
+Starts one fake_server.py and runs the real launcher, main.py --workers N,
+for each worker count, with the response cache and lead store on as they
+are by default. Each run works in its own copy of src/, so the leads,
+cache, store and worker logs land in a temporary directory. A single
+process run without --workers goes first; it is the throughput baseline
+and its lead counts are what every merged run must reproduce. The
+benchmark fails if a shard fails or the merged counts differ.
+
+    python bench/bench_shards.py --cities-per-state 20 --workers 2 4 8
+
+The launcher splits the rate limits between its workers, as they share one
+API key. Here the limits are scaled with the worker count instead, so each
+worker gets what the single process had and only concurrency is measured.
+Every worker then keeps --max-in-flight requests going, so throughput grows
+linearly with the workers while they wait on the API. It stops growing once
+the workers and the fake server, a single process itself, use up the CPU
+cores: the CPU figures show the share of all cores each side used.
+"""
+import argparse
+import csv
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_pipeline import BENCH_DIR, start_server
+from fake_server import add_arguments
+
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'src')
+RUN_ID = 'bench'
+
+
+def count_rows(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path, newline='', encoding='utf-8') as file:
+        return max(sum(1 for _ in csv.reader(file)) - 1, 0)
+
+
+def children_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def process_cpu_time(pid):
+    # CPU seconds used so far by a running process, from /proc on Linux, or None elsewhere
+    try:
+        with open(f"/proc/{pid}/stat", encoding='ascii') as file:
+            fields = file.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def run_search(args, url, workers, city_index):
+    # Runs main.py in a fresh copy of src/ and returns (wall time, CPU time, lead counts by kind)
+    with tempfile.TemporaryDirectory() as root:
+        shutil.copytree(SRC_DIR, os.path.join(root, 'src'), ignore=shutil.ignore_patterns('__pycache__'))
+        cache_dir = os.path.join(root, 'leads', '.cache')
+        os.makedirs(cache_dir)
+        shutil.copy(city_index, cache_dir)
+
+        command = [
+            sys.executable, os.path.join(root, 'src', 'main.py'), args.business_type,
+            '--all-states', '-n', str(args.cities_per_state),
+            '--run-id', RUN_ID,
+            '--max-in-flight', str(args.max_in_flight),
+            '--textsearch-qps', str(args.textsearch_qps * workers),
+            '--details-qps', str(args.details_qps * workers),
+        ]
+        if workers > 1:
+            command += ['--workers', str(workers)]
+        env = dict(os.environ, PLACES_API_URL=f"{url}/maps/api/place", OPENAI_BASE_URL=f"{url}/v1",
+                   GOOGLE_PLACES_API_KEY='bench', OPENAI_API_KEY='bench')
+
+        start_time, start_cpu = time.perf_counter(), children_cpu_time()
+        process = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        elapsed, cpu = time.perf_counter() - start_time, children_cpu_time() - start_cpu
+        if process.returncode != 0:
+            raise RuntimeError(f"{workers} workers: main.py failed with exit code {process.returncode}\n{process.stdout}")
+
+        leads_dir = os.path.join(root, 'leads')
+        counts = {kind: count_rows(os.path.join(leads_dir, f"{kind}_{RUN_ID}.csv")) for kind in ('leads', 'bad-leads', 'new-leads')}
+    return elapsed, cpu, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how throughput scales with main.py --workers.")
+    parser.add_argument('--cities-per-state', type=int, default=20, help="Cities searched in each state (default: 20)")
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4], help="Worker counts to try after the single process (default: 2 4)")
+    parser.add_argument('--business-type', default="Lighting and Holiday", help="Business type to search for")
+    parser.add_argument('--max-in-flight', type=int, default=20, help="Maximum concurrent requests per worker (default: 20)")
+    parser.add_argument('--textsearch-qps', type=float, default=100, help="Text search requests per second per worker (default: 100)")
+    parser.add_argument('--details-qps', type=float, default=500, help="Place details requests per second per worker (default: 500)")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    from city_index import build_city_index
+
+    server, url = start_server(args)
+    cores = os.cpu_count() or 1
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            # Every run starts from the same prebuilt city index
+            city_index = os.path.join(directory, 'us_cities.idx')
+            build_city_index(city_index)
+            baseline = None
+            for workers in [1] + [count for count in args.workers if count > 1]:
+                server_cpu = process_cpu_time(server.pid)
+                elapsed, cpu, counts = run_search(args, url, workers, city_index)
+                if server_cpu is not None:
+                    server_cpu = process_cpu_time(server.pid) - server_cpu
+                if baseline is None:
+                    baseline, single_elapsed = counts, elapsed
+                print(f"{workers} workers: {counts['leads']} valid and {counts['bad-leads']} bad leads in {elapsed:.2f}s "
+                      f"({single_elapsed / elapsed:.2f}x single process), CPU of {cores} cores: workers {cpu / elapsed / cores:.0%}"
+                      + (f", fake server {server_cpu / elapsed / cores:.0%}" if server_cpu is not None else ""))
+                if counts != baseline:
+                    raise SystemExit(f"{workers} workers merged {counts}, the single process found {baseline}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Measure CLI startup time.
+
+Runs `python src/main.py --help` repeatedly in fresh interpreters and
+reports the median and best wall time, plus the slowest imports reported
+by `-X importtime` for a single run.
+
+    python bench/bench_startup.py -n 20
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'main.py')
+
+
+def time_startup(runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, MAIN, '--help'], stdout=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def slowest_imports(count):
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', MAIN, '--help'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative_us), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure CLI startup time.")
+    parser.add_argument('-n', '--runs', type=int, default=10, help="Number of runs (default: 10)")
+    parser.add_argument('--top', type=int, default=10, help="Slowest imports to list (default: 10)")
+    args = parser.parse_args()
+
+    timings = time_startup(args.runs)
+    print(f"main.py --help over {args.runs} runs: median {statistics.median(timings) * 1000:.1f} ms, best {min(timings) * 1000:.1f} ms")
+
+    print("\nSlowest imports (cumulative):")
+    for cumulative_us, name in slowest_imports(args.top):
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+"""
+Local stand-in for the Google Places and OpenAI APIs.
+
+Serves text search, place details and chat completions with the same
+response shapes as the real APIs, so the pipeline can be run end to end
+without network access or API spend. Latency, server errors, 429 bursts,
+pagination, the overlap between neighbouring searches and the share of
+sparse searches that only find a few results are configurable,
+and responses are deterministic for a given seed.
+
+With --sites N, place details point the businesses' websites at N local
+sites on their own loopback addresses (127.0.1.1, 127.0.1.2, ...), served
+by the same process, so website enrichment can be run against it too.
+Some sites only list their email on a contact page, and a configurable
+share of them fail, hang, send their pages a few bytes at a time or serve
+pages larger than the enrichment reads.
+
+    python bench/fake_server.py --port 8765 --latency 80 --error-rate 0.01
+    PLACES_API_URL=http://127.0.0.1:8765/maps/api/place \\
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 python src/main.py --state CA -n 10
+
+Request counters are served as JSON from /stats.
+
+    python bench/fake_server.py --sites 100 --site-hang-rate 0.05
+    python src/main.py --state CA -n 10 --enrich
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+PLACES_PATH = '/maps/api/place'
+PAGE_SIZE = 20
+
+NAME_WORDS = [
+    'Bright', 'Holiday', 'Lighting', 'Exterior', 'Contracting', 'Roofing', 'Gutter', 'Lawn', 'Pest', 'Plumbing',
+    'Electric', 'Pressure', 'Window', 'Fence', 'Patio', 'Pool', 'Solar', 'Security', 'Home', 'Residential',
+    'Metro', 'Summit', 'Valley', 'Coastal', 'Premier', 'Elite', 'Golden', 'Family', 'Quality', 'Northside',
+]
+NAME_SUFFIXES = ['LLC', 'Inc', 'Co', 'Services', 'Pros', 'Group', '& Sons', 'Experts', 'Solutions']
+
+# Loopback addresses of the local sites: 127.0.1.1 to 127.0.1.250, then 127.0.2.1 and so on
+SITES_PER_SUBNET = 250
+MAX_SITES = SITES_PER_SUBNET * 254
+# Sites listing their email only on their contact page
+CONTACT_PAGE_RATE = 0.3
+# Bytes a slow site sends each second
+SLOW_SITE_BYTES = 16
+# Filler repeated to make a large page, about 2 MB
+LARGE_PAGE_FILLER = '<p>Serving the whole metro area since 1998. Licensed, bonded and insured.</p>\n' * 28000
+
+
+class FakePlacesAPI:
+    """
+    Deterministic Places API with tunable failure modes.
+
+    Every search draws its results from a shared pool of places. A fraction
+    `overlap` of each page comes from a window shared with neighbouring
+    searches of the same state, so the pipeline sees the same place_ids and
+    businesses again, as it does for suburbs of one metro.
+    """
+
+    def __init__(self, latency=50, jitter=0.5, error_rate=0.0, over_limit_rate=0.0, burst_every=0, burst_length=0,
+                 pages=3, token_delay=2, overlap=0.3, pool_size=100000, no_phone_rate=0.1, sparse_rate=0.0, sites=0,
+                 site_latency=50, site_error_rate=0.0, site_hang_rate=0.0, site_slow_rate=0.0, site_large_rate=0.0, seed=0):
+        self.latency = latency / 1000
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.over_limit_rate = over_limit_rate
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.pages = pages
+        self.token_delay = token_delay
+        self.overlap = overlap
+        self.pool_size = pool_size
+        self.no_phone_rate = no_phone_rate
+        self.sparse_rate = sparse_rate
+        self.sites = min(sites, MAX_SITES)
+        self.site_latency = site_latency / 1000
+        self.site_error_rate = site_error_rate
+        self.site_hang_rate = site_hang_rate
+        self.site_slow_rate = site_slow_rate
+        self.site_large_rate = site_large_rate
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.started = time.monotonic()
+        self.tokens = {}
+        self.stats = Counter()
+
+    def _rng(self, *parts):
+        digest = hashlib.sha256('|'.join(str(part) for part in (self.seed, *parts)).encode('utf-8')).digest()
+        return random.Random(digest)
+
+    async def delay(self):
+        await asyncio.sleep(self.latency * (1 + self.jitter * (2 * self.rng.random() - 1)))
+
+    def failure(self, endpoint):
+        # Returns an error response for this request, or None to serve it normally
+        if self.burst_every:
+            # Every burst_every seconds, reject everything for burst_length seconds
+            if (time.monotonic() - self.started) % self.burst_every < self.burst_length:
+                self.stats[f'{endpoint}_429'] += 1
+                return web.json_response({'error_message': 'Rate limit exceeded'}, status=429)
+        if self.rng.random() < self.error_rate:
+            self.stats[f'{endpoint}_500'] += 1
+            return web.json_response({'error_message': 'Internal error'}, status=500)
+        if self.rng.random() < self.over_limit_rate:
+            self.stats[f'{endpoint}_over_query_limit'] += 1
+            return web.json_response({'status': 'OVER_QUERY_LIMIT', 'results': []})
+        return None
+
+    def place_id(self, index):
+        return f"fake-{index % self.pool_size}"
+
+    def place(self, index):
+        rng = self._rng('place', index % self.pool_size)
+        name = ' '.join(rng.sample(NAME_WORDS, rng.randint(1, 3)) + [rng.choice(NAME_SUFFIXES)])
+        return {
+            'place_id': self.place_id(index),
+            'name': name,
+            'rating': round(rng.uniform(3, 5), 1),
+            'user_ratings_total': rng.randint(0, 500),
+        }
+
+    def is_sparse(self, search):
+        # Decided per search rather than per request, like a small town always being small
+        return self._rng('sparse', search).random() < self.sparse_rate
+
+    def search_results(self, search, page):
+        # The shared window is keyed by the last word of the search, i.e. the
+        # state of "query in City, ST", so searches of one state overlap
+        rng = self._rng('search', search, page)
+        region = self._rng('region', search.split()[-1] if search else '').randrange(self.pool_size)
+        shared = int(PAGE_SIZE * self.overlap)
+        indices = [region + rng.randrange(PAGE_SIZE * self.pages * 4) for _ in range(shared)]
+        indices += [rng.randrange(self.pool_size) for _ in range(PAGE_SIZE - shared)]
+        if self.is_sparse(search):
+            indices = indices[:PAGE_SIZE // 5]
+        return [self.place(index) for index in indices]
+
+    async def textsearch(self, request):
+        self.stats['textsearch'] += 1
+        await self.delay()
+        failure = self.failure('textsearch')
+        if failure:
+            return failure
+
+        params = request.query
+        if 'pagetoken' in params:
+            token = self.tokens.get(params['pagetoken'])
+            # Like the real API, a token is rejected until it becomes valid
+            if token is None or time.monotonic() < token[2]:
+                self.stats['textsearch_invalid_token'] += 1
+                return web.json_response({'status': 'INVALID_REQUEST', 'results': []})
+            search, page = token[0], token[1]
+        elif 'query' in params:
+            search = params['query']
+            if 'location' in params:
+                search = f"{search} @ {params['location']} r{params.get('radius', '')}"
+            page = 1
+        else:
+            return web.json_response({'status': 'INVALID_REQUEST', 'error_message': 'Missing query', 'results': []})
+
+        body = {'status': 'OK', 'results': self.search_results(search, page)}
+        if page < self.pages and not self.is_sparse(search):
+            token = hashlib.sha256(f"{search}|{page}|{time.monotonic()}".encode('utf-8')).hexdigest()
+            self.tokens[token] = (search, page + 1, time.monotonic() + self.token_delay)
+            body['next_page_token'] = token
+        return web.json_response(body)
+
+    async def details(self, request):
+        self.stats['details'] += 1
+        await self.delay()
+        failure = self.failure('details')
+        if failure:
+            return failure
+
+        place_id = request.query.get('place_id', '')
+        if not place_id.startswith('fake-'):
+            return web.json_response({'status': 'NOT_FOUND'})
+        index = int(place_id[len('fake-'):])
+        rng = self._rng('details', index)
+        if self.sites:
+            result = {'website': f"http://{self.site_host(index % self.sites)}:{request.url.port}/"}
+        else:
+            result = {'website': f"https://example.com/{index}"}
+        if rng.random() >= self.no_phone_rate:
+            result['formatted_phone_number'] = f"({200 + index % 800}) {index // 10000 % 1000:03d}-{index % 10000:04d}"
+        return web.json_response({'status': 'OK', 'result': result})
+
+    async def chat_completions(self, request):
+        self.stats['chat_completions'] += 1
+        payload = await request.json()
+        await self.delay()
+        prompt = payload['messages'][-1]['content']
+        business_type = prompt.split("'")[1] if "'" in prompt else 'services'
+        content = (f"Enhanced Query: Residential {business_type.title()}\n"
+                   f"Keywords: {', '.join(word.lower() for word in NAME_WORDS[:15])}, exterior, contract")
+        return web.json_response({
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': payload.get('model', 'fake'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+        })
+
+    def site_hosts(self):
+        return [self.site_host(site) for site in range(self.sites)]
+
+    @staticmethod
+    def site_host(site):
+        return f"127.0.{1 + site // SITES_PER_SUBNET}.{1 + site % SITES_PER_SUBNET}"
+
+    async def site_page(self, request):
+        # The home and contact pages of the local site at the request's address
+        host = request.host.split(':')[0]
+        page = 'contact' if request.path.startswith('/contact') else 'home'
+        self.stats[f'site_{page}'] += 1
+        await asyncio.sleep(self.site_latency * (1 + self.jitter * (2 * self.rng.random() - 1)))
+
+        # Failure modes are decided per site, like a site that is down staying down
+        rng = self._rng('site', host)
+        if rng.random() < self.site_error_rate:
+            self.stats['site_500'] += 1
+            return web.Response(status=500, text='Internal Server Error')
+        if rng.random() < self.site_hang_rate:
+            self.stats['site_hang'] += 1
+            await asyncio.sleep(3600)
+        filler = LARGE_PAGE_FILLER if rng.random() < self.site_large_rate else ''
+        contact_only = rng.random() < CONTACT_PAGE_RATE
+        slow = rng.random() < self.site_slow_rate
+
+        name = f"site-{host.replace('.', '-')}"
+        email = f'<a href="mailto:info@{name}.example">info&#64;{name}.example</a>'
+        if page == 'contact':
+            body = f"<h1>Contact us</h1><p>Call or email {email}</p>"
+        else:
+            body = (
+                f'<img src="/img/logo@2x.png">'
+                f'<a href="https://www.facebook.com/{name}">Facebook</a> '
+                f'<a href="https://instagram.com/{name}/">Instagram</a> '
+                f'<a href="https://www.facebook.com/sharer/sharer.php?u=http://{host}/">Share</a>'
+                f"{filler}"
+                f'<footer>{"" if contact_only else email} <a href="/contact-us">Contact</a></footer>'
+            )
+        text = f"<html><head><title>{name}</title></head><body>{body}</body></html>"
+        if not slow:
+            return web.Response(text=text, content_type='text/html')
+
+        # Answers at once but sends the page a few bytes a second, never pausing long enough to time out a read
+        self.stats['site_slow'] += 1
+        response = web.StreamResponse(headers={'Content-Type': 'text/html'})
+        await response.prepare(request)
+        try:
+            for start in range(0, len(text), SLOW_SITE_BYTES):
+                await response.write(text[start:start + SLOW_SITE_BYTES].encode())
+                await asyncio.sleep(1)
+            await response.write_eof()
+        except ConnectionResetError:
+            # The client gave up on the page
+            pass
+        return response
+
+    async def stats_handler(self, request):
+        return web.json_response(dict(self.stats))
+
+
+def build_app(api):
+    app = web.Application()
+    app.router.add_get(f'{PLACES_PATH}/textsearch/json', api.textsearch)
+    app.router.add_get(f'{PLACES_PATH}/details/json', api.details)
+    app.router.add_post('/v1/chat/completions', api.chat_completions)
+    app.router.add_get('/stats', api.stats_handler)
+    app.router.add_get('/', api.site_page)
+    app.router.add_get('/contact-us', api.site_page)
+    return app
+
+
+def add_arguments(parser):
+    parser.add_argument('--latency', type=float, default=50, help="Mean response latency in ms (default: 50)")
+    parser.add_argument('--jitter', type=float, default=0.5, help="Latency jitter as a fraction of the mean (default: 0.5)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests failing with HTTP 500")
+    parser.add_argument('--over-limit-rate', type=float, default=0.0, help="Fraction of requests answered with OVER_QUERY_LIMIT")
+    parser.add_argument('--burst-every', type=float, default=0, help="Seconds between 429 bursts (default: no bursts)")
+    parser.add_argument('--burst-length', type=float, default=0, help="Length of each 429 burst in seconds")
+    parser.add_argument('--pages', type=int, default=3, help="Result pages per search (default: 3)")
+    parser.add_argument('--token-delay', type=float, default=2, help="Seconds before a next_page_token becomes valid (default: 2)")
+    parser.add_argument('--overlap', type=float, default=0.3, help="Fraction of results shared between searches of one state (default: 0.3)")
+    parser.add_argument('--no-phone-rate', type=float, default=0.1, help="Fraction of places without a phone number (default: 0.1)")
+    parser.add_argument('--sparse-rate', type=float, default=0.0, help="Fraction of searches returning a single short page (default: 0)")
+    parser.add_argument('--sites', type=int, default=0, help="Serve the businesses' websites on this many local sites (default: none)")
+    parser.add_argument('--site-latency', type=float, default=50, help="Mean website response latency in ms (default: 50)")
+    parser.add_argument('--site-error-rate', type=float, default=0.0, help="Fraction of sites failing with HTTP 500")
+    parser.add_argument('--site-hang-rate', type=float, default=0.0, help="Fraction of sites that never answer")
+    parser.add_argument('--site-slow-rate', type=float, default=0.0, help="Fraction of sites sending their pages a few bytes a second")
+    parser.add_argument('--site-large-rate', type=float, default=0.0, help="Fraction of sites with a 2 MB home page, the email at its end")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for generated data and failures")
+
+
+def api_from_args(args):
+    return FakePlacesAPI(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        over_limit_rate=args.over_limit_rate,
+        burst_every=args.burst_every,
+        burst_length=args.burst_length,
+        pages=args.pages,
+        token_delay=args.token_delay,
+        overlap=args.overlap,
+        no_phone_rate=args.no_phone_rate,
+        sparse_rate=args.sparse_rate,
+        sites=args.sites,
+        site_latency=args.site_latency,
+        site_error_rate=args.site_error_rate,
+        site_hang_rate=args.site_hang_rate,
+        site_slow_rate=args.site_slow_rate,
+        site_large_rate=args.site_large_rate,
+        seed=args.seed
+    )
+
+
+async def serve(api, host, port):
+    runner = web.AppRunner(build_app(api), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    for site_host in api.site_hosts():
+        await web.TCPSite(runner, site_host, port).start()
+    # Parsed by bench_pipeline.py to find the port when started with --port 0
+    print(f"Serving on http://{host}:{port}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Places and OpenAI APIs.")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765, help="Port to listen on, 0 picks a free one (default: 8765)")
+    add_arguments(parser)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(api_from_args(args), args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import Counter
+
+# Query parameters that must never end up in a cache key
+SECRET_PARAMS = {'key'}
+
+# Number of buffered writes flushed in one transaction
+COMMIT_INTERVAL = 100
+# Seconds to wait for another process sharing the cache to finish writing
+BUSY_TIMEOUT = 2
+
+
+def make_cache_key(endpoint, params):
+    normalized = {
+        name: str(value).strip().lower() if name == 'query' else str(value)
+        for name, value in (params or {}).items()
+        if name not in SECRET_PARAMS
+    }
+    payload = json.dumps([endpoint, sorted(normalized.items())], separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite-backed cache of Places API JSON responses.
+
+    Entries expire after a per-endpoint TTL and the least recently used
+    entries are evicted once the stored bodies exceed max_bytes. With
+    refresh=True lookups always miss but fresh responses are still stored.
+
+    Several processes can share the cache (--workers). The connection is in
+    autocommit mode, so no transaction is held while a city awaits its
+    requests: new entries and access times are buffered and written every
+    COMMIT_INTERVAL writes in one short transaction. A cache that stays
+    locked longer than BUSY_TIMEOUT is treated as a miss, and its buffered
+    writes are tried again at the next flush.
+    """
+
+    def __init__(self, path, ttl, max_bytes, refresh=False):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.refresh = refresh
+        self.stats = Counter()
+        # Key -> (endpoint, body, created_at) of entries not written yet
+        self.pending = {}
+        # Key -> last access of entries read since the last flush
+        self.accessed = {}
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                body TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, endpoint, params):
+        if self.refresh:
+            self.stats[(endpoint, 'misses')] += 1
+            return None
+
+        key = make_cache_key(endpoint, params)
+        row = self.pending.get(key)
+        if row is not None:
+            body, created_at = row[1], row[2]
+        else:
+            try:
+                row = self.conn.execute("SELECT body, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            except sqlite3.OperationalError as e:
+                logging.debug(f"Response cache lookup failed: {e}")
+                row = None
+            if row is not None:
+                body, created_at = row
+        now = time.time()
+        if row is None or now - created_at > self.ttl.get(endpoint, 0):
+            self.stats[(endpoint, 'misses')] += 1
+            return None
+
+        self.accessed[key] = now
+        if len(self.accessed) >= COMMIT_INTERVAL:
+            self.flush()
+        self.stats[(endpoint, 'hits')] += 1
+        return json.loads(body)
+
+    def set(self, endpoint, params, result):
+        key = make_cache_key(endpoint, params)
+        self.pending[key] = (endpoint, json.dumps(result, separators=(',', ':')), time.time())
+        if len(self.pending) >= COMMIT_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        # Writes the buffered entries and access times in one transaction
+        if not self.pending and not self.accessed:
+            return
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:
+            logging.debug(f"Response cache is busy, keeping {len(self.pending)} writes for later: {e}")
+            return
+        try:
+            for key, (endpoint, body, created_at) in self.pending.items():
+                previous = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, endpoint, body, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, endpoint, body, len(body), created_at, self.accessed.pop(key, created_at))
+                )
+                self.total_bytes += len(body) - (previous[0] if previous else 0)
+            self.conn.executemany("UPDATE responses SET accessed_at = ? WHERE key = ?",
+                                  [(accessed_at, key) for key, accessed_at in self.accessed.items()])
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+            self.conn.execute("COMMIT")
+        except sqlite3.OperationalError as e:
+            self.conn.execute("ROLLBACK")
+            logging.debug(f"Response cache write failed, keeping {len(self.pending)} writes for later: {e}")
+            self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            return
+        self.pending = {}
+        self.accessed = {}
+
+    def evict(self):
+        # Drop expired entries first, then least recently used ones down to 90% of the limit
+        now = time.time()
+        for endpoint, ttl in self.ttl.items():
+            self.conn.execute("DELETE FROM responses WHERE endpoint = ? AND created_at < ?", (endpoint, now - ttl))
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+        target = self.max_bytes * 0.9
+        stale_keys = []
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            if self.total_bytes <= target:
+                break
+            stale_keys.append((key,))
+            self.total_bytes -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", stale_keys)
+        evicted = len(stale_keys)
+        self.stats['evicted'] += evicted
+        logging.debug(f"Response cache evicted {evicted} entries, {self.total_bytes} bytes remaining")
+
+    def summary(self):
+        endpoints = sorted({key[0] for key in self.stats if isinstance(key, tuple)})
+        summary = {}
+        for endpoint in endpoints:
+            hits = self.stats[(endpoint, 'hits')]
+            misses = self.stats[(endpoint, 'misses')]
+            summary[endpoint] = {
+                'hits': hits,
+                'misses': misses,
+                'hit_ratio': hits / (hits + misses) if hits + misses else 0
+            }
+        return summary
+
+    def close(self):
+        self.flush()
+        if self.pending:
+            logging.warning(f"Response cache stayed busy, {len(self.pending)} responses were not cached")
+        self.conn.close()
+
+
+class ExpansionCache:
+    """
+    JSON file memoizing LLM query/keyword expansions.
+
+    Entries are keyed on the business type, the extra keywords, the prompt
+    version and the model, so changing any of them produces a fresh
+    expansion while re-runs of the same search get the same keywords.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as file:
+                    self.entries = json.load(file)
+            except (OSError, json.JSONDecodeError):
+                logging.warning(f"Ignoring unreadable expansion cache {path}")
+
+    @staticmethod
+    def make_key(business_type, additional_keywords, prompt_version, model):
+        extra = sorted({kw.strip().lower() for kw in (additional_keywords or '').split(',') if kw.strip()})
+        return json.dumps([business_type.strip().lower(), extra, prompt_version, model], separators=(',', ':'))
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        return entry['enhanced_query'], entry['keywords']
+
+    def set(self, key, enhanced_query, keywords):
+        self.entries[key] = {'enhanced_query': enhanced_query, 'keywords': keywords, 'created_at': time.time()}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.part"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.entries, file, indent=2)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,176 @@
+import bisect
+import json
+import logging
+import os
+import struct
+import time
+from array import array
+
+from config import CACHE_DIR
+
+INDEX_PATH = os.path.join(CACHE_DIR, 'us_cities.idx')
+INDEX_MAGIC = b'LGCITY1\n'
+INDEX_VERSION = 1
+
+
+def build_city_index(path=INDEX_PATH):
+    """
+    Build the US city index from GeonamesCache and write it to path.
+
+    The file holds a small JSON header followed by three packed arrays
+    (population, latitude, longitude) and the newline-separated city names.
+    Cities are grouped by state and sorted by descending population, so
+    each state is a contiguous slice described by (start, count).
+    """
+    from geonamescache import GeonamesCache
+
+    start_time = time.time()
+    by_state = {}
+    for city_info in GeonamesCache().get_cities().values():
+        if city_info['countrycode'] == 'US':
+            by_state.setdefault(city_info['admin1code'], []).append(city_info)
+
+    states = {}
+    names = []
+    populations = array('q')
+    latitudes = array('d')
+    longitudes = array('d')
+    for state in sorted(by_state):
+        cities = sorted(by_state[state], key=lambda c: (-c['population'], c['name']))
+        states[state] = [len(names), len(cities)]
+        for city_info in cities:
+            names.append(city_info['name'])
+            populations.append(city_info['population'])
+            latitudes.append(float(city_info['latitude']))
+            longitudes.append(float(city_info['longitude']))
+
+    header = json.dumps({
+        'version': INDEX_VERSION,
+        'source': _source_version(),
+        'count': len(names),
+        'states': states,
+    }).encode('utf-8')
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.part"
+    with open(temp_path, 'wb') as file:
+        file.write(INDEX_MAGIC)
+        file.write(struct.pack('<I', len(header)))
+        file.write(header)
+        file.write(populations.tobytes())
+        file.write(latitudes.tobytes())
+        file.write(longitudes.tobytes())
+        file.write('\n'.join(names).encode('utf-8'))
+    os.replace(temp_path, path)
+    logging.debug(f"Built city index with {len(names)} cities in {time.time() - start_time:.2f} seconds")
+
+
+def _source_version():
+    try:
+        from importlib.metadata import version
+        return version('geonamescache')
+    except Exception:
+        return None
+
+
+class CityIndex:
+    """Read-only view over a city index file built by build_city_index."""
+
+    def __init__(self, path=INDEX_PATH):
+        with open(path, 'rb') as file:
+            data = file.read()
+        if not data.startswith(INDEX_MAGIC):
+            raise ValueError(f"Not a city index file: {path}")
+
+        offset = len(INDEX_MAGIC)
+        (header_length,) = struct.unpack_from('<I', data, offset)
+        offset += 4
+        header = json.loads(data[offset:offset + header_length])
+        offset += header_length
+        if header['version'] != INDEX_VERSION:
+            raise ValueError(f"Unsupported city index version {header['version']}")
+
+        count = header['count']
+        self.source = header['source']
+        self.states = {state: tuple(span) for state, span in header['states'].items()}
+        self.populations = array('q')
+        self.populations.frombytes(data[offset:offset + count * 8])
+        offset += count * 8
+        self.latitudes = array('d')
+        self.latitudes.frombytes(data[offset:offset + count * 8])
+        offset += count * 8
+        self.longitudes = array('d')
+        self.longitudes.frombytes(data[offset:offset + count * 8])
+        offset += count * 8
+        self.names = data[offset:].decode('utf-8').split('\n') if count else []
+        self._positions = None
+
+    def _span(self, state, min_population):
+        start, count = self.states.get(state, (0, 0))
+        # Populations are sorted descending, so the floor is a binary search;
+        # bisect_right keeps cities whose population equals the floor
+        end = bisect.bisect_right(self.populations, -min_population, start, start + count, key=lambda p: -p)
+        return start, end
+
+    def top_cities(self, state, num_cities=None, min_population=0):
+        # Returns (name, population) for the largest cities of a state
+        start, end = self._span(state, min_population)
+        if num_cities is not None:
+            end = min(end, start + num_cities)
+        return [(self.names[i], self.populations[i]) for i in range(start, end)]
+
+    def cities_with_coordinates(self, state, num_cities=None, min_population=0):
+        # Returns (name, population, latitude, longitude) for the largest cities of a state
+        start, end = self._span(state, min_population)
+        if num_cities is not None:
+            end = min(end, start + num_cities)
+        return [
+            (self.names[i], self.populations[i], self.latitudes[i], self.longitudes[i])
+            for i in range(start, end)
+        ]
+
+    def _position(self, city, state):
+        if self._positions is None:
+            self._positions = {}
+            for state_abbr, (start, count) in self.states.items():
+                for i in range(start, start + count):
+                    # Keep the most populous city when names repeat within a state
+                    self._positions.setdefault((self.names[i].lower(), state_abbr), i)
+        return self._positions.get((city.strip().lower(), state.strip().upper()))
+
+    def coordinates(self, city, state):
+        i = self._position(city, state)
+        if i is None:
+            return None
+        return self.latitudes[i], self.longitudes[i]
+
+    def population(self, city, state):
+        i = self._position(city, state)
+        return self.populations[i] if i is not None else None
+
+
+_city_index = None
+
+
+def get_city_index(path=INDEX_PATH):
+    # Loads the index on first use, building it if it is missing or stale
+    global _city_index
+    if _city_index is None:
+        index = None
+        if os.path.exists(path):
+            try:
+                index = CityIndex(path)
+                if index.source != _source_version():
+                    index = None
+            except (ValueError, KeyError, struct.error):
+                index = None
+        if index is None:
+            build_city_index(path)
+            index = CityIndex(path)
+        _city_index = index
+    return _city_index
+
+
+if __name__ == '__main__':
+    build_city_index()
+    print(f"City index written to {INDEX_PATH}")
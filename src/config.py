@@ -4,7 +4,79 @@ import os
 GOOGLE_PLACES_API_KEY = os.environ.get('GOOGLE_PLACES_API_KEY')
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
 
+# API endpoints, overridable to point at a local stand-in (see bench/fake_server.py)
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL')
+
 # Constants
 BUSINESS_TYPE = "Lighting and Holiday"
 MAX_RETRIES = 3
-BACKOFF_TIME = 2
\ No newline at end of file
+BACKOFF_TIME = 2
+
+# Places API request scheduling
+PLACES_API_URL = os.environ.get('PLACES_API_URL', "https://maps.googleapis.com/maps/api/place")
+MAX_IN_FLIGHT = 20
+TEXTSEARCH_QPS = 10
+DETAILS_QPS = 50
+REQUEST_TIMEOUT = 30
+DETAILS_PER_CITY = 10
+
+# Local storage
+LEADS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'leads')
+CACHE_DIR = os.path.join(LEADS_DIR, '.cache')
+
+# Places API response cache
+CACHE_ENABLED = True
+CACHE_TTL = {
+    'textsearch': 24 * 60 * 60,
+    'details': 7 * 24 * 60 * 60,
+    # Contact emails and social links found on a lead's website, per domain
+    'website': 30 * 24 * 60 * 60,
+}
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Run journals used by --resume
+RUNS_DIR = os.path.join(LEADS_DIR, 'runs')
+
+# Cross-run store of valid leads, used to write only the new ones
+LEAD_STORE_ENABLED = True
+LEAD_STORE_PATH = os.path.join(LEADS_DIR, 'leads.sqlite')
+
+# Yield-aware planning: the share of a city's leads a second search is
+# expected to find again as new, and the completed cities over which the
+# marginal yield is measured for --min-yield
+REPEAT_SEARCH_NEW_SHARE = 0.1
+YIELD_WINDOW = 20
+
+# Format of the leads files: 'csv', 'jsonl.gz' or 'parquet' (needs pyarrow)
+OUTPUT_FORMAT = 'csv'
+
+# Website enrichment (--enrich): connections overall and per host, the
+# timeout in seconds for each page, how much of a page is read and how many
+# searched cities may wait for their websites before searching pauses
+ENRICH_ENABLED = False
+ENRICH_MAX_CONNECTIONS = 50
+ENRICH_PER_HOST = 2
+ENRICH_TIMEOUT = 10
+ENRICH_MAX_BYTES = 512 * 1024
+ENRICH_MAX_PENDING_CITIES = 50
+
+# Text search pagination
+MAX_PAGES = 1
+PAGE_TOKEN_DELAY = 2
+PAGE_TOKEN_RETRIES = 3
+
+# Grid search mode
+GRID_POPULATION_PER_CELL = 150000
+GRID_MAX_CELL_KM = 60
+GRID_MIN_CELL_KM = 2
+# Half the width of the square a city covers, in km per square root of its
+# population (about 20 km for 2.3 million people, 3 km for 50,000), capped
+GRID_KM_PER_SQRT_POPULATION = 0.013
+GRID_MAX_CITY_KM = 40
+
+# Places API list prices in USD per 1000 requests, for cost estimates.
+# Details requests include the contact fields (phone, website).
+PLACES_COST_PER_1000 = {
+    'textsearch': 32.0,
+    'details': 20.0,
+}
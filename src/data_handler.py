@@ -1,14 +1,183 @@
 import csv
+import json
+import os
+from collections import Counter
+
+from dedup import DuplicateIndex, canonical_name, normalize_phone
+from formats import LEAD_FIELDS, format_for
+
+# Rows buffered before they are written and flushed to disk
+WRITE_BATCH_SIZE = 100
 
 def save_to_csv(data, filename):
     with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
         if data:  # Check if data is not empty
-            writer = csv.DictWriter(csvfile, fieldnames=data[0].keys())
+            writer = csv.DictWriter(csvfile, fieldnames=LEAD_FIELDS, extrasaction='ignore')
             writer.writeheader()
             for row in data:
                 writer.writerow(row)
-    
+
     print(f"Data saved to {filename}")
 
+def lead_identifier(lead):
+    # Two rows describe the same lead if they share a canonical name and phone number
+    return (canonical_name(lead['NAME']), normalize_phone(lead['PHONE']))
+
+def deduplicate_businesses(businesses):
+    # Keeps the first of each group of near-duplicates, see dedup.DuplicateIndex
+    index = DuplicateIndex()
+    return [business for business in businesses if not index.check(business)]
+
+class LeadWriter:
+    """
+    Streams lead rows to a file as cities complete.
+
+    The format (CSV, JSONL.gz or Parquet, see formats.py) follows from the
+    file name's extension. Rows are deduplicated on lead_identifier,
+    buffered and flushed in batches to a `.part` file next to the
+    destination, which is renamed into place when the writer is closed.
+    Only the identifiers seen so far are kept in memory, never the rows
+    themselves. on_row is called with every row kept, e.g. LeadStats.add.
+
+    With append=True an existing file (finalized or `.part`) is reopened
+    and its rows are read back so deduplication continues across restarts.
+    """
+
+    def __init__(self, filename, batch_size=WRITE_BATCH_SIZE, append=False, on_row=None):
+        self.filename = filename
+        self.temp_filename = f"{filename}.part"
+        self.format = format_for(filename)
+        self.batch_size = batch_size
+        self.on_row = on_row
+        self.seen = set()
+        self.pending = []
+        self.rows_written = 0
+        self.reasons = Counter()
+
+        if append and not os.path.exists(self.temp_filename) and os.path.exists(self.filename):
+            os.replace(self.filename, self.temp_filename)
+        append = append and os.path.exists(self.temp_filename)
+        if append:
+            self.format.recover(self.temp_filename)
+            self._load_existing()
+        self.output = self.format(self.temp_filename, append=append)
+
+    def _load_existing(self):
+        for row in self.format.read_rows(self.temp_filename):
+            self.seen.add(lead_identifier(row))
+            self.reasons[row.get('REASON') or ''] += 1
+            self.rows_written += 1
+            if self.on_row:
+                self.on_row(row)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, rows):
+        for row in rows:
+            identifier = lead_identifier(row)
+            if identifier in self.seen:
+                continue
+            self.seen.add(identifier)
+            self.pending.append(row)
+            self.reasons[row.get('REASON', '')] += 1
+            if self.on_row:
+                self.on_row(row)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.output.write_rows(self.pending)
+            self.rows_written += len(self.pending)
+            self.pending = []
+        self.output.flush()
+
+    def close(self):
+        if self.output is None:
+            return
+        self.flush()
+        self.output.close()
+        self.output = None
+        os.replace(self.temp_filename, self.filename)
+
+
+class LeadStats:
+    """
+    Per-city and per-state aggregates of the leads written for a run.
+
+    Updated row by row as the lead writers keep rows (pass add, or add_new
+    for the new leads file, as their on_row), so the sidecar summary never
+    needs a rescan of the output. Reopened writers replay their existing
+    rows, which rebuilds the aggregates on resume.
+    """
+
+    def __init__(self):
+        self.cities = {}
+
+    def _city(self, location):
+        aggregate = self.cities.get(location)
+        if aggregate is None:
+            aggregate = self.cities[location] = _merged([])
+        return aggregate
+
+    def add(self, row):
+        aggregate = self._city(row['STATE/CITY'])
+        reason = row.get('REASON') or ''
+        if reason:
+            aggregate['invalid_leads'] += 1
+            aggregate['reasons'][reason] += 1
+            return
+        aggregate['valid_leads'] += 1
+        if row.get('WEBSITE') not in (None, '', 'N/A'):
+            aggregate['with_website'] += 1
+        if row.get('RATING') not in (None, '', 'N/A'):
+            aggregate['rated'] += 1
+            aggregate['rating_sum'] += float(row['RATING'])
+        if row.get('REVIEWS') not in (None, '', 'N/A'):
+            aggregate['total_reviews'] += int(float(row['REVIEWS']))
+
+    def add_new(self, row):
+        self._city(row['STATE/CITY'])['new_leads'] += 1
+
+    def summary(self):
+        # {'totals': ..., 'states': {state: ...}, 'cities': {"ST, City": ...}}
+        states = {}
+        for location, aggregate in self.cities.items():
+            states.setdefault(location.split(',')[0].strip(), []).append(aggregate)
+        return {
+            'totals': _finished(_merged(self.cities.values())),
+            'states': {state: _finished(_merged(aggregates)) for state, aggregates in sorted(states.items())},
+            'cities': {location: _finished(aggregate) for location, aggregate in sorted(self.cities.items())},
+        }
+
+    def write(self, path, **extra):
+        # Replaced atomically, so readers never see a partial file
+        temp_path = f"{path}.part"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({**extra, **self.summary()}, file, indent=2)
+        os.replace(temp_path, path)
+
+
+def _merged(aggregates):
+    # Sum of city aggregates; an empty one for no aggregates
+    merged = {'valid_leads': 0, 'new_leads': 0, 'invalid_leads': 0, 'with_website': 0, 'rated': 0,
+              'rating_sum': 0.0, 'total_reviews': 0, 'reasons': Counter()}
+    for aggregate in aggregates:
+        for name, value in aggregate.items():
+            merged[name] += value
+    return merged
+
+
+def _finished(aggregate):
+    # Drops the running sum in favour of the average it was kept for
+    finished = {name: value for name, value in aggregate.items() if name != 'rating_sum'}
+    finished['avg_rating'] = round(aggregate['rating_sum'] / aggregate['rated'], 3) if aggregate['rated'] else None
+    finished['reasons'] = dict(sorted(aggregate['reasons'].items()))
+    return finished
+
 # Add this line to make the function available for import
-__all__ = ['save_to_csv'];
\ No newline at end of file
+__all__ = ['save_to_csv', 'lead_identifier', 'deduplicate_businesses', 'LeadWriter', 'LeadStats', 'LEAD_FIELDS'];
@@ -0,0 +1,138 @@
+import re
+
+# Trailing words that don't tell two businesses apart
+LEGAL_SUFFIXES = {
+    'llc', 'inc', 'incorporated', 'corp', 'corporation', 'co', 'company', 'ltd', 'limited',
+    'lp', 'llp', 'pllc', 'pc', 'pa', 'plc',
+}
+
+# Trigram similarity needed for two names to match, on their own in the
+# same city, or when both leads share a phone number
+NAME_THRESHOLD = 0.8
+PHONE_NAME_THRESHOLD = 0.4
+
+# Blocks bigger than this stop growing, so a word shared by thousands of
+# businesses ('lighting') doesn't turn every lookup into a scan
+MAX_BLOCK_SIZE = 64
+
+
+def normalize_phone(phone):
+    # Digits only, without the US country code; '' for missing numbers
+    digits = re.sub(r'\D', '', phone or '')
+    if len(digits) == 11 and digits.startswith('1'):
+        digits = digits[1:]
+    return digits
+
+
+def canonical_name(name):
+    # "The A.B.C. Lighting & Decor, LLC" -> "abc lighting and decor"
+    name = (name or '').lower().replace('&', ' and ')
+    name = re.sub(r"[.'’]", '', name)
+    words = re.sub(r'[^a-z0-9]+', ' ', name).split()
+    while len(words) > 1 and words[-1] in LEGAL_SUFFIXES:
+        words.pop()
+    if len(words) > 1 and words[0] == 'the':
+        words.pop(0)
+    return ' '.join(words)
+
+
+def lead_key(lead):
+    # (canonical name, normalized phone, location) used for duplicate detection
+    return (canonical_name(lead['NAME']), normalize_phone(lead['PHONE']), lead['STATE/CITY'].strip().lower())
+
+
+def trigrams(name):
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(grams_a, grams_b):
+    if not grams_a or not grams_b:
+        return 0
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+
+def _matches(key_a, grams_a, key_b, grams_b):
+    name_a, phone_a, location_a = key_a
+    name_b, phone_b, location_b = key_b
+    if phone_a and phone_a == phone_b:
+        # Same number: only a completely different name (a shared call centre) keeps them apart
+        return name_a == name_b or similarity(grams_a, grams_b) >= PHONE_NAME_THRESHOLD
+    if phone_a and phone_b:
+        # Different numbers are different branches, however similar the names
+        return False
+    return location_a == location_b and (name_a == name_b or similarity(grams_a, grams_b) >= NAME_THRESHOLD)
+
+
+def same_business(a, b):
+    key_a, key_b = lead_key(a), lead_key(b)
+    return _matches(key_a, trigrams(key_a[0]), key_b, trigrams(key_b[0]))
+
+
+class DuplicateIndex:
+    """
+    Incremental near-duplicate detector for leads.
+
+    Names are canonicalized (case, punctuation and legal suffixes removed)
+    and phones reduced to digits. Instead of comparing a lead with every
+    earlier one, candidates come from three indexes: the same phone, the
+    same canonical name in the same location, and blocks of leads in the
+    same location sharing a name word. Candidates are then compared by
+    name trigram similarity, so the cost per lead stays roughly constant.
+    """
+
+    def __init__(self, max_block_size=MAX_BLOCK_SIZE):
+        self.max_block_size = max_block_size
+        self.keys = []
+        self.grams = []
+        self.by_phone = {}
+        self.by_name = {}
+        self.blocks = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _candidates(self, key):
+        name, phone, location = key
+        if phone:
+            yield from self.by_phone.get(phone, ())
+        yield from self.by_name.get((location, name), ())
+        for word in set(name.split()):
+            yield from self.blocks.get((location, word), ())
+
+    def find_key(self, key):
+        # Returns the position of an earlier lead matching key, or None
+        grams = trigrams(key[0])
+        checked = set()
+        for candidate in self._candidates(key):
+            if candidate in checked:
+                continue
+            checked.add(candidate)
+            if _matches(key, grams, self.keys[candidate], self.grams[candidate]):
+                return candidate
+        return None
+
+    def add_key(self, key):
+        name, phone, location = key
+        position = len(self.keys)
+        self.keys.append(key)
+        self.grams.append(trigrams(name))
+        if phone:
+            self.by_phone.setdefault(phone, []).append(position)
+        self.by_name.setdefault((location, name), []).append(position)
+        for word in set(name.split()):
+            block = self.blocks.setdefault((location, word), [])
+            if len(block) < self.max_block_size:
+                block.append(position)
+        return position
+
+    def find(self, lead):
+        return self.find_key(lead_key(lead))
+
+    def check(self, lead):
+        # Returns True if lead duplicates an earlier one, otherwise remembers it
+        key = lead_key(lead)
+        if self.find_key(key) is not None:
+            return True
+        self.add_key(key)
+        return False
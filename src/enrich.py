@@ -0,0 +1,243 @@
+import asyncio
+import html
+import logging
+import re
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urljoin, urlsplit
+
+from config import ENRICH_MAX_BYTES, ENRICH_MAX_CONNECTIONS, ENRICH_PER_HOST, ENRICH_TIMEOUT
+
+EMAIL_PATTERN = re.compile(r'[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}')
+# Asset names such as logo@2x.png look like emails
+NOT_EMAIL_SUFFIXES = ('.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp', '.css', '.js')
+MAX_EMAILS = 5
+
+SOCIAL_PATTERN = re.compile(
+    r'https?://(?:www\.|m\.)?(facebook|instagram|linkedin|twitter|x|youtube|tiktok)\.com/[^\s"\'<>?#]+',
+    re.IGNORECASE
+)
+# Share buttons and widgets link to the network rather than to the business
+SOCIAL_IGNORED_PATHS = {'sharer', 'sharer.php', 'share', 'intent', 'plugins', 'dialog', 'login', 'home'}
+
+CONTACT_LINK_PATTERN = re.compile(r'href=["\']([^"\']*contact[^"\']*)["\']', re.IGNORECASE)
+HTML_TYPES = ('text/html', 'application/xhtml+xml')
+CHUNK_SIZE = 16 * 1024
+USER_AGENT = 'Mozilla/5.0 (compatible; LeadGenScript)'
+
+
+def website_domain(url):
+    # The domain results are kept under: the host name, lowercased and without www.
+    if not url or url == 'N/A':
+        return None
+    if '://' not in url:
+        url = f"http://{url}"
+    try:
+        host = (urlsplit(url).hostname or '').lower()
+    except ValueError:
+        return None
+    return host[len('www.'):] if host.startswith('www.') else host or None
+
+
+def extract_emails(text):
+    emails = []
+    for match in EMAIL_PATTERN.finditer(text):
+        email = match.group(0).strip('.').lower()
+        if email.endswith(NOT_EMAIL_SUFFIXES) or email in emails:
+            continue
+        emails.append(email)
+        if len(emails) >= MAX_EMAILS:
+            break
+    return emails
+
+
+def extract_social(text):
+    # The first profile link found for each network
+    links = {}
+    for match in SOCIAL_PATTERN.finditer(text):
+        network = match.group(1).lower()
+        url = match.group(0).rstrip('/')
+        path = urlsplit(url).path.strip('/').lower()
+        if not path or path.split('/')[0] in SOCIAL_IGNORED_PATHS:
+            continue
+        links.setdefault('twitter' if network == 'x' else network, url)
+    return list(links.values())
+
+
+def contact_link(text, page_url):
+    # A link to a contact page on the same site, or None
+    host = urlsplit(page_url).hostname
+    for match in CONTACT_LINK_PATTERN.finditer(text):
+        url = urljoin(page_url, match.group(1))
+        if url.startswith(('http://', 'https://')) and urlsplit(url).hostname == host and url != page_url:
+            return url
+    return None
+
+
+def empty_result():
+    return {'emails': [], 'social': []}
+
+
+class WebsiteEnricher:
+    """
+    Looks up contact emails and social profile links on lead websites.
+
+    Pages are fetched over one pooled HTTP session, at most max_connections
+    at a time and per_host for any one host. Once it has a connection slot,
+    a page gets timeout seconds in all, so a site that sends slowly can't
+    hold a slot for long, and only the first max_bytes of an HTML page are
+    read. When the home page shows no email, one link to a contact page on
+    the same site is followed, so a site takes at most twice the timeout.
+
+    Results are kept per domain, so leads sharing a website share one
+    lookup, and with a ResponseCache they are reused by later runs (endpoint
+    'website'). Sites that could not be reached, timed out or answered with
+    a server error are not cached, so a later run tries them again.
+    """
+
+    def __init__(self, cache=None, max_connections=ENRICH_MAX_CONNECTIONS, per_host=ENRICH_PER_HOST,
+                 timeout=ENRICH_TIMEOUT, max_bytes=ENRICH_MAX_BYTES, metrics=None):
+        self.cache = cache
+        self.max_connections = max_connections
+        self.per_host = per_host
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.metrics = metrics
+        self.session = None
+        # Connection slots overall and per host; waiting for one doesn't count towards the timeout
+        self.connections = None
+        self.hosts = defaultdict(lambda: asyncio.Semaphore(self.per_host))
+        # Domain -> future of its result, shared by every lead with a website there
+        self.domains = {}
+        self.stats = Counter()
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def open(self):
+        import aiohttp
+
+        self.connections = asyncio.Semaphore(self.max_connections)
+        connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.per_host, ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            # fetch_page() bounds each page as a whole
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout),
+            headers={'User-Agent': USER_AGENT}
+        )
+
+    async def close(self):
+        for future in self.domains.values():
+            future.cancel()
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def enrich(self, leads):
+        # Sets EMAIL and SOCIAL ('; '-separated, '' when nothing was found) on each lead
+        results = await asyncio.gather(*(self.lookup(lead.get('WEBSITE')) for lead in leads))
+        for lead, result in zip(leads, results):
+            lead['EMAIL'] = '; '.join(result['emails'])
+            lead['SOCIAL'] = '; '.join(result['social'])
+            self.stats['leads'] += 1
+            self.stats['leads_with_email'] += bool(result['emails'])
+
+    async def lookup(self, url):
+        domain = website_domain(url)
+        if not domain:
+            return empty_result()
+        future = self.domains.get(domain)
+        if future is None:
+            future = asyncio.ensure_future(self.fetch_site(domain, url))
+            self.domains[domain] = future
+        else:
+            self.stats['shared'] += 1
+        # One lead's enrichment being cancelled must not cancel the lookup for the others
+        return await asyncio.shield(future)
+
+    async def fetch_site(self, domain, url):
+        # Never raises: sites that fail yield an empty, uncached result
+        import aiohttp
+
+        fetch_errors = (aiohttp.ClientError, asyncio.TimeoutError, ValueError)
+        if self.cache:
+            cached = self.cache.get('website', {'domain': domain})
+            if cached is not None:
+                self.stats['cached'] += 1
+                return cached
+
+        if '://' not in url:
+            url = f"http://{url}"
+        start_time = time.monotonic()
+        try:
+            page = await self.fetch_page(url)
+        except fetch_errors as e:
+            self.stats['failed'] += 1
+            logging.debug(f"Could not fetch {url}: {type(e).__name__} {e}")
+            self.observe(start_time, 'failed')
+            return empty_result()
+
+        result = empty_result()
+        if page:
+            page_url, text = page
+            result = {'emails': extract_emails(text), 'social': extract_social(text)}
+            contact_url = None if result['emails'] else contact_link(text, page_url)
+            if contact_url:
+                try:
+                    contact_page = await self.fetch_page(contact_url)
+                except fetch_errors as e:
+                    logging.debug(f"Could not fetch {contact_url}: {type(e).__name__} {e}")
+                    contact_page = None
+                if contact_page:
+                    result['emails'] = extract_emails(contact_page[1])
+                    result['social'] += [link for link in extract_social(contact_page[1]) if link not in result['social']]
+        self.stats['fetched'] += 1
+        self.observe(start_time, 'ok')
+        if self.cache:
+            self.cache.set('website', {'domain': domain}, result)
+        return result
+
+    async def fetch_page(self, url):
+        # Returns (final url, text) of an HTML page, None for pages that won't
+        # become useful on a retry, and raises for ones that might
+        self.stats['pages'] += 1
+        async with self.connections, self.hosts[urlsplit(url).hostname]:
+            try:
+                return await asyncio.wait_for(self.read_page(url), self.timeout)
+            except asyncio.TimeoutError:
+                self.stats['timed_out'] += 1
+                raise
+
+    async def read_page(self, url):
+        async with self.session.get(url, max_redirects=5) as response:
+            if response.status >= 500 or response.status == 429:
+                response.raise_for_status()
+            content_type = response.headers.get('Content-Type', '').lower()
+            if response.status != 200 or not content_type.startswith(HTML_TYPES):
+                self.stats['not_html'] += 1
+                return None
+
+            body = bytearray()
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                body += chunk
+                if len(body) >= self.max_bytes:
+                    self.stats['truncated'] += 1
+                    del body[self.max_bytes:]
+                    break
+            try:
+                text = body.decode(response.charset or 'utf-8', errors='replace')
+            except LookupError:
+                text = body.decode('utf-8', errors='replace')
+            # Emails are often written as entities, e.g. info&#64;example.com
+            return str(response.url), html.unescape(text)
+
+    def observe(self, start_time, status):
+        if self.metrics:
+            self.metrics.observe('website_seconds', time.monotonic() - start_time, status=status)
+
+    def summary(self):
+        return dict(self.stats)
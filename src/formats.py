@@ -0,0 +1,226 @@
+import csv
+import gzip
+import json
+import os
+
+# Columns of the good and bad leads files and the type each is written as
+# by the typed formats. Missing values ('N/A' in the CSV) are written as null.
+LEAD_SCHEMA = [
+    ('NAME', str),
+    ('PHONE', str),
+    ('WEBSITE', str),
+    ('STATE/CITY', str),
+    ('RATING', float),
+    ('REVIEWS', int),
+    ('REASON', str),
+    ('KEYWORD', str),
+    # Filled in by website enrichment (--enrich), '' when it found nothing
+    ('EMAIL', str),
+    ('SOCIAL', str),
+]
+LEAD_FIELDS = [name for name, _ in LEAD_SCHEMA]
+
+# Rows per Parquet row group
+PARQUET_ROW_GROUP_SIZE = 10000
+
+
+def typed_row(row):
+    typed = {}
+    for name, kind in LEAD_SCHEMA:
+        value = row.get(name)
+        if value is None or value == 'N/A' or (value == '' and kind is not str):
+            typed[name] = None
+        else:
+            typed[name] = kind(float(value)) if kind is int else kind(value)
+    return typed
+
+
+class CsvFormat:
+    """
+    Plain CSV with 'N/A' for missing values, the historical output format.
+    """
+    extension = '.csv'
+
+    def __init__(self, path, append=False):
+        header = None
+        if append:
+            # Appended rows follow the existing header, which may predate newer columns
+            with open(path, newline='', encoding='utf-8') as file:
+                header = next(csv.reader(file), None)
+        self.file = open(path, 'a' if append else 'w', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.file, fieldnames=header or LEAD_FIELDS, extrasaction='ignore')
+        if not header:
+            # On disk right away, so a run killed before its first flush leaves a file it can resume
+            self.writer.writeheader()
+            self.flush()
+
+    @staticmethod
+    def recover(path):
+        # Drop a row torn by a crash mid-write so appended rows start on a new line
+        with open(path, 'rb+') as file:
+            content = file.read()
+            if content and not content.endswith(b'\n'):
+                file.truncate(content.rfind(b'\n') + 1)
+
+    @staticmethod
+    def read_rows(path):
+        with open(path, newline='', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                if row.get('NAME') is not None and row.get('PHONE') is not None:
+                    yield row
+
+    def write_rows(self, rows):
+        self.writer.writerows({name: 'N/A' if value is None else value for name, value in row.items()} for row in rows)
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+class JsonlGzFormat:
+    """
+    Gzip-compressed JSON lines with typed values (see LEAD_SCHEMA).
+
+    Each flush ends a deflate block, so everything flushed can be read back
+    after a crash. Resuming appends a new gzip member, which readers such
+    as gzip.open and zcat treat as one stream.
+    """
+    extension = '.jsonl.gz'
+
+    def __init__(self, path, append=False):
+        self.file = gzip.open(path, 'ab' if append else 'wb')
+
+    @staticmethod
+    def recover(path):
+        # Keep the rows that can still be decompressed and rewrite the file with them
+        rows = list(JsonlGzFormat.read_rows(path))
+        temp_path = f"{path}.recover"
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as file:
+            for row in rows:
+                file.write(json.dumps(row) + '\n')
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def read_rows(path):
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            try:
+                for line in file:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final line from a crash mid-write
+                        return
+            except (EOFError, gzip.BadGzipFile):
+                return
+
+    def write_rows(self, rows):
+        self.file.write(''.join(json.dumps(typed_row(row)) + '\n' for row in rows).encode('utf-8'))
+
+    def flush(self):
+        self.file.flush()
+        self.file.fileobj.flush()
+        os.fsync(self.file.fileobj.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetFormat:
+    """
+    Parquet with a fixed typed schema, written with pyarrow.
+
+    A Parquet file is unreadable until its footer is written, so rows are
+    staged in a JSONL.gz file next to it while the run is in progress and
+    converted in row groups when the writer is closed. That keeps crash
+    recovery and resuming the same as for the other formats.
+    """
+    extension = '.parquet'
+
+    def __init__(self, path, append=False):
+        # Fail before the run starts rather than when it finishes
+        import pyarrow  # noqa: F401
+
+        self.path = path
+        self.staging = JsonlGzFormat(self.staging_path(path), append=append and os.path.exists(self.staging_path(path)))
+        # Stands in for the file until it is converted, so a crashed run's staged rows are found on resume
+        open(path, 'ab').close()
+
+    @staticmethod
+    def staging_path(path):
+        return f"{path}.jsonl.gz"
+
+    @staticmethod
+    def schema():
+        import pyarrow as pa
+
+        types = {str: pa.string(), float: pa.float64(), int: pa.int64()}
+        return pa.schema([(name, types[kind]) for name, kind in LEAD_SCHEMA])
+
+    @staticmethod
+    def recover(path):
+        staging_path = ParquetFormat.staging_path(path)
+        if os.path.exists(staging_path):
+            JsonlGzFormat.recover(staging_path)
+            return
+        # A finished file being reopened: stage its rows again
+        with gzip.open(staging_path, 'wt', encoding='utf-8') as file:
+            for row in ParquetFormat._read_parquet(path):
+                file.write(json.dumps(row) + '\n')
+
+    @staticmethod
+    def read_rows(path):
+        staging_path = ParquetFormat.staging_path(path)
+        if os.path.exists(staging_path):
+            return JsonlGzFormat.read_rows(staging_path)
+        return ParquetFormat._read_parquet(path)
+
+    @staticmethod
+    def _read_parquet(path):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches():
+            yield from batch.to_pylist()
+
+    def write_rows(self, rows):
+        self.staging.write_rows(rows)
+
+    def flush(self):
+        self.staging.flush()
+
+    def close(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.staging.close()
+        staging_path = self.staging_path(self.path)
+        schema = self.schema()
+        with pq.ParquetWriter(self.path, schema, compression='zstd') as writer:
+            rows = []
+            for row in JsonlGzFormat.read_rows(staging_path):
+                rows.append(row)
+                if len(rows) >= PARQUET_ROW_GROUP_SIZE:
+                    writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+                    rows = []
+            if rows:
+                writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+        os.remove(staging_path)
+
+
+FORMATS = {
+    'csv': CsvFormat,
+    'jsonl.gz': JsonlGzFormat,
+    'parquet': ParquetFormat,
+}
+
+
+def format_for(filename):
+    # The format of a leads file, from its extension (ignoring a trailing .part)
+    if filename.endswith('.part'):
+        filename = filename[:-len('.part')]
+    for output_format in FORMATS.values():
+        if filename.endswith(output_format.extension):
+            return output_format
+    raise ValueError(f"Unknown output format for {filename}")
@@ -0,0 +1,152 @@
+import math
+
+from config import (
+    GRID_POPULATION_PER_CELL,
+    GRID_MAX_CELL_KM,
+    GRID_MIN_CELL_KM,
+    GRID_KM_PER_SQRT_POPULATION,
+    GRID_MAX_CITY_KM
+)
+
+KM_PER_DEGREE = 111.32
+
+
+class Cell:
+    """
+    Rectangular search area within a state.
+
+    Cells are searched with a location/radius text search centred on the
+    cell, with the radius reaching its corners. A cell whose search returns
+    a full page can be split into four quadrants that are searched instead.
+    """
+
+    def __init__(self, state, south, west, north, east, city=None):
+        self.state = state
+        self.south = south
+        self.west = west
+        self.north = north
+        self.east = east
+        self.city = city
+
+    @property
+    def center(self):
+        return (self.south + self.north) / 2, (self.west + self.east) / 2
+
+    @property
+    def height_km(self):
+        return (self.north - self.south) * KM_PER_DEGREE
+
+    @property
+    def width_km(self):
+        return (self.east - self.west) * KM_PER_DEGREE * math.cos(math.radians(self.center[0]))
+
+    @property
+    def radius_m(self):
+        return int(math.hypot(self.height_km, self.width_km) / 2 * 1000)
+
+    @property
+    def key(self):
+        # Stable string form used in run journals and progress output
+        city = f"{self.city}|" if self.city else ''
+        return f"grid:{self.state}|{city}{self.south:.5f},{self.west:.5f},{self.north:.5f},{self.east:.5f}"
+
+    @staticmethod
+    def is_key(key):
+        return key.startswith('grid:')
+
+    @classmethod
+    def from_key(cls, key):
+        parts = key[len('grid:'):].split('|')
+        state, bounds = parts[0], parts[-1]
+        city = parts[1] if len(parts) == 3 else None
+        south, west, north, east = (float(value) for value in bounds.split(','))
+        return cls(state, south, west, north, east, city)
+
+    def contains(self, lat, lon):
+        return self.south <= lat < self.north and self.west <= lon < self.east
+
+    def can_split(self, min_size_km=GRID_MIN_CELL_KM):
+        return max(self.height_km, self.width_km) / 2 >= min_size_km
+
+    def split(self):
+        lat, lon = self.center
+        return [
+            Cell(self.state, south, west, north, east, self.city)
+            for south, north in ((self.south, lat), (lat, self.north))
+            for west, east in ((self.west, lon), (lon, self.east))
+        ]
+
+
+def city_radius_km(population, km_per_sqrt_population=GRID_KM_PER_SQRT_POPULATION, min_cell_km=GRID_MIN_CELL_KM):
+    # Half the width of a city's area, which grows with the square root of its population
+    return min(GRID_MAX_CITY_KM / 2, max(min_cell_km, km_per_sqrt_population * math.sqrt(population)))
+
+
+def city_extent(city, km_per_sqrt_population=GRID_KM_PER_SQRT_POPULATION, min_cell_km=GRID_MIN_CELL_KM):
+    # (south, west, north, east) of the square around a (name, population, latitude, longitude) city
+    name, population, lat, lon = city
+    radius_km = city_radius_km(population, km_per_sqrt_population, min_cell_km)
+    lat_radius = radius_km / KM_PER_DEGREE
+    lon_radius = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+    return lat - lat_radius, lon - lon_radius, lat + lat_radius, lon + lon_radius
+
+
+def overlap(cell, extent):
+    # Share of extent's area that lies inside cell
+    south, west, north, east = extent
+    height = min(cell.north, north) - max(cell.south, south)
+    width = min(cell.east, east) - max(cell.west, west)
+    if height <= 0 or width <= 0:
+        return 0
+    return height * width / ((north - south) * (east - west))
+
+
+def plan_state_grid(state, cities, population_per_cell=GRID_POPULATION_PER_CELL,
+                    max_cell_km=GRID_MAX_CELL_KM, min_cell_km=GRID_MIN_CELL_KM,
+                    km_per_sqrt_population=GRID_KM_PER_SQRT_POPULATION):
+    """
+    Tile the populated area of a state into cells sized by density.
+
+    cities is a list of (name, population, latitude, longitude). Each city
+    covers a square whose size grows with the square root of its
+    population (city_radius_km), and its people are spread evenly over it.
+    Starting from the box around all of them, cells are split into
+    quadrants while they hold more than population_per_cell people or are
+    wider than max_cell_km, so a dense metro is tiled with many small cells
+    over its whole extent and rural areas get a few large ones. Quadrants
+    that no city's square reaches are dropped.
+    """
+    if not cities:
+        return []
+
+    extents = [city_extent(city, km_per_sqrt_population, min_cell_km) for city in cities]
+    root = Cell(
+        state,
+        min(extent[0] for extent in extents),
+        min(extent[1] for extent in extents),
+        max(extent[2] for extent in extents),
+        max(extent[3] for extent in extents)
+    )
+
+    cells = []
+    # Each cell is planned with (city, extent, share of the city's area inside the cell) for the cities reaching it
+    stack = [(root, [(city, extent, 1.0) for city, extent in zip(cities, extents)])]
+    while stack:
+        cell, members = stack.pop()
+        population = sum(city[1] * share for city, _, share in members)
+        too_big = max(cell.height_km, cell.width_km) > max_cell_km
+        # A single city is not split for its population here; the search splits its cell if a page comes back full
+        crowded = population > population_per_cell and len(members) > 1
+        if (crowded or too_big) and cell.can_split(min_cell_km):
+            for quadrant in cell.split():
+                inside = [(city, extent, overlap(quadrant, extent)) for city, extent, _ in members]
+                inside = [member for member in inside if member[2] > 0]
+                if inside:
+                    stack.append((quadrant, inside))
+        else:
+            # Name the cell after the city with the most people in it, used for the STATE/CITY column
+            cell.city = max(members, key=lambda member: member[0][1] * member[2])[0][0]
+            cells.append(cell)
+
+    cells.sort(key=lambda cell: (-cell.center[0], cell.center[1]))
+    return cells
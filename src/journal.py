@@ -0,0 +1,90 @@
+import json
+import os
+
+from grid import Cell
+
+# Completed cities between checkpoints
+CHECKPOINT_INTERVAL = 10
+
+
+class RunJournal:
+    """
+    Append-only JSON lines record of a run's progress.
+
+    The first record describes the run (query, keywords, planned cities and
+    output files). Each following record marks a completed city together
+    with the place_ids and (name, phone, location) keys it claimed, which
+    is enough to rebuild the duplicate tracking state on resume.
+    """
+
+    def __init__(self, directory, run_id):
+        os.makedirs(directory, exist_ok=True)
+        self.run_id = run_id
+        self.path = os.path.join(directory, f"{run_id}.jsonl")
+        self.run = None
+        self.completed_cities = set()
+        self.place_ids = set()
+        self.identifiers = set()
+        self.pending = []
+        # Grid cells discovered by splitting completed cells, by state
+        self.children = {}
+        if os.path.exists(self.path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn final line from a crash mid-write
+                    continue
+                if record['type'] == 'run':
+                    self.run = record
+                elif record['type'] == 'city':
+                    self.completed_cities.add(record['city'])
+                    for child in record.get('children', []):
+                        self.children.setdefault(record['state'], []).append(child)
+                    self.place_ids.update(record['place_ids'])
+                    self.identifiers.update(tuple(identifier) for identifier in record['identifiers'])
+
+    @property
+    def exists(self):
+        return self.run is not None
+
+    def start(self, **run):
+        self.run = {'type': 'run', 'run_id': self.run_id, **run}
+        self.pending.append(self.run)
+        self.flush()
+
+    def pending_cities(self):
+        return {
+            state: [city for city in cities + self.children.get(state, []) if city not in self.completed_cities]
+            for state, cities in self.run['cities_by_state'].items()
+        }
+
+    def record_city(self, city, place_ids, identifiers, children=None):
+        self.completed_cities.add(city)
+        record = {
+            'type': 'city',
+            'city': city,
+            'place_ids': sorted(place_ids),
+            'identifiers': sorted(identifiers),
+        }
+        if children:
+            # Split grid cells; they stay pending until recorded themselves
+            record['state'] = Cell.from_key(city).state
+            record['children'] = list(children)
+            self.children.setdefault(record['state'], []).extend(children)
+        self.pending.append(record)
+
+
+    def flush(self):
+        if not self.pending:
+            return
+        with open(self.path, 'a', encoding='utf-8') as file:
+            for record in self.pending:
+                file.write(json.dumps(record) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        self.pending = []
@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import time
+
+from dedup import canonical_name, normalize_phone
+
+
+def name_city_key(lead):
+    return f"{canonical_name(lead['NAME'])}|{lead['STATE/CITY'].strip().lower()}"
+
+
+class LeadStore:
+    """
+    SQLite store of every valid lead found across runs.
+
+    A lead matches an earlier one with the same place_id, the same
+    normalized phone number or the same canonical name in the same city,
+    each backed by an index so lookups stay logarithmic as the history
+    grows. Each lead remembers the run that first found it, which is how a
+    run tells its new leads apart from ones already handed out.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        # Sharded workers may write to the same store, so wait for their transactions
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS leads (
+                id INTEGER PRIMARY KEY,
+                place_id TEXT,
+                phone TEXT NOT NULL,
+                name_city TEXT NOT NULL,
+                name TEXT NOT NULL,
+                location TEXT NOT NULL,
+                website TEXT,
+                business_type TEXT,
+                first_run TEXT NOT NULL,
+                last_run TEXT NOT NULL,
+                first_seen REAL NOT NULL,
+                last_seen REAL NOT NULL,
+                times_seen INTEGER NOT NULL DEFAULT 1
+            )
+        """)
+        self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS leads_place_id ON leads (place_id) WHERE place_id IS NOT NULL")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS leads_phone ON leads (phone) WHERE phone != ''")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS leads_name_city ON leads (name_city)")
+        # Per niche and city: how many leads its searches found and how many of them were new
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS city_yields (
+                business_type TEXT NOT NULL,
+                city TEXT NOT NULL,
+                searches INTEGER NOT NULL,
+                leads INTEGER NOT NULL,
+                last_leads INTEGER NOT NULL,
+                last_new_leads INTEGER NOT NULL,
+                last_run TEXT NOT NULL,
+                last_seen REAL NOT NULL,
+                PRIMARY KEY (business_type, city)
+            )
+        """)
+        self.conn.commit()
+
+    def find(self, lead):
+        # Returns (id, first_run) of the stored lead matching this one, or None
+        place_id = lead.get('PLACE_ID') or None
+        if place_id:
+            row = self.conn.execute("SELECT id, first_run FROM leads WHERE place_id = ?", (place_id,)).fetchone()
+            if row:
+                return row
+        phone = normalize_phone(lead['PHONE'])
+        if phone:
+            row = self.conn.execute("SELECT id, first_run FROM leads WHERE phone = ? AND phone != '' LIMIT 1", (phone,)).fetchone()
+            if row:
+                return row
+        return self.conn.execute("SELECT id, first_run FROM leads WHERE name_city = ? LIMIT 1", (name_city_key(lead),)).fetchone()
+
+    def upsert(self, leads, run_id, business_type=None):
+        """
+        Record leads as seen by run_id, in one transaction.
+
+        Returns the leads that no earlier run had found. Leads first found
+        by run_id itself, e.g. before it was interrupted and resumed, still
+        count as new for it.
+        """
+        new_leads = []
+        now = time.time()
+        with self.conn:
+            for lead in leads:
+                match = self.find(lead)
+                if match:
+                    lead_id, first_run = match
+                    self.conn.execute(
+                        "UPDATE leads SET last_run = ?, last_seen = ?, times_seen = times_seen + 1, "
+                        "place_id = COALESCE(place_id, ?) WHERE id = ?",
+                        (run_id, now, lead.get('PLACE_ID') or None, lead_id)
+                    )
+                    if first_run == run_id:
+                        new_leads.append(lead)
+                    continue
+
+                self.conn.execute(
+                    "INSERT INTO leads (place_id, phone, name_city, name, location, website, business_type, "
+                    "first_run, last_run, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (lead.get('PLACE_ID') or None, normalize_phone(lead['PHONE']), name_city_key(lead), lead['NAME'],
+                     lead['STATE/CITY'], lead.get('WEBSITE'), business_type, run_id, run_id, now, now)
+                )
+                new_leads.append(lead)
+        return new_leads
+
+    def record_search(self, business_type, city, leads, new_leads, run_id):
+        # Records one search of city for business_type, for planning later runs
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO city_yields (business_type, city, searches, leads, last_leads, last_new_leads, last_run, last_seen) "
+                "VALUES (?, ?, 1, ?, ?, ?, ?, ?) ON CONFLICT (business_type, city) DO UPDATE SET "
+                "searches = searches + 1, leads = leads + excluded.leads, last_leads = excluded.last_leads, "
+                "last_new_leads = excluded.last_new_leads, last_run = excluded.last_run, last_seen = excluded.last_seen",
+                (business_type or '', city, leads, leads, new_leads, run_id, time.time())
+            )
+
+    def city_history(self, business_type):
+        # {city: (searches, leads, last_leads, last_new_leads)} for business_type
+        rows = self.conn.execute(
+            "SELECT city, searches, leads, last_leads, last_new_leads FROM city_yields WHERE business_type = ?",
+            (business_type or '',)
+        )
+        return {city: tuple(counts) for city, *counts in rows}
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM leads").fetchone()[0]
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
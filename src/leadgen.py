@@ -0,0 +1,1095 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter, defaultdict, deque
+
+from config import (
+    GOOGLE_PLACES_API_KEY,
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    MAX_RETRIES,
+    BACKOFF_TIME,
+    PLACES_API_URL,
+    MAX_IN_FLIGHT,
+    TEXTSEARCH_QPS,
+    DETAILS_QPS,
+    DETAILS_PER_CITY,
+    REQUEST_TIMEOUT,
+    LEADS_DIR,
+    CACHE_DIR,
+    CACHE_ENABLED,
+    CACHE_TTL,
+    CACHE_MAX_BYTES,
+    RUNS_DIR,
+    MAX_PAGES,
+    PAGE_TOKEN_DELAY,
+    PAGE_TOKEN_RETRIES,
+    PLACES_COST_PER_1000,
+    LEAD_STORE_ENABLED,
+    LEAD_STORE_PATH,
+    OUTPUT_FORMAT,
+    ENRICH_ENABLED,
+    ENRICH_MAX_PENDING_CITIES
+)
+from data_handler import LeadWriter, LeadStats
+from dedup import DuplicateIndex, lead_key
+from formats import FORMATS
+from journal import RunJournal, CHECKPOINT_INTERVAL
+from grid import Cell
+from matcher import KeywordMatcher
+from metrics import Metrics, CITY_BUCKETS
+from planner import city_populations, order_cities
+from registry import PlaceRegistry
+from scheduler import RequestScheduler, RequestFailed
+
+# A text search page holds at most this many results
+FULL_PAGE_SIZE = 20
+
+# Heavy third-party packages (aiohttp, openai, us, geonamescache) are imported
+# where they are used so importing this module stays cheap.
+
+
+def get_state_from_input(input_str):
+    import us
+
+    if input_str:
+        state = us.states.lookup(input_str)
+        if not state:
+            state = next((s for s in us.states.STATES if s.name.lower() == input_str.lower()), None)
+        return state
+    return None
+
+
+def get_cities_by_state(state_input=None, all_states=False, num_cities=100, min_population=10000, grid=False):
+    # With grid=True each state's list holds grid cell keys covering its
+    # num_cities largest cities instead of the city names themselves
+    import us
+    from city_index import get_city_index
+    from grid import plan_state_grid
+
+    logging.debug(f"Starting get_cities_by_state with state_input={state_input}, all_states={all_states}, num_cities={num_cities}")
+    start_time = time.time()
+
+    city_index = get_city_index()
+
+    logging.debug(f"Loaded city index in {time.time() - start_time:.2f} seconds")
+
+    def get_cities_for_state(state, city_index, min_population, num_cities):
+        if grid:
+            cities = city_index.cities_with_coordinates(state.abbr, num_cities, min_population)
+            return [cell.key for cell in plan_state_grid(state.abbr, cities)]
+
+        # The index is already sorted by population, so this is a slice rather than a scan
+        cities = city_index.top_cities(state.abbr, num_cities, min_population)
+        top_cities = [f"{name}, {state.abbr}" for name, population in cities]
+
+        capital_city = f"{state.capital}, {state.abbr}"
+        if capital_city not in top_cities:
+            top_cities.insert(0, capital_city)
+
+        return top_cities[:num_cities]
+
+    if all_states:
+        states_dict = {}
+        for state in us.states.STATES:
+            if not state.is_territory:
+                cities = get_cities_for_state(state, city_index, min_population, num_cities)
+                states_dict[state.abbr] = cities
+        logging.debug(f"Processed all states in {time.time() - start_time:.2f} seconds")
+        return states_dict
+    elif state_input:
+        state = get_state_from_input(state_input)
+        if not state:
+            raise ValueError(f"Invalid state input: {state_input}")
+
+        cities = get_cities_for_state(state, city_index, min_population, num_cities)
+        logging.debug(f"Processed single state {state.abbr} in {time.time() - start_time:.2f} seconds")
+        return {state.abbr: cities}
+    else:
+        logging.debug("No state input or all_states flag, defaulting to all states")
+        return get_cities_by_state(all_states=True, num_cities=num_cities, min_population=min_population, grid=grid)
+
+
+# Bump when the prompt changes so cached expansions are regenerated
+PROMPT_VERSION = 1
+EXPANSION_MODEL = "gpt-4o-mini"
+
+
+def build_expansion_messages(original_query):
+    return [
+        {"role": "system", "content": "You are a helpful assistant that generates concise and relevant enhanced search queries for residential services."},
+        {"role": "user", "content": f"""Generate a concise enhanced search query for the business type: '{original_query}', focusing on residential services for homeowners. The enhanced query should be 2-3 words long, specific, and targeted to improve search results. Avoid unnecessary adjectives or commercial terms.
+
+Also, provide a list of 10-15 relevant keywords or partial keywords, prioritizing residential-related terms. Include 'exterior' and 'contract' (to cover terms like contracting, contractor) in the keywords. Partial keywords are encouraged to match variations (e.g., 'illumin' for illuminate, illumination, etc.). Use 'light' instead of 'lights' to match both singular and plural forms.
+
+Respond with the enhanced query on one line, followed by the keywords list on the next line, separated by commas. Example response format:
+Enhanced Query: Residential Roofing
+Keywords: roof, repair, install, exterior, contract, shingl, homeown, resident, light, ..."""}
+    ]
+
+
+def parse_expansion(content, additional_keywords=None):
+    result = content.strip().split('\n')
+    enhanced_query = result[0].split(': ')[1].strip()
+    keywords = result[1].split(': ')[1].strip().split(', ')
+
+    # Add additional keywords if provided
+    if additional_keywords:
+        keywords.extend([kw.strip() for kw in additional_keywords.split(',')])
+
+    # Ensure each word in the enhanced query is in keywords
+    keywords.extend(word for word in enhanced_query.split() if word not in keywords)
+
+    keywords = sorted(set([word.lower() for word in keywords]))  # Remove duplicates and convert to lowercase
+
+    return enhanced_query, keywords
+
+
+def generate_enhanced_query_and_keywords(original_query, additional_keywords=None, api_key=OPENAI_API_KEY):
+    from openai import OpenAI
+
+    try:
+        client = OpenAI(api_key=api_key, base_url=OPENAI_BASE_URL)
+        response = client.chat.completions.create(
+            model=EXPANSION_MODEL,
+            messages=build_expansion_messages(original_query)
+        )
+        return parse_expansion(response.choices[0].message.content, additional_keywords)
+    except Exception as e:
+        logging.error(f"Error generating enhanced query and keywords: {str(e)}")
+        return original_query, []
+
+
+async def expand_query(original_query, additional_keywords=None, refresh=False, api_key=OPENAI_API_KEY):
+    """
+    Memoized, non-blocking version of generate_enhanced_query_and_keywords.
+
+    Expansions are cached on disk per business type, extra keywords and
+    prompt version; refresh=True ignores the cached entry and replaces it.
+    Failed expansions fall back to the original query and are not cached.
+    """
+    from cache import ExpansionCache
+
+    cache = ExpansionCache(os.path.join(CACHE_DIR, 'expansions.json'))
+    key = ExpansionCache.make_key(original_query, additional_keywords, PROMPT_VERSION, EXPANSION_MODEL)
+    if not refresh:
+        cached = cache.get(key)
+        if cached:
+            logging.debug(f"Using cached expansion for {original_query}")
+            return cached
+
+    from openai import AsyncOpenAI
+
+    try:
+        client = AsyncOpenAI(api_key=api_key, base_url=OPENAI_BASE_URL)
+        response = await client.chat.completions.create(
+            model=EXPANSION_MODEL,
+            messages=build_expansion_messages(original_query)
+        )
+        enhanced_query, keywords = parse_expansion(response.choices[0].message.content, additional_keywords)
+    except Exception as e:
+        logging.error(f"Error generating enhanced query and keywords: {str(e)}")
+        return original_query, []
+
+    cache.set(key, enhanced_query, keywords)
+    return enhanced_query, keywords
+
+
+def load_batch_file(path):
+    """
+    Read the niches of a batch run from path.
+
+    One niche per line: the business type, then optionally extra keywords
+    and exclude keywords, separated by '|', e.g.
+
+        roofing | shingle, gutter | commercial, industrial
+
+    Blank lines and lines starting with '#' are ignored.
+    """
+    niches = []
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            parts = [part.strip() for part in line.split('|')]
+            if not parts[0]:
+                raise ValueError(f"Missing business type in batch file line: {line}")
+            niches.append({
+                'business_type': parts[0],
+                'keywords': parts[1] if len(parts) > 1 and parts[1] else None,
+                'exclude_keywords': [kw.strip() for kw in parts[2].split(',') if kw.strip()] if len(parts) > 2 else [],
+            })
+    check_niche_slugs(niches)
+    return niches
+
+
+def niche_slug(business_type):
+    return re.sub(r'[^a-z0-9]+', '-', business_type.lower()).strip('-')
+
+
+def check_niche_slugs(niches):
+    # Niches with the same slug would share a run journal and output files
+    seen = {}
+    for niche in niches:
+        slug = niche_slug(niche['business_type'])
+        if slug in seen:
+            raise ValueError(f"Business types '{seen[slug]}' and '{niche['business_type']}' are the same niche ({slug})")
+        seen[slug] = niche['business_type']
+
+
+def start_batch(batch_id, niches, cities_by_state, match_mode='substring', grid=False, runs_dir=RUNS_DIR, output_format=OUTPUT_FORMAT):
+    """
+    Create one run journal per niche and a manifest listing them.
+
+    niches are dicts with business_type, enhanced_query, keywords and
+    exclude_keywords. Each niche's run ID is the batch ID followed by its
+    slug, so its output files can be told apart. Raises ValueError if two
+    niches have the same slug. Returns the journals.
+    """
+    check_niche_slugs(niches)
+    journals = []
+    for niche in niches:
+        run_id = f"{batch_id}_{niche_slug(niche['business_type'])}"
+        journals.append(start_run(
+            run_id,
+            niche['business_type'],
+            niche['enhanced_query'],
+            niche['keywords'],
+            cities_by_state,
+            niche['exclude_keywords'],
+            match_mode,
+            grid,
+            runs_dir,
+            output_format
+        ))
+    with open(os.path.join(runs_dir, f"{batch_id}.batch.json"), 'w', encoding='utf-8') as file:
+        json.dump({'batch_id': batch_id, 'run_ids': [journal.run_id for journal in journals]}, file)
+    return journals
+
+
+def load_batch(batch_id, runs_dir=RUNS_DIR):
+    # Returns the journals of a batch started with start_batch, or None if there is no such batch
+    path = os.path.join(runs_dir, f"{batch_id}.batch.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as file:
+        manifest = json.load(file)
+    return [RunJournal(runs_dir, run_id) for run_id in manifest['run_ids']]
+
+
+def start_run(run_id, business_type, enhanced_query, keywords, cities_by_state, exclude_keywords=None, match_mode='substring', grid=False,
+              runs_dir=RUNS_DIR, output_format=OUTPUT_FORMAT):
+    # Creates the journal for a new run; its output files are named after the run ID
+    extension = FORMATS[output_format].extension
+    journal = RunJournal(runs_dir, run_id)
+    journal.start(
+        business_type=business_type,
+        enhanced_query=enhanced_query,
+        keywords=keywords,
+        exclude_keywords=exclude_keywords or [],
+        match_mode=match_mode,
+        grid=grid,
+        cities_by_state=cities_by_state,
+        good_leads_file=f"leads_{run_id}{extension}",
+        bad_leads_file=f"bad-leads_{run_id}{extension}",
+        new_leads_file=f"new-leads_{run_id}{extension}",
+        stats_file=f"stats_{run_id}.json"
+    )
+    return journal
+
+
+class CityResult:
+    def __init__(self, city, businesses=None, bad_leads=None, skipped_businesses=0, invalid_leads=0, duplicates=0, error=None):
+        self.city = city
+        self.businesses = businesses or []
+        self.bad_leads = bad_leads or []
+        self.skipped_businesses = skipped_businesses
+        self.invalid_leads = invalid_leads
+        self.duplicates = duplicates
+        self.error = error
+        self.runtime = 0
+        self.pages = 0
+        self.children = []
+
+    @property
+    def label(self):
+        # Grid cells are shown by the city they are named after
+        if Cell.is_key(self.city):
+            cell = Cell.from_key(self.city)
+            return f"{cell.city}, {cell.state} ({cell.width_km:.0f}km)"
+        return self.city
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def leads(self):
+        return [b for b in self.businesses if b['PHONE'] != 'N/A']
+
+
+def _discard_result(task):
+    if not task.cancelled():
+        task.exception()
+
+
+class LeadSearch:
+    """
+    Search pipeline for one business type.
+
+    Owns the HTTP session, request scheduler, response cache and the
+    run-wide duplicate tracking. Use it as an async context manager:
+
+        async with LeadSearch("gutters", enhanced_query, keywords) as search:
+            result = await search.search_city("Austin, TX")
+    """
+
+    def __init__(
+        self,
+        business_type,
+        enhanced_query=None,
+        keywords=None,
+        exclude_keywords=None,
+        match_mode='substring',
+        api_key=GOOGLE_PLACES_API_KEY,
+        max_in_flight=MAX_IN_FLIGHT,
+        textsearch_qps=TEXTSEARCH_QPS,
+        details_qps=DETAILS_QPS,
+        details_per_city=DETAILS_PER_CITY,
+        max_pages=MAX_PAGES,
+        cache=CACHE_ENABLED,
+        refresh=False,
+        places_api_url=PLACES_API_URL,
+        store=LEAD_STORE_ENABLED,
+        prioritize=True,
+        budget=None,
+        store_path=LEAD_STORE_PATH,
+        enrich=ENRICH_ENABLED
+    ):
+        if not api_key:
+            raise ValueError("A Google Places API key is required")
+        self.business_type = business_type
+        self.enhanced_query = enhanced_query or business_type
+        self.keywords = keywords or []
+        self.matcher = KeywordMatcher(self.keywords, exclude_keywords, match_mode)
+        self.api_key = api_key
+        self.max_in_flight = max_in_flight
+        self.qps = {'textsearch': textsearch_qps, 'details': details_qps}
+        self.details_per_city = details_per_city
+        self.max_pages = max_pages
+        # The most one city can cost, as a RequestScheduler.summary(), for the budget
+        self.city_requests = {
+            'textsearch': {'calls': max_pages},
+            'details': {'calls': max_pages * FULL_PAGE_SIZE},
+        }
+        self.textsearch_url = f"{places_api_url}/textsearch/json"
+        self.details_url = f"{places_api_url}/details/json"
+        self.use_cache = cache
+        self.refresh = refresh
+        self.use_store = store
+        self.store_path = store_path
+        # Order cities by expected new leads (see planner.order_cities) and stop when budget says so
+        self.prioritize = prioritize
+        self.budget = budget
+        self.budget_stop = None
+        self.cities_not_searched = 0
+        # Look up emails and social links on the valid leads' websites (see enrich.py)
+        self.use_enricher = enrich
+
+        # Track unique businesses based on place_id and near-duplicate names and phones across the whole run
+        self.duplicate_index = DuplicateIndex()
+        self.place_registry = PlaceRegistry()
+
+        # Per text search page number: pages fetched, results returned and valid leads found
+        self.page_stats = defaultdict(Counter)
+
+        # Request latencies, response sizes and city times, exported at the end of run()
+        self.metrics = Metrics()
+
+        self.session = None
+        self.scheduler = None
+        self.cache = None
+        self.lead_store = None
+        self.enricher = None
+        self.owns_session = True
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def open(self, shared=None):
+        # With shared, another open LeadSearch, its session, scheduler, response
+        # cache and details lookups are reused instead; they stay owned by it
+        if shared:
+            self.session = shared.session
+            self.scheduler = shared.scheduler
+            self.cache = shared.cache
+            self.lead_store = shared.lead_store
+            self.enricher = shared.enricher if self.use_enricher else None
+            self.place_registry = PlaceRegistry(shared.place_registry.details)
+            self.owns_session = False
+            return
+
+        import aiohttp
+
+        if self.use_store:
+            from lead_store import LeadStore
+            self.lead_store = LeadStore(self.store_path)
+
+        if self.use_cache:
+            from cache import ResponseCache
+            self.cache = ResponseCache(os.path.join(CACHE_DIR, 'responses.sqlite'), CACHE_TTL, CACHE_MAX_BYTES, refresh=self.refresh)
+
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+        self.scheduler = RequestScheduler(
+            self.session,
+            max_in_flight=self.max_in_flight,
+            qps=self.qps,
+            max_retries=MAX_RETRIES,
+            backoff_time=BACKOFF_TIME,
+            cache=self.cache,
+            metrics=self.metrics
+        )
+        if self.use_enricher:
+            from enrich import WebsiteEnricher
+            self.enricher = WebsiteEnricher(self.cache, metrics=self.metrics)
+            await self.enricher.open()
+
+    async def close(self):
+        if not self.owns_session:
+            self.session = self.scheduler = self.cache = self.lead_store = self.enricher = None
+            return
+        if self.enricher:
+            await self.enricher.close()
+            self.enricher = None
+        if self.session:
+            await self.session.close()
+            self.session = None
+        if self.cache:
+            self.cache.close()
+            self.cache = None
+        if self.lead_store:
+            self.lead_store.close()
+            self.lead_store = None
+
+    def restore(self, journal):
+        # Seed duplicate tracking with the cities a journal has already completed
+        for identifier in journal.identifiers:
+            # Journals written before locations were recorded only hold (name, phone)
+            self.duplicate_index.add_key(identifier if len(identifier) == 3 else (*identifier, ''))
+        self.place_registry.claimed.update(journal.place_ids)
+
+    def is_duplicate(self, business):
+        return self.duplicate_index.check(business)
+
+    async def get_place_details(self, place_id):
+        params = {'place_id': place_id, 'fields': 'formatted_phone_number,website', 'key': self.api_key}
+        result = await self.scheduler.get_json('details', self.details_url, params)
+        details = result.get('result', {})
+        return details.get('formatted_phone_number'), details.get('website')
+
+    async def get_details_for_places(self, place_ids):
+        # Fan out the details lookups for one page of results, at most details_per_city at a time.
+        # Results come back in the same order as place_ids so classification stays deterministic.
+        # place_ids already fetched by another city reuse the earlier lookup instead of a new call.
+        semaphore = asyncio.Semaphore(self.details_per_city)
+
+        async def fetch(place_id):
+            async with semaphore:
+                return await self.get_place_details(place_id)
+
+        # Shield the shared lookups so one city failing doesn't cancel them for the others
+        futures = [asyncio.shield(self.place_registry.get_details(place_id, fetch)) for place_id in place_ids]
+        details = await asyncio.gather(*futures, return_exceptions=True)
+        for result in details:
+            if isinstance(result, BaseException):
+                raise result
+        return details
+
+    async def search_businesses(self, location):
+        result = CityResult(location)
+        query = f"{self.enhanced_query} in {location}"
+        city, state = location.split(',')
+        await self.search_area(result, {'query': query, 'key': self.api_key}, query, city.strip(), state.strip())
+        return result
+
+    async def search_cell(self, key):
+        # Grid mode: a location/radius search over one cell; a full page of results
+        # means the cell is too dense, so its quadrants are queued as children
+        cell = Cell.from_key(key)
+        result = CityResult(key)
+        lat, lon = cell.center
+        params = {'query': self.enhanced_query, 'location': f"{lat:.5f},{lon:.5f}", 'radius': cell.radius_m, 'key': self.api_key}
+        search_key = f"{self.enhanced_query} @ {params['location']} r{params['radius']}"
+        await self.search_area(result, params, search_key, cell.city, cell.state, cell)
+        return result
+
+    async def search_area(self, result, params, search_key, city, state, cell=None):
+        # Runs one text search and its follow-up pages, classifying results into result.
+        # search_key identifies the search in the cache for follow-up pages.
+        location = result.city
+
+        # Look in the cache separately so we know whether this page's next_page_token is still live
+        page = self.scheduler.cached('textsearch', params)
+        from_cache = page is not None
+        if page is None:
+            page = await self.scheduler.get_json('textsearch', self.textsearch_url, params, use_cache=False)
+
+        if 'error_message' in page:
+            result.error = f"API Error for {location}: {page['error_message']}"
+            return
+
+        if cell and cell.can_split() and (len(page.get('results', [])) >= FULL_PAGE_SIZE or page.get('next_page_token')):
+            result.children = [child.key for child in cell.split()]
+
+        page_number = 1
+        while True:
+            self.page_stats[page_number]['pages'] += 1
+            next_page = None
+            token = page.get('next_page_token')
+            # Split cells are covered by their children, so only page through leaf cells
+            if token and page_number < self.max_pages and not result.children:
+                # Start waiting for the next page before classifying this one
+                next_page = self.request_next_page(search_key, token, page_number + 1, from_cache)
+
+            places = page.get('results', [])
+            try:
+                valid_leads = await self.classify_places(result, city, state, places)
+            except BaseException:
+                if next_page is not None:
+                    next_page.cancel()
+                raise
+            self.page_stats[page_number]['results'] += len(places)
+            self.page_stats[page_number]['leads'] += valid_leads
+            result.pages = page_number
+
+            logging.debug(f"Location: {location} (page {page_number})")
+            logging.debug(f"Total results: {len(places)}")
+            logging.debug(f"Valid leads: {valid_leads}")
+
+            if next_page is None:
+                break
+            try:
+                page, from_cache = await next_page
+            except RequestFailed as e:
+                logging.warning(f"Stopped paging {location} after page {page_number}: {str(e)}")
+                break
+            if page.get('status') not in ('OK', 'ZERO_RESULTS'):
+                logging.warning(f"Stopped paging {location} after page {page_number}: {page.get('status')}")
+                break
+            page_number += 1
+
+        logging.debug(f"Invalid leads: {result.invalid_leads}")
+        logging.debug(f"Duplicates: {result.duplicates}")
+
+    def request_next_page(self, query, token, page_number, previous_from_cache):
+        # Returns an awaitable for (page, from_cache) of page_number of a text search.
+        # Follow-up pages are cached by query and page number since page tokens change every run.
+        cached = self.scheduler.cached('textsearch', {'query': query, 'page': page_number})
+        if cached is not None:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result((cached, True))
+            return future
+
+        async def fetch():
+            fresh_token = token
+            if previous_from_cache:
+                fresh_token = await self.refresh_page_token(query, page_number - 1)
+            return await self.fetch_next_page(query, fresh_token, page_number), False
+
+        return self.scheduler.schedule(PAGE_TOKEN_DELAY, fetch)
+
+    async def fetch_next_page(self, query, token, page_number, attempt=0):
+        params = {'pagetoken': token, 'key': self.api_key}
+        page = await self.scheduler.get_json(
+            'textsearch', self.textsearch_url, params,
+            cache_params={'query': query, 'page': page_number}, use_cache=False
+        )
+        if page.get('status') == 'INVALID_REQUEST' and attempt < PAGE_TOKEN_RETRIES:
+            # The token isn't valid yet; try again later without holding up other cities
+            return await self.scheduler.schedule(
+                PAGE_TOKEN_DELAY, lambda: self.fetch_next_page(query, token, page_number, attempt + 1)
+            )
+        return page
+
+    async def refresh_page_token(self, query, page_number):
+        # Tokens inside cached pages have expired, so walk the pages again
+        # from the API to get a live token for the page after page_number
+        page = await self.scheduler.get_json('textsearch', self.textsearch_url, {'query': query, 'key': self.api_key}, use_cache=False)
+        for next_page_number in range(2, page_number + 1):
+            token = page.get('next_page_token')
+            if not token:
+                break
+            page = await self.scheduler.schedule(
+                PAGE_TOKEN_DELAY, lambda token=token, n=next_page_number: self.fetch_next_page(query, token, n)
+            )
+        return page.get('next_page_token')
+
+    async def classify_places(self, result, city, state, places):
+        # Classifies one page of text search results into result, returns the number of valid leads
+        valid_leads = 0
+        matched_keywords = [self.matcher.match(place['name']) for place in places]
+        excluded_keywords = [self.matcher.excluded(place['name']) if keyword else None for place, keyword in zip(places, matched_keywords)]
+
+        # Details are only fetched for keyword matches that no exclude keyword ruled out
+        matches = [i for i, keyword in enumerate(matched_keywords) if keyword and not excluded_keywords[i]]
+        details = await self.get_details_for_places([places[i].get('place_id') for i in matches])
+        details_by_place = dict(zip(matches, details))
+
+        for i, place in enumerate(places):
+            if i in details_by_place:
+                phone_number, website = details_by_place[i]
+                business = {
+                    'NAME': place['name'],
+                    'PHONE': phone_number if phone_number else 'N/A',
+                    'WEBSITE': website if website else 'N/A',
+                    'STATE/CITY': f"{state}, {city}",
+                    'RATING': place.get('rating', 'N/A'),
+                    'REVIEWS': place.get('user_ratings_total', 'N/A'),
+                    'REASON': '',
+                    'KEYWORD': matched_keywords[i],
+                    'PLACE_ID': place.get('place_id')
+                }
+
+                place_id = business['PLACE_ID']
+                if (place_id and not self.place_registry.claim(place_id)) or self.is_duplicate(business):
+                    business['REASON'] = 'duplicate'
+                    result.bad_leads.append(business)
+                    result.duplicates += 1
+                    result.invalid_leads += 1
+                elif not phone_number:
+                    business['REASON'] = 'no_number'
+                    result.bad_leads.append(business)
+                    result.skipped_businesses += 1
+                    result.invalid_leads += 1
+                else:
+                    result.businesses.append(business)
+                    valid_leads += 1
+            else:
+                reason = 'excluded' if excluded_keywords[i] else 'no_keyword'
+                bad_lead = {
+                    'NAME': place['name'],
+                    'PHONE': 'N/A',
+                    'WEBSITE': 'N/A',
+                    'STATE/CITY': f"{state}, {city}",
+                    'RATING': place.get('rating', 'N/A'),
+                    'REVIEWS': place.get('user_ratings_total', 'N/A'),
+                    'REASON': reason,
+                    'KEYWORD': excluded_keywords[i] or '',
+                    'PLACE_ID': place.get('place_id')
+                }
+                result.bad_leads.append(bad_lead)
+                result.invalid_leads += 1
+
+        return valid_leads
+
+    async def search_city(self, city):
+        start_time_city = time.time()
+        try:
+            if Cell.is_key(city):
+                result = await self.search_cell(city)
+            else:
+                result = await self.search_businesses(city)
+        except RequestFailed as e:
+            logging.error(f"Giving up on {city}: {str(e)}")
+            result = CityResult(city, error=str(e))
+        result.runtime = time.time() - start_time_city
+        logging.debug(f"Time taken for {city}: {result.runtime:.2f} seconds")
+        status = 'ok' if result.ok else 'failed'
+        self.metrics.inc('cities_total', status=status)
+        self.metrics.observe('city_seconds', result.runtime, CITY_BUCKETS, status=status)
+        return result
+
+    async def search_cities(self, cities):
+        # Yields a CityResult for each city as soon as it completes. Grid cells
+        # that were split are followed by searches of their children. With a
+        # budget, cities are dispatched in order, at most max_in_flight at a
+        # time, a city that doesn't fit yet or whose turn goes to another
+        # search sharing the budget waits, and dispatching stops once the
+        # budget is used up; the rest stay pending in the journal.
+        queue = deque(cities)
+        pending = set()
+        waiter = None
+        self.budget_stop = None
+
+        def dispatch():
+            nonlocal waiter
+            # A search sharing its budget in a batch always keeps one city going
+            while queue and (self.budget is None or not pending or self.budget.can_start(self.max_in_flight)):
+                if self.budget:
+                    requests = self.scheduler.summary()
+                    if self.budget.check(requests, self.city_requests):
+                        self.budget_stop = self.budget.stop_reason
+                        # Searches waiting for their turn stop as well
+                        self.budget.wake()
+                        return
+                    fits = self.budget.fits(requests, self.city_requests)
+                    if not fits or self.budget.defers(self):
+                        if waiter is None or waiter.done():
+                            waiter = self.budget.wait(self)
+                            pending.add(waiter)
+                        if fits:
+                            # Let the waiting search that comes first take the city
+                            self.budget.wake()
+                        return
+                    self.budget.start(self)
+                pending.add(asyncio.ensure_future(self.search_city(queue.popleft())))
+
+        # Completed tasks whose results haven't been taken yet
+        done = set()
+        dispatch()
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                while done:
+                    result = done.pop().result()
+                    if result is None:
+                        # A wait for the budget ended
+                        continue
+                    # Children of a dense cell are likely to be productive too
+                    queue.extendleft(reversed(result.children))
+                    yield result
+                dispatch()
+        finally:
+            # When a city raised or the run stopped, the other cities' errors are dropped
+            # rather than reported as never retrieved
+            for task in pending:
+                task.cancel()
+                task.add_done_callback(_discard_result)
+            for task in done:
+                _discard_result(task)
+            if self.budget:
+                self.budget.leave(self)
+            self.cities_not_searched = len(queue)
+
+    async def run(self, journal, output_dir=LEADS_DIR, on_city=None, metrics_interval=None, prometheus_file=None):
+        """
+        Search the pending cities of a run and stream their leads to disk.
+
+        Rows are appended to the run's good and bad leads files as each
+        city completes and the journal is checkpointed along the way, so an
+        interrupted run can be resumed from the same journal. on_city is
+        called with each CityResult. Returns a summary of the run.
+
+        With the lead store enabled, valid leads no earlier run has found
+        are also written to the run's new leads file. Per-city and per-state
+        aggregates (LeadStats) are kept up to date in the run's stats file.
+
+        With website enrichment, a city's rows are written once its valid
+        leads have their EMAIL and SOCIAL columns. That happens in the
+        background while the next cities are searched, and the run waits
+        for the last of them before finishing.
+
+        Metrics are written next to the journal as <run_id>.metrics.json and
+        a Prometheus textfile (<run_id>.prom unless prometheus_file is given)
+        when the run ends, and every metrics_interval seconds if set.
+        """
+        self.restore(journal)
+        cities = [city for cities in journal.pending_cities().values() for city in cities]
+        if self.prioritize and len(cities) > 1:
+            history = self.lead_store.city_history(self.business_type) if self.lead_store else {}
+            cities = order_cities(cities, history, city_populations(cities))
+        stats = LeadStats()
+        stats_file = os.path.join(output_dir, journal.run.get('stats_file', f"stats_{journal.run_id}.json"))
+        good_leads_writer = LeadWriter(os.path.join(output_dir, journal.run['good_leads_file']), append=True, on_row=stats.add)
+        bad_leads_writer = LeadWriter(os.path.join(output_dir, journal.run['bad_leads_file']), append=True, on_row=stats.add)
+        new_leads_writer = None
+        if self.lead_store:
+            new_leads_file = journal.run.get('new_leads_file', f"new-leads_{journal.run_id}.csv")
+            new_leads_writer = LeadWriter(os.path.join(output_dir, new_leads_file), append=True, on_row=stats.add_new)
+        failed_cities = 0
+        split_cells = 0
+        runs_dir = os.path.dirname(journal.path)
+        metrics_file = os.path.join(runs_dir, f"{journal.run_id}.metrics.json")
+        prometheus_file = prometheus_file or os.path.join(runs_dir, f"{journal.run_id}.prom")
+
+        def checkpoint():
+            # Rows must be on disk before the journal marks their cities as completed
+            good_leads_writer.flush()
+            bad_leads_writer.flush()
+            if new_leads_writer:
+                new_leads_writer.flush()
+            stats.write(stats_file, run_id=journal.run_id, business_type=self.business_type)
+            journal.flush()
+
+        def summarize():
+            return {
+                'run_id': journal.run_id,
+                'good_leads_file': good_leads_writer.filename,
+                'bad_leads_file': bad_leads_writer.filename,
+                'new_leads_file': new_leads_writer.filename if new_leads_writer else None,
+                'stats_file': stats_file,
+                'avg_rating': stats.summary()['totals']['avg_rating'],
+                'valid_leads': len(good_leads_writer.seen),
+                'new_leads': len(new_leads_writer.seen) if new_leads_writer else None,
+                'invalid_leads': len(bad_leads_writer.seen),
+                'no_keyword': bad_leads_writer.reasons['no_keyword'],
+                'excluded': bad_leads_writer.reasons['excluded'],
+                'duplicates': bad_leads_writer.reasons['duplicate'],
+                'no_number': bad_leads_writer.reasons['no_number'],
+                'failed_cities': failed_cities,
+                'split_cells': split_cells,
+                'budget_stop': self.budget_stop,
+                'cities_not_searched': self.cities_not_searched,
+                'details_calls_saved': self.place_registry.saved_calls,
+                'pages': {page: dict(counts) for page, counts in sorted(self.page_stats.items())},
+                # A search sharing another's scheduler can't tell its own requests apart
+                'requests': self.scheduler.summary() if self.owns_session else {},
+                'cache': self.cache.summary() if self.cache and self.owns_session else {},
+                'websites': self.enricher.summary() if self.enricher and self.owns_session else {},
+            }
+
+        def export_metrics():
+            summary = summarize()
+            summary['estimated_cost'] = self.collect_metrics(summary)
+            self.metrics.write(metrics_file, prometheus_file)
+            return summary
+
+        async def stream_metrics():
+            while True:
+                await asyncio.sleep(metrics_interval)
+                export_metrics()
+
+        def write_city(result, stored):
+            good_leads_writer.write(result.businesses)
+            bad_leads_writer.write(result.bad_leads)
+            if new_leads_writer:
+                new_leads_writer.write(stored)
+                # Recorded along with the journal, so a resumed run doesn't count the city twice
+                self.lead_store.record_search(self.business_type, result.city, len(result.businesses), len(stored), journal.run_id)
+
+            classified = [lead for lead in result.businesses + result.bad_leads if lead['REASON'] not in ('no_keyword', 'excluded')]
+            journal.record_city(
+                result.city,
+                place_ids={lead['PLACE_ID'] for lead in classified if lead['PLACE_ID']},
+                identifiers={lead_key(lead) for lead in classified},
+                children=result.children
+            )
+            if len(journal.pending) >= CHECKPOINT_INTERVAL:
+                checkpoint()
+
+        async def enrich_city(result, stored):
+            try:
+                await self.enricher.enrich(result.businesses)
+                write_city(result, stored)
+            finally:
+                enrichment_slots.release()
+
+        def enrichment_done(task):
+            enrichments.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                enrichment_errors.append(task.exception())
+
+        # Cities whose leads are being enriched; an interrupted run leaves them pending in the journal
+        enrichments = set()
+        # Searching pauses while this many cities wait for their websites
+        enrichment_slots = asyncio.Semaphore(ENRICH_MAX_PENDING_CITIES)
+        # A city that couldn't be enriched or written fails the run, as it would without --enrich
+        enrichment_errors = []
+        live_metrics = asyncio.ensure_future(stream_metrics()) if metrics_interval else None
+        try:
+            async for result in self.search_cities(cities):
+                if enrichment_errors:
+                    raise enrichment_errors[0]
+                new_leads = 0
+                if result.ok:
+                    stored = []
+                    new_leads = len(result.businesses)
+                    if new_leads_writer:
+                        stored = self.lead_store.upsert(result.businesses, journal.run_id, self.business_type)
+                        new_leads = len(stored)
+                    split_cells += bool(result.children)
+                    if self.enricher:
+                        await enrichment_slots.acquire()
+                        task = asyncio.ensure_future(enrich_city(result, stored))
+                        enrichments.add(task)
+                        task.add_done_callback(enrichment_done)
+                    else:
+                        write_city(result, stored)
+                else:
+                    failed_cities += 1
+                if self.budget:
+                    self.budget.record(self.scheduler.summary(), new_leads, self)
+
+                if on_city:
+                    on_city(result)
+            if enrichments:
+                await asyncio.gather(*enrichments)
+            if enrichment_errors:
+                raise enrichment_errors[0]
+        finally:
+            # Finalize whatever was collected, even if the run was interrupted
+            for task in enrichments:
+                task.cancel()
+            if live_metrics:
+                live_metrics.cancel()
+            checkpoint()
+            good_leads_writer.close()
+            bad_leads_writer.close()
+            if new_leads_writer:
+                new_leads_writer.close()
+            summary = export_metrics()
+
+        summary['metrics_file'] = metrics_file
+        summary['prometheus_file'] = prometheus_file
+        return summary
+
+    def collect_metrics(self, summary):
+        # Copies the run totals from a run() summary into self.metrics and
+        # returns the estimated Places API cost in USD. Searches sharing
+        # another's scheduler can't tell their requests apart and return None.
+        metrics = self.metrics
+        for kind in ('valid_leads', 'invalid_leads', 'no_keyword', 'excluded', 'duplicates', 'no_number'):
+            metrics.set('leads', summary[kind], kind=kind)
+        metrics.set_total('details_calls_saved_total', summary['details_calls_saved'])
+        if 'cities_not_searched' in summary:
+            metrics.set('cities_not_searched', summary['cities_not_searched'])
+        for page, counts in summary['pages'].items():
+            metrics.set_total('page_results_total', counts.get('results', 0), page=page)
+            metrics.set_total('page_leads_total', counts.get('leads', 0), page=page)
+        if not self.owns_session:
+            return None
+
+        total_cost = 0
+        for endpoint, counts in summary['requests'].items():
+            for event, count in counts.items():
+                metrics.set_total('api_requests_total', count, endpoint=endpoint, event=event)
+            cost = counts['calls'] * PLACES_COST_PER_1000.get(endpoint, 0) / 1000
+            metrics.set('estimated_cost_usd', cost, endpoint=endpoint)
+            total_cost += cost
+        for endpoint, counts in summary['cache'].items():
+            metrics.set_total('cache_hits_total', counts['hits'], endpoint=endpoint)
+            metrics.set_total('cache_misses_total', counts['misses'], endpoint=endpoint)
+        for event, count in summary.get('websites', {}).items():
+            metrics.set_total('websites_total', count, event=event)
+        if summary['valid_leads']:
+            metrics.set('estimated_cost_per_lead_usd', total_cost / summary['valid_leads'])
+        return total_cost
+
+
+class LeadBatch:
+    """
+    Runs several niches, each a LeadSearch with its own run journal, as one batch.
+
+    The niches share one HTTP session, request scheduler, response cache and
+    place details store, so a business found by several niches is only
+    looked up once and all requests count against the same rate limits.
+    Duplicate tracking and output files stay separate per niche. The shared
+    resources are opened with the options given here; the niches' own
+    connection options are ignored.
+    """
+
+    def __init__(
+        self,
+        searches,
+        api_key=GOOGLE_PLACES_API_KEY,
+        max_in_flight=MAX_IN_FLIGHT,
+        textsearch_qps=TEXTSEARCH_QPS,
+        details_qps=DETAILS_QPS,
+        cache=CACHE_ENABLED,
+        refresh=False,
+        places_api_url=PLACES_API_URL,
+        store=LEAD_STORE_ENABLED,
+        enrich=ENRICH_ENABLED
+    ):
+        self.searches = searches
+        self.shared = LeadSearch(
+            'batch',
+            api_key=api_key,
+            max_in_flight=max_in_flight,
+            textsearch_qps=textsearch_qps,
+            details_qps=details_qps,
+            cache=cache,
+            refresh=refresh,
+            places_api_url=places_api_url,
+            store=store,
+            enrich=enrich
+        )
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def open(self):
+        await self.shared.open()
+        for search in self.searches:
+            await search.open(shared=self.shared)
+
+    async def close(self):
+        for search in self.searches:
+            await search.close()
+        await self.shared.close()
+
+    async def run(self, batch_id, journals, output_dir=LEADS_DIR, on_city=None, metrics_interval=None, prometheus_file=None):
+        """
+        Run every niche against its journal concurrently.
+
+        on_city is called with (search, result) for each completed city.
+        Returns the per-niche run() summaries and a batch summary with the
+        shared request, cache and cost totals, which are also written as
+        <batch_id>.metrics.json and a Prometheus textfile (<batch_id>.prom
+        unless prometheus_file is given) next to the journals. With
+        metrics_interval, the batch's and each niche's metrics files are
+        also written every metrics_interval seconds.
+        """
+        def niche_callback(search):
+            return (lambda result: on_city(search, result)) if on_city else None
+
+        runs_dir = os.path.dirname(journals[0].path) if journals else RUNS_DIR
+        metrics_file = os.path.join(runs_dir, f"{batch_id}.metrics.json")
+        prometheus_file = prometheus_file or os.path.join(runs_dir, f"{batch_id}.prom")
+
+        async def stream_metrics():
+            # Request metrics as they are recorded; the batch totals are added at the end
+            while True:
+                await asyncio.sleep(metrics_interval)
+                self.shared.metrics.write(metrics_file, prometheus_file)
+
+        # Niches sharing a budget take turns from their first city on
+        budgeted = [search for search in self.searches if search.budget]
+        for search in budgeted:
+            search.budget.join(search)
+        live_metrics = asyncio.ensure_future(stream_metrics()) if metrics_interval else None
+        try:
+            summaries = await asyncio.gather(*(
+                search.run(journal, output_dir, on_city=niche_callback(search), metrics_interval=metrics_interval)
+                for search, journal in zip(self.searches, journals)
+            ))
+        finally:
+            if live_metrics:
+                live_metrics.cancel()
+            for search in budgeted:
+                search.budget.leave(search)
+
+        pages = defaultdict(Counter)
+        for summary in summaries:
+            for page, counts in summary['pages'].items():
+                pages[page].update(counts)
+        batch = {
+            'batch_id': batch_id,
+            'niches': len(summaries),
+            'pages': {page: dict(counts) for page, counts in sorted(pages.items())},
+            'requests': self.shared.scheduler.summary(),
+            'cache': self.shared.cache.summary() if self.shared.cache else {},
+            'websites': self.shared.enricher.summary() if self.shared.enricher else {},
+        }
+        for key in ('valid_leads', 'invalid_leads', 'no_keyword', 'excluded', 'duplicates', 'no_number',
+                    'failed_cities', 'details_calls_saved'):
+            batch[key] = sum(summary[key] for summary in summaries)
+        batch['new_leads'] = sum(summary['new_leads'] for summary in summaries) if self.shared.lead_store else None
+        batch['estimated_cost'] = self.shared.collect_metrics(batch)
+
+        batch['metrics_file'] = metrics_file
+        batch['prometheus_file'] = prometheus_file
+        self.shared.metrics.write(batch['metrics_file'], batch['prometheus_file'])
+        return summaries, batch
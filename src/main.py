@@ -1,455 +1,317 @@
-import requests
-import json
-import csv
 import time
-import concurrent.futures
-import sys
+
+# Measured before anything else is imported so --debug can report startup cost
+STARTUP_TIME = time.perf_counter()
+
+import argparse
+import logging
 import os
+import sys
 from datetime import datetime
+
 from colorama import Fore, Back, Style, init
-from geopy.geocoders import Nominatim
-import us
-from urllib.request import urlopen
-from io import StringIO
-import argparse
-from geonamescache import GeonamesCache
-from geonamescache.mappers import country
-from threading import local
-import logging
-from openai import OpenAI
-import threading
-import asyncio
-import aiohttp
+
 from config import (
     GOOGLE_PLACES_API_KEY,
     OPENAI_API_KEY,
     BUSINESS_TYPE,
-    MAX_RETRIES,
-    BACKOFF_TIME
+    MAX_IN_FLIGHT,
+    TEXTSEARCH_QPS,
+    DETAILS_QPS,
+    DETAILS_PER_CITY,
+    LEADS_DIR,
+    CACHE_ENABLED,
+    RUNS_DIR,
+    MAX_PAGES,
+    LEAD_STORE_ENABLED,
+    OUTPUT_FORMAT,
+    YIELD_WINDOW,
+    ENRICH_ENABLED
 )
-from data_handler import save_to_csv as save_to_csv_handler
-
-client = OpenAI(api_key=OPENAI_API_KEY)
-
-# Initialize thread-local storage for sessions
-thread_local = local()
-
-def get_session():
-    if not hasattr(thread_local, "session"):
-        thread_local.session = requests.Session()
-    return thread_local.session
-
-# API key for Google Places API (imported from environment variable)
-API_KEY = GOOGLE_PLACES_API_KEY
-
-if not API_KEY:
-    print("Error: GOOGLE_PLACES_API_KEY environment variable is not set.")
-    sys.exit(1)
-
-if not OPENAI_API_KEY:
-    print("Error: OPENAI_API_KEY environment variable is not set.")
-    sys.exit(1)
-
-parser = argparse.ArgumentParser(description="Search for businesses in US states.")
-parser.add_argument("--all-states", action="store_true", help="Search in major cities of all states")
-parser.add_argument("--state", help="Two-letter state abbreviation to search for cities")
-parser.add_argument("-n", "--number", type=int, default=100, help="Number of cities to process (default: 100)")
-parser.add_argument("business_type", nargs="?", default="Lighting and Holiday", help="Type of business to search for")
-parser.add_argument('--debug', action='store_true', help='Enable debug mode')
-parser.add_argument('-k', '--keywords', help="Additional comma-separated keywords to extend the search")
-args = parser.parse_args()
-
-# Initialize colorama
-init(autoreset=True)
-
-# Replace the existing logging configuration with this
-if args.debug:
-    class ColoredFormatter(logging.Formatter):
-        COLORS = {
-            'DEBUG': Fore.CYAN,
-            'INFO': Fore.GREEN,
-            'WARNING': Fore.YELLOW,
-            'ERROR': Fore.RED,
-            'CRITICAL': Fore.RED + Back.WHITE
-        }
-
-        def format(self, record):
-            color = self.COLORS.get(record.levelname, '')
-            message = super().format(record)
-            return f"{color}{message}{Style.RESET_ALL}"
-
-    handler = logging.StreamHandler()
-    handler.setFormatter(ColoredFormatter('%(asctime)s - %(levelname)s - %(message)s'))
-    logging.basicConfig(level=logging.DEBUG, handlers=[handler])
-else:
-    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
-
-def get_location_coordinates(location):
-    geolocator = Nominatim(user_agent="my_app")
-    try:
-        location_data = geolocator.geocode(location)
-        if location_data:
-            return f"{location_data.latitude},{location_data.longitude}"
-    except Exception as e:
-        print(f"Error getting coordinates for {location}: {str(e)}")
-    return None
-
-async def get_place_details(session, place_id):
-    url = f"https://maps.googleapis.com/maps/api/place/details/json?place_id={place_id}&fields=formatted_phone_number,website&key={API_KEY}"
-    async with session.get(url) as response:
-        result = await response.json()
-        details = result.get('result', {})
-        return details.get('formatted_phone_number'), details.get('website')
-
-# Initialize a set to track unique businesses based on (name, phone)
-unique_businesses = set()
-
-# Update the is_duplicate function
-def is_duplicate(business):
-    identifier = (business['NAME'].strip().lower(), business['PHONE'].strip())
-    if identifier in unique_businesses:
-        return True
-    unique_businesses.add(identifier)
-    return False
-
-# Update the search_businesses function
-async def search_businesses(session, location, business_type, enhanced_query, keywords):
-    businesses = []
-    bad_leads = []
-    skipped_businesses = 0
-    duplicates = 0
-    url = f"https://maps.googleapis.com/maps/api/place/textsearch/json?query={enhanced_query}+in+{location}&key={API_KEY}"
-
-    async with session.get(url) as response:
-        results = await response.json()
-
-    if 'error_message' in results:
-        print(f"\nAPI Error for {location}: {results['error_message']}")
-        return businesses, bad_leads, skipped_businesses, duplicates
-
-    total_results = len(results.get('results', []))
-    valid_leads = 0
-    invalid_leads = 0
-
-    for result in results.get('results', []):
-        business_name = result['name'].lower()
-        if any(keyword in business_name for keyword in keywords):
-            phone_number, website = await get_place_details(session, result.get('place_id'))
-            city, state = location.split(',')
-            business = {
-                'NAME': result['name'],
-                'PHONE': phone_number if phone_number else 'N/A',
-                'WEBSITE': website if website else 'N/A',
-                'STATE/CITY': f"{state.strip()}, {city.strip()}",
-                'RATING': result.get('rating', 'N/A'),
-                'REVIEWS': result.get('user_ratings_total', 'N/A'),
-                'REASON': ''
-            }
-            
-            if is_duplicate(business):
-                business['REASON'] = 'duplicate'
-                bad_leads.append(business)
-                duplicates += 1
-                invalid_leads += 1
-            elif not phone_number:
-                business['REASON'] = 'no_number'
-                bad_leads.append(business)
-                skipped_businesses += 1
-                invalid_leads += 1
-            else:
-                businesses.append(business)
-                valid_leads += 1
-        else:
-            city, state = location.split(',')
-            bad_lead = {
-                'NAME': result['name'],
-                'PHONE': 'N/A',
-                'WEBSITE': 'N/A',
-                'STATE/CITY': f"{state.strip()}, {city.strip()}",
-                'RATING': result.get('rating', 'N/A'),
-                'REVIEWS': result.get('user_ratings_total', 'N/A'),
-                'REASON': 'no_keyword'
+from formats import FORMATS
+from matcher import MATCH_MODES
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Search for businesses in US states.")
+    parser.add_argument("--all-states", action="store_true", help="Search in major cities of all states")
+    parser.add_argument("--state", help="Two-letter state abbreviation to search for cities")
+    parser.add_argument("-n", "--number", type=int, default=100, help="Number of cities to process (default: 100)")
+    parser.add_argument("business_type", nargs="?", default=BUSINESS_TYPE, help="Type of business to search for")
+    parser.add_argument('--debug', action='store_true', help='Enable debug mode')
+    parser.add_argument('-k', '--keywords', help="Additional comma-separated keywords to extend the search")
+    parser.add_argument('-x', '--exclude', help="Comma-separated negative keywords; matching businesses are skipped")
+    parser.add_argument('--match-mode', choices=MATCH_MODES, default='substring', help="How keywords match business names (default: substring)")
+    parser.add_argument('--max-in-flight', type=int, default=MAX_IN_FLIGHT, help=f"Maximum concurrent Places API requests (default: {MAX_IN_FLIGHT})")
+    parser.add_argument('--textsearch-qps', type=float, default=TEXTSEARCH_QPS, help=f"Text search requests per second (default: {TEXTSEARCH_QPS})")
+    parser.add_argument('--details-qps', type=float, default=DETAILS_QPS, help=f"Place details requests per second (default: {DETAILS_QPS})")
+    parser.add_argument('--cache', action=argparse.BooleanOptionalAction, default=CACHE_ENABLED, help="Use the local Places API response cache (default: enabled)")
+    parser.add_argument('--store', action=argparse.BooleanOptionalAction, default=LEAD_STORE_ENABLED, help="Record valid leads in the cross-run lead store and write the new ones separately (default: enabled)")
+    parser.add_argument('--refresh', action='store_true', help="Ignore cached responses but store fresh ones in the cache")
+    parser.add_argument('--resume', metavar='RUN_ID', help="Resume an interrupted run, processing only its pending cities")
+    parser.add_argument('--refresh-keywords', action='store_true', help="Regenerate the enhanced query and keywords instead of using the cached ones")
+    parser.add_argument('--max-pages', type=int, default=MAX_PAGES, choices=range(1, 4), metavar='{1,2,3}', help=f"Text search result pages per city, 20 results each (default: {MAX_PAGES})")
+    parser.add_argument('--grid', action='store_true', help="Search density-sized grid cells covering each state instead of named cities")
+    parser.add_argument('--metrics-interval', type=float, metavar='SECONDS', help="Also write the metrics files every SECONDS while the run is in progress")
+    parser.add_argument('--prometheus-file', metavar='PATH', help="Where to write the Prometheus textfile (default: next to the run journal)")
+    parser.add_argument('--batch', metavar='FILE', help="Search every business type listed in FILE in one run (one per line: type | keywords | exclude)")
+    parser.add_argument('--shard', metavar='i/N', help="Only search the cities of shard i out of N (0-based); the split is the same on every machine")
+    parser.add_argument('--run-id', help="Run ID to use instead of the current time, e.g. the same one for every shard")
+    parser.add_argument('--workers', type=int, help="Split the run into this many shards, run them as local processes and merge their output")
+    parser.add_argument('--merge', metavar='RUN_ID', help="Merge and deduplicate the lead files of every shard of RUN_ID, then exit")
+    parser.add_argument('--prioritize', action=argparse.BooleanOptionalAction, default=True,
+                        help="Search the cities expected to find the most new leads first, from earlier runs' results (default: enabled)")
+    parser.add_argument('--max-api-calls', type=int, metavar='N', help="Stop starting new cities once the run is about to exceed N Places API calls")
+    parser.add_argument('--max-cost', type=float, metavar='USD', help="Stop starting new cities once the estimated Places API cost is about to exceed USD")
+    parser.add_argument('--min-yield', type=float, metavar='LEADS', help=f"Stop starting new cities once the last {YIELD_WINDOW} cities found fewer than LEADS new leads per dollar")
+    parser.add_argument('--output-format', choices=list(FORMATS), default=OUTPUT_FORMAT,
+                        help=f"Format of the leads files; parquet needs pyarrow (default: {OUTPUT_FORMAT})")
+    parser.add_argument('--enrich', action=argparse.BooleanOptionalAction, default=ENRICH_ENABLED,
+                        help="Look up contact emails and social links on the valid leads' websites (default: disabled)")
+    parser.add_argument('--details-per-city', type=int, default=DETAILS_PER_CITY, help=f"Concurrent place details lookups per city (default: {DETAILS_PER_CITY})")
+    return parser
+
+
+def configure_logging(debug):
+    if debug:
+        class ColoredFormatter(logging.Formatter):
+            COLORS = {
+                'DEBUG': Fore.CYAN,
+                'INFO': Fore.GREEN,
+                'WARNING': Fore.YELLOW,
+                'ERROR': Fore.RED,
+                'CRITICAL': Fore.RED + Back.WHITE
             }
-            bad_leads.append(bad_lead)
-            invalid_leads += 1
-
-    logging.debug(f"{Fore.MAGENTA}Location: {location}{Style.RESET_ALL}")
-    logging.debug(f"{Fore.CYAN}Total results: {total_results}{Style.RESET_ALL}")
-    logging.debug(f"{Fore.GREEN}Valid leads: {valid_leads}{Style.RESET_ALL}")
-    logging.debug(f"{Fore.RED}Invalid leads: {invalid_leads}{Style.RESET_ALL}")
-    logging.debug(f"{Fore.YELLOW}Duplicates: {duplicates}{Style.RESET_ALL}")
-
-    return businesses, bad_leads, skipped_businesses, invalid_leads, duplicates
-
-# Update the process_city function
-async def process_city(session, city, business_type, enhanced_query, keywords):
-    start_time_city = time.time()
-    businesses, bad_leads, skipped_businesses, invalid_leads, duplicates = await search_businesses(session, city, business_type, enhanced_query, keywords)
-    logging.debug(f"Time taken for {city}: {time.time() - start_time_city:.2f} seconds")
-    return city, businesses, bad_leads, skipped_businesses, invalid_leads, duplicates
-
-# Update the save_to_csv function
-def save_to_csv(businesses, filename):
-    with open(filename, 'w', newline='', encoding='utf-8') as file:
-        writer = csv.DictWriter(file, fieldnames=['NAME', 'PHONE', 'WEBSITE', 'STATE/CITY', 'RATING', 'REVIEWS', 'REASON'])
-        writer.writeheader()
-        writer.writerows(businesses)
-
-def get_cities_by_state(state_input=None, all_states=False, num_cities=100, min_population=10000):
-    logging.debug(f"Starting get_cities_by_state with state_input={state_input}, all_states={all_states}, num_cities={num_cities}")
-    start_time = time.time()
-    
-    gc = GeonamesCache()
-    us_cities = gc.get_cities()
-    
-    logging.debug(f"Loaded GeonamesCache in {time.time() - start_time:.2f} seconds")
-
-    def get_state_from_input(input_str):
-        if input_str:
-            state = us.states.lookup(input_str)
-            if not state:
-                state = next((s for s in us.states.STATES if s.name.lower() == input_str.lower()), None)
-            return state
-        return None
 
-    def get_cities_for_state(state, us_cities, min_population, num_cities):
-        cities = []
-        for geoname_id, city_info in us_cities.items():
-            if city_info['countrycode'] == 'US' and city_info['admin1code'] == state.abbr:
-                if city_info['population'] >= min_population:
-                    city_name = f"{city_info['name']}, {state.abbr}"
-                    cities.append((city_name, city_info['population']))
-        
-        cities.sort(key=lambda x: x[1], reverse=True)
-        top_cities = [city[0] for city in cities[:num_cities]]
-        
-        capital_city = f"{state.capital}, {state.abbr}"
-        if capital_city not in top_cities:
-            top_cities.insert(0, capital_city)
-        
-        return top_cities[:num_cities]
-
-    if all_states:
-        states_dict = {}
-        for state in us.states.STATES:
-            if not state.is_territory:
-                cities = get_cities_for_state(state, us_cities, min_population, num_cities)
-                states_dict[state.abbr] = cities
-        logging.debug(f"Processed all states in {time.time() - start_time:.2f} seconds")
-        return states_dict
-    elif state_input:
-        state = get_state_from_input(state_input)
-        if not state:
-            raise ValueError(f"Invalid state input: {state_input}")
-
-        cities = get_cities_for_state(state, us_cities, min_population, num_cities)
-        logging.debug(f"Processed single state {state.abbr} in {time.time() - start_time:.2f} seconds")
-        print(f"Number of cities found for {state.name} ({state.abbr}): {len(cities)}")
-        return {state.abbr: cities}
+            def format(self, record):
+                color = self.COLORS.get(record.levelname, '')
+                message = super().format(record)
+                return f"{color}{message}{Style.RESET_ALL}"
+
+        handler = logging.StreamHandler()
+        handler.setFormatter(ColoredFormatter('%(asctime)s - %(levelname)s - %(message)s'))
+        logging.basicConfig(level=logging.DEBUG, handlers=[handler])
     else:
-        logging.debug("No state input or all_states flag, defaulting to all states")
-        return get_cities_by_state(all_states=True, num_cities=num_cities)
+        logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def build_budget(args):
+    from planner import Budget
+
+    if args.max_api_calls is None and args.max_cost is None and args.min_yield is None:
+        return None
+    return Budget(args.max_api_calls, args.max_cost, args.min_yield)
+
+
+def print_cities_found(args, cities_by_state):
+    # For a single --state, how many of its cities (or grid cells) will be searched
+    if args.state and not args.all_states:
+        from leadgen import get_state_from_input
+
+        state = get_state_from_input(args.state)
+        print(f"Number of cities found for {state.name} ({state.abbr}): {len(cities_by_state.get(state.abbr, []))}")
+
+
+def print_websites(websites):
+    # Website enrichment totals from a run or batch summary, if it was enabled
+    if not websites:
+        return
+    print(f"{Style.BRIGHT}{Fore.GREEN}Leads with an email from their website: {websites.get('leads_with_email', 0)} of {websites.get('leads', 0)}")
+    print(f"{Style.BRIGHT}{Fore.YELLOW}Websites: {websites.get('fetched', 0)} fetched, {websites.get('cached', 0)} from cache, "
+          f"{websites.get('failed', 0)} unreachable, {websites.get('truncated', 0)} pages cut at the size limit")
 
-def generate_enhanced_query_and_keywords(original_query, additional_keywords=None):
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that generates concise and relevant enhanced search queries for residential services."},
-                {"role": "user", "content": f"""Generate a concise enhanced search query for the business type: '{original_query}', focusing on residential services for homeowners. The enhanced query should be 2-3 words long, specific, and targeted to improve search results. Avoid unnecessary adjectives or commercial terms.
-
-Also, provide a list of 10-15 relevant keywords or partial keywords, prioritizing residential-related terms. Include 'exterior' and 'contract' (to cover terms like contracting, contractor) in the keywords. Partial keywords are encouraged to match variations (e.g., 'illumin' for illuminate, illumination, etc.). Use 'light' instead of 'lights' to match both singular and plural forms.
-
-Respond with the enhanced query on one line, followed by the keywords list on the next line, separated by commas. Example response format:
-Enhanced Query: Residential Roofing
-Keywords: roof, repair, install, exterior, contract, shingl, homeown, resident, light, ..."""}
-            ]
-        )
-        result = response.choices[0].message.content.strip().split('\n')
-        enhanced_query = result[0].split(': ')[1].strip()
-        keywords = result[1].split(': ')[1].strip().split(', ')
-        
-        # Add additional keywords if provided
-        if additional_keywords:
-            keywords.extend([kw.strip() for kw in additional_keywords.split(',')])
-        
-        # Ensure each word in the enhanced query is in keywords
-        keywords.extend(word for word in enhanced_query.split() if word not in keywords)
-
-        keywords = list(set([word.lower() for word in keywords]))  # Remove duplicates and convert to lowercase
-
-        return enhanced_query, keywords
-    except Exception as e:
-        print(f"Error generating enhanced query and keywords: {str(e)}")
-        return original_query, []
-
-# Add this function at the beginning of your file
-def print_legend():
-    print(f"\nLegend: {Fore.RED}0 leads {Fore.YELLOW}1-4 leads {Fore.BLUE}5-14 leads {Fore.GREEN}15+ leads{Style.RESET_ALL}")
-
-# Update the display_progress function
-def display_progress(city, result, start_time, completed_cities, total_cities):
-    runtime = (datetime.now() - start_time).total_seconds()
-    
-    if result['status'] == 'Completed':
-        data = result['data']
-        if data['leads'] >= 15:
-            color = Fore.GREEN
-        elif data['leads'] >= 5:
-            color = Fore.BLUE
-        elif data['leads'] > 0:
-            color = Fore.YELLOW
-        else:
-            color = Fore.RED
-        print(f"{color}{city:<20} {data['leads']:<8} {data['invalid_leads']:<15} {data['duplicates']:<10} {runtime:.2f}s{' ':<8} {completed_cities}/{total_cities}")
-    elif result['status'] == 'Error':
-        print(f"{Fore.RED}{city:<20} {'ERROR':<8} {'N/A':<15} {'N/A':<10} {runtime:.2f}s{' ':<8} {completed_cities}/{total_cities}")
-
-    sys.stdout.flush()
 
 # Add this function to ensure the directory exists
 def ensure_directory(directory):
     if not os.path.exists(directory):
         os.makedirs(directory)
 
-def deduplicate_businesses(businesses):
-    deduped = []
-    seen = set()
-    for business in businesses:
-        identifier = (business['NAME'].strip().lower(), business['PHONE'].strip())
-        if identifier not in seen:
-            deduped.append(business)
-            seen.add(identifier)
-    return deduped
-
-async def main_async():
+
+async def main_async(args):
     """
     Main function to run the business search and data saving process.
     """
+    import asyncio
+    from leadgen import LeadSearch, get_cities_by_state, expand_query, start_run, load_batch
+    from shard import shard_cities, shard_run_id
+    from journal import RunJournal
+    from utils import print_legend, display_progress
+
+    if args.batch or (args.resume and load_batch(args.resume) is not None):
+        await batch_async(args)
+        return
 
-    init(autoreset=True)  # Initialize colorama
     start_time = datetime.now()
 
-    # Get cities grouped by state based on arguments
-    try:
+    # Create the ../leads directory if it doesn't exist
+    leads_directory = LEADS_DIR
+    ensure_directory(leads_directory)
+
+    if args.resume:
+        # Pick up the plan, query and output files of an interrupted run
+        journal = RunJournal(RUNS_DIR, args.resume)
+        if not journal.exists:
+            logging.error(f"No run journal found for run ID {args.resume}")
+            sys.exit(1)
+        business_type = journal.run['business_type']
+        cities_by_state = journal.pending_cities()
+        enhanced_query = journal.run['enhanced_query']
+        keywords = journal.run['keywords']
+        exclude_keywords = journal.run.get('exclude_keywords', [])
+        match_mode = journal.run.get('match_mode', 'substring')
+    else:
+        business_type = args.business_type
+
+        # Plan the cities in a worker thread while the query expansion runs,
+        # so the LLM call is not on the critical path
         start_time_cities = time.time()
-        cities_by_state = get_cities_by_state(args.state, args.all_states, args.number)
-        logging.debug(f"Total time to get cities: {time.time() - start_time_cities:.2f} seconds")
-    except ValueError as ve:
-        logging.error(str(ve))
-        sys.exit(1)
+        planning = asyncio.to_thread(get_cities_by_state, args.state, args.all_states, args.number, grid=args.grid)
+        expansion = expand_query(business_type, args.keywords, refresh=args.refresh_keywords)
+        results = await asyncio.gather(planning, expansion, return_exceptions=True)
+        planning_time = time.time() - start_time_cities
+        logging.debug(f"Total time to get cities and keywords: {planning_time:.2f} seconds")
+
+        # Get cities grouped by state based on arguments
+        if isinstance(results[0], ValueError):
+            logging.error(str(results[0]))
+            sys.exit(1)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        cities_by_state, (enhanced_query, keywords) = results
+        print_cities_found(args, cities_by_state)
+
+        exclude_keywords = [kw.strip() for kw in args.exclude.split(',')] if args.exclude else []
+        match_mode = args.match_mode
+
+        if args.shard:
+            cities_by_state = shard_cities(cities_by_state, *args.shard)
+        run_id = args.run_id or datetime.now().strftime("%Y%m%d_%H%M%S")
+        if args.shard:
+            run_id = shard_run_id(run_id, *args.shard)
+        journal = start_run(run_id, business_type, enhanced_query, keywords, cities_by_state, exclude_keywords, match_mode, args.grid,
+                            output_format=args.output_format)
 
     total_cities = sum(len(cities) for cities in cities_by_state.values())
     states = list(cities_by_state.keys())
-    
+
     # Print the introduction
     print(f"\n{Fore.GREEN}Starting business search process:")
-    print(f"{Fore.GREEN}- Searching for: {args.business_type}")
+    print(f"{Fore.GREEN}- Searching for: {business_type}")
     print(f"{Fore.GREEN}- Total cities to search: {total_cities}")
+    if args.resume:
+        print(f"{Fore.GREEN}- Already completed: {len(journal.completed_cities)} cities")
     print(f"{Fore.GREEN}- States included: {', '.join(states)}")
 
     # Print the legend
     print_legend()
 
-    # Generate the enhanced query using GPT-4 Mini
-    print(f"\n{Style.BRIGHT}{Fore.MAGENTA}Original Search Query: {args.business_type}")
-    enhanced_query, keywords = generate_enhanced_query_and_keywords(args.business_type, args.keywords)
+    print(f"\n{Style.BRIGHT}{Fore.MAGENTA}Original Search Query: {business_type}")
     logging.info(f"Enhanced query: {enhanced_query}")
     logging.info(f"Keywords: {keywords}")
     print(f"{Style.BRIGHT}{Fore.MAGENTA}Enhanced Search Query: {enhanced_query}")
     print(f"{Style.BRIGHT}{Fore.MAGENTA}Keywords: {', '.join(keywords)}")
+    if exclude_keywords:
+        print(f"{Style.BRIGHT}{Fore.MAGENTA}Excluded keywords: {', '.join(exclude_keywords)}")
+    print(f"{Style.BRIGHT}{Fore.MAGENTA}Run ID: {journal.run_id} (resume with --resume {journal.run_id})")
 
     print(f"\n{Style.BRIGHT}{Fore.CYAN}{'City, State':<20} {'Leads':<8} {'Invalid Leads':<15} {'Dups':<10} {'Runtime':<15} {'Progress'}")
     print(f"{Style.BRIGHT}{Fore.CYAN}{'-'*85}")
 
-    all_businesses = []
-    all_bad_leads = []
-    businesses_without_numbers = 0
-    total_duplicates = 0
-
     completed_cities = 0
-    total_cities = sum(len(cities) for cities in cities_by_state.values())
 
-    async with aiohttp.ClientSession() as session:
-        tasks = []
-        for state, cities in cities_by_state.items():
-            for city in cities:
-                tasks.append(process_city(session, city, args.business_type, enhanced_query, keywords))
-
-        for completed_task in asyncio.as_completed(tasks):
-            try:
-                city, businesses, bad_leads, skipped_businesses, invalid_leads, duplicates = await completed_task
-                all_businesses.extend(businesses)
-                all_bad_leads.extend(bad_leads)
-                businesses_without_numbers += skipped_businesses
-                total_duplicates += duplicates
-                completed_cities += 1
-
-                # Calculate averages and display progress
-                businesses_with_numbers = [b for b in businesses if b['PHONE'] != 'N/A']
-                avg_rating = sum(float(b['RATING']) for b in businesses_with_numbers if b['RATING'] != 'N/A') / len(businesses_with_numbers) if businesses_with_numbers else 0
-                total_reviews = sum(int(b['REVIEWS']) for b in businesses_with_numbers if b['REVIEWS'] != 'N/A')
-
-                display_progress(city, {
-                    'status': 'Completed',
-                    'data': {
-                        'leads': len(businesses_with_numbers),
-                        'invalid_leads': invalid_leads,
-                        'duplicates': duplicates
-                    }
-                }, start_time, completed_cities, total_cities)
-            except Exception as e:
-                logging.error(f"Error processing task: {str(e)}")
+    def on_city(result):
+        nonlocal completed_cities, total_cities
+        completed_cities += 1
+        # Split grid cells queue their quadrants
+        total_cities += len(result.children)
+        if not result.ok:
+            display_progress(result.label, {'status': 'Error'}, start_time, completed_cities, total_cities)
+            return
+        display_progress(result.label, {
+            'status': 'Completed',
+            'data': {
+                'leads': len(result.leads),
+                'invalid_leads': result.invalid_leads,
+                'duplicates': result.duplicates
+            }
+        }, start_time, completed_cities, total_cities)
+
+    search = LeadSearch(
+        business_type,
+        enhanced_query,
+        keywords,
+        exclude_keywords=exclude_keywords,
+        match_mode=match_mode,
+        max_in_flight=args.max_in_flight,
+        textsearch_qps=args.textsearch_qps,
+        details_qps=args.details_qps,
+        details_per_city=args.details_per_city,
+        max_pages=args.max_pages,
+        cache=args.cache,
+        refresh=args.refresh,
+        store=args.store,
+        prioritize=args.prioritize,
+        budget=build_budget(args),
+        enrich=args.enrich
+    )
+    if not args.resume:
+        search.metrics.set('planning_seconds', planning_time)
+    async with search:
+        summary = await search.run(
+            journal,
+            leads_directory,
+            on_city=on_city,
+            metrics_interval=args.metrics_interval,
+            prometheus_file=args.prometheus_file
+        )
 
     print("\nProcessing completed. Preparing final results...")
 
-    # Replace the existing counts with deduplicated counts
-    # Deduplicate the businesses
-    all_businesses = deduplicate_businesses(all_businesses)
-    all_bad_leads = deduplicate_businesses(all_bad_leads)
-
-    # Recalculate counts based on deduplicated data
-    didnt_match_keywords = sum(1 for lead in all_bad_leads if lead.get('REASON') == "no_keyword")
-    total_duplicates = sum(1 for lead in all_bad_leads if lead.get('REASON') == "duplicate")
-    no_phone_number = sum(1 for lead in all_bad_leads if lead.get('REASON') == "no_number")
-    total_leads = len(all_businesses) + len(all_bad_leads)
-
     try:
-        # Create the ../leads directory if it doesn't exist
-        leads_directory = os.path.join(os.path.dirname(os.path.dirname(__file__)), "leads")
-        ensure_directory(leads_directory)
-
-        # Update the filenames to include the full path and timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        good_leads_filename = os.path.join(leads_directory, f"leads_{timestamp}.csv")
-        bad_leads_filename = os.path.join(leads_directory, f"bad-leads_{timestamp}.csv")
-
-        # Update the saving part
-        print(f"Saving {len(all_businesses)} good leads...")
-        save_to_csv_handler(all_businesses, good_leads_filename)
-        
-        print(f"Saving {len(all_bad_leads)} bad leads...")
-        save_to_csv_handler(all_bad_leads, bad_leads_filename)
-
-        # Update image paths in the data (if needed)
-        for business in all_businesses + all_bad_leads:
-            if 'IMAGE' in business and business['IMAGE']:
-                old_path = business['IMAGE']
-                new_path = old_path.replace('imgs/', '../imgs/')
-                business['IMAGE'] = new_path
-
         total_runtime = datetime.now() - start_time
-        total_leads = len(all_businesses) + len(all_bad_leads)
-        
+        total_leads = summary['valid_leads'] + summary['invalid_leads']
+
         print(f"\n{Style.BRIGHT}{Fore.YELLOW}Total runtime: {total_runtime}")
         print(f"{Style.BRIGHT}{Fore.YELLOW}Total leads: {total_leads}")
-        print(f"{Style.BRIGHT}{Fore.RED}Total no numbers: {no_phone_number}")
-        print(f"{Style.BRIGHT}{Fore.RED}Total duplicates found: {total_duplicates}")
-        print(f"{Style.BRIGHT}{Fore.RED}Didn't match keywords: {didnt_match_keywords}")
-        print(f"{Style.BRIGHT}{Fore.RED}Total invalid leads: {len(all_bad_leads)}")
-        print(f"{Style.BRIGHT}{Fore.GREEN}Valid leads: {len(all_businesses)}")
-        print(f"{Style.BRIGHT}{Fore.YELLOW}Good leads saved as: {os.path.basename(good_leads_filename)}")
-        print(f"{Style.BRIGHT}{Fore.YELLOW}Bad leads saved as: {os.path.basename(bad_leads_filename)}")
+        print(f"{Style.BRIGHT}{Fore.RED}Total no numbers: {summary['no_number']}")
+        print(f"{Style.BRIGHT}{Fore.RED}Total duplicates found: {summary['duplicates']}")
+        print(f"{Style.BRIGHT}{Fore.RED}Didn't match keywords: {summary['no_keyword']}")
+        print(f"{Style.BRIGHT}{Fore.RED}Excluded by negative keywords: {summary['excluded']}")
+        print(f"{Style.BRIGHT}{Fore.RED}Total invalid leads: {summary['invalid_leads']}")
+        print(f"{Style.BRIGHT}{Fore.GREEN}Valid leads: {summary['valid_leads']}")
+        if summary['avg_rating'] is not None:
+            print(f"{Style.BRIGHT}{Fore.GREEN}Average rating of valid leads: {summary['avg_rating']:.2f}")
+        if summary['new_leads'] is not None:
+            print(f"{Style.BRIGHT}{Fore.GREEN}New leads (not found by earlier runs): {summary['new_leads']}")
+        print(f"{Style.BRIGHT}{Fore.RED}Failed cities: {summary['failed_cities']}")
+        if summary['budget_stop']:
+            print(f"{Style.BRIGHT}{Fore.YELLOW}Stopped early, {summary['budget_stop']}: {summary['cities_not_searched']} cities not searched "
+                  f"(search them with --resume {journal.run_id})")
+        if summary['split_cells']:
+            print(f"{Style.BRIGHT}{Fore.YELLOW}Grid cells split for density: {summary['split_cells']}")
+        requests = sum(counts['calls'] for counts in summary['requests'].values())
+        if summary['valid_leads']:
+            print(f"{Style.BRIGHT}{Fore.YELLOW}API calls per valid lead: {requests / summary['valid_leads']:.2f}")
+        print(f"{Style.BRIGHT}{Fore.YELLOW}Details calls saved by place_id reuse: {summary['details_calls_saved']}")
+        for page, counts in summary['pages'].items():
+            print(f"{Style.BRIGHT}{Fore.YELLOW}Page {page}: {counts['pages']} pages, {counts.get('results', 0)} results, "
+                  f"{counts.get('leads', 0)} valid leads ({counts.get('leads', 0) / counts['pages']:.1f} per page)")
+        for endpoint, counts in summary['requests'].items():
+            print(f"{Style.BRIGHT}{Fore.YELLOW}{endpoint} requests: {counts['calls']} "
+                  f"(retries: {counts['retries']}, throttled: {counts['throttled']}, gave up: {counts['gave_up']})")
+        for endpoint, counts in summary['cache'].items():
+            print(f"{Style.BRIGHT}{Fore.YELLOW}{endpoint} cache: {counts['hits']} hits, {counts['misses']} misses "
+                  f"({counts['hit_ratio']:.0%} hit ratio)")
+        print_websites(summary['websites'])
+        print(f"{Style.BRIGHT}{Fore.YELLOW}Estimated Places API cost: ${summary['estimated_cost']:.2f}"
+              + (f" (${summary['estimated_cost'] / summary['valid_leads']:.3f} per valid lead)" if summary['valid_leads'] else ""))
+        print(f"{Style.BRIGHT}{Fore.YELLOW}Metrics saved as: {summary['metrics_file']} and {summary['prometheus_file']}")
+        print(f"{Style.BRIGHT}{Fore.YELLOW}Good leads saved as: {os.path.basename(summary['good_leads_file'])}")
+        print(f"{Style.BRIGHT}{Fore.YELLOW}Bad leads saved as: {os.path.basename(summary['bad_leads_file'])}")
+        if summary['new_leads_file']:
+            print(f"{Style.BRIGHT}{Fore.YELLOW}New leads saved as: {os.path.basename(summary['new_leads_file'])}")
+        print(f"{Style.BRIGHT}{Fore.YELLOW}Per-state and per-city statistics saved as: {os.path.basename(summary['stats_file'])}")
         print(f"{Style.BRIGHT}{Fore.YELLOW}Leads saved in directory: {leads_directory}")
 
         print("\nScript completed successfully.")
@@ -457,9 +319,278 @@ async def main_async():
         print(f"\n{Fore.RED}An error occurred while finalizing results: {str(e)}")
         logging.exception("Error in finalizing results")
 
-if __name__ == "__main__":
+
+async def batch_async(args):
+    """
+    Run every niche of a batch file, or resume a batch, sharing one session,
+    scheduler, city plan and details store.
+    """
+    import asyncio
+    from leadgen import LeadSearch, LeadBatch, get_cities_by_state, expand_query, load_batch_file, load_batch, start_batch
+    from shard import shard_cities, shard_run_id
+    from utils import print_legend, display_progress
+
+    start_time = datetime.now()
+    leads_directory = LEADS_DIR
+    ensure_directory(leads_directory)
+
+    if args.resume:
+        batch_id = args.resume
+        journals = [journal for journal in load_batch(batch_id) if journal.exists]
+    else:
+        try:
+            niches = load_batch_file(args.batch)
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not read batch file {args.batch}: {str(e)}")
+            sys.exit(1)
+        if not niches:
+            logging.error(f"No business types found in {args.batch}")
+            sys.exit(1)
+
+        # One city plan for the whole batch, planned while every niche's query is expanded
+        start_time_cities = time.time()
+        planning = asyncio.to_thread(get_cities_by_state, args.state, args.all_states, args.number, grid=args.grid)
+        expansions = [expand_query(niche['business_type'], niche['keywords'], refresh=args.refresh_keywords) for niche in niches]
+        results = await asyncio.gather(planning, *expansions, return_exceptions=True)
+        logging.debug(f"Total time to get cities and keywords: {time.time() - start_time_cities:.2f} seconds")
+
+        if isinstance(results[0], ValueError):
+            logging.error(str(results[0]))
+            sys.exit(1)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        cities_by_state = results[0]
+        print_cities_found(args, cities_by_state)
+        for niche, (enhanced_query, keywords) in zip(niches, results[1:]):
+            niche['enhanced_query'] = enhanced_query
+            niche['keywords'] = keywords
+
+        if args.shard:
+            cities_by_state = shard_cities(cities_by_state, *args.shard)
+        batch_id = args.run_id or datetime.now().strftime("%Y%m%d_%H%M%S")
+        if args.shard:
+            batch_id = shard_run_id(batch_id, *args.shard)
+        journals = start_batch(batch_id, niches, cities_by_state, args.match_mode, args.grid, output_format=args.output_format)
+
+    # One budget for the whole batch, as its niches share the scheduler
+    budget = build_budget(args)
+    searches = [
+        LeadSearch(
+            journal.run['business_type'],
+            journal.run['enhanced_query'],
+            journal.run['keywords'],
+            exclude_keywords=journal.run.get('exclude_keywords', []),
+            match_mode=journal.run.get('match_mode', 'substring'),
+            details_per_city=args.details_per_city,
+            max_pages=args.max_pages,
+            prioritize=args.prioritize,
+            budget=budget,
+            enrich=args.enrich
+        )
+        for journal in journals
+    ]
+    total_cities = sum(len(cities) for journal in journals for cities in journal.pending_cities().values())
+
+    print(f"\n{Fore.GREEN}Starting batch search process:")
+    print(f"{Fore.GREEN}- Business types: {len(searches)}")
+    print(f"{Fore.GREEN}- Total city searches: {total_cities}")
+    for search in searches:
+        print(f"{Style.BRIGHT}{Fore.MAGENTA}{search.business_type}: {search.enhanced_query} ({', '.join(search.keywords)})")
+    print(f"{Style.BRIGHT}{Fore.MAGENTA}Batch ID: {batch_id} (resume with --resume {batch_id})")
+
+    print_legend()
+    print(f"\n{Style.BRIGHT}{Fore.CYAN}{'City, State':<20} {'Leads':<8} {'Invalid Leads':<15} {'Dups':<10} {'Runtime':<15} {'Progress'}")
+    print(f"{Style.BRIGHT}{Fore.CYAN}{'-'*85}")
+
+    completed_cities = 0
+
+    def on_city(search, result):
+        nonlocal completed_cities, total_cities
+        completed_cities += 1
+        total_cities += len(result.children)
+        label = f"{result.label} [{search.business_type}]"
+        if not result.ok:
+            display_progress(label, {'status': 'Error'}, start_time, completed_cities, total_cities)
+            return
+        display_progress(label, {
+            'status': 'Completed',
+            'data': {
+                'leads': len(result.leads),
+                'invalid_leads': result.invalid_leads,
+                'duplicates': result.duplicates
+            }
+        }, start_time, completed_cities, total_cities)
+
+    batch = LeadBatch(
+        searches,
+        max_in_flight=args.max_in_flight,
+        textsearch_qps=args.textsearch_qps,
+        details_qps=args.details_qps,
+        cache=args.cache,
+        refresh=args.refresh,
+        store=args.store,
+        enrich=args.enrich
+    )
+    async with batch:
+        summaries, totals = await batch.run(batch_id, journals, leads_directory, on_city=on_city,
+                                            metrics_interval=args.metrics_interval, prometheus_file=args.prometheus_file)
+
+    print(f"\n{Style.BRIGHT}{Fore.YELLOW}Total runtime: {datetime.now() - start_time}")
+    for search, summary in zip(searches, summaries):
+        new_leads = f"{summary['new_leads']} new, " if summary['new_leads'] is not None else ""
+        print(f"{Style.BRIGHT}{Fore.GREEN}{search.business_type}: {summary['valid_leads']} valid leads, {new_leads}"
+              f"{summary['invalid_leads']} invalid, {summary['failed_cities']} failed cities "
+              f"-> {os.path.basename(summary['good_leads_file'])}")
+    print(f"{Style.BRIGHT}{Fore.GREEN}Valid leads: {totals['valid_leads']}")
+    if totals['new_leads'] is not None:
+        print(f"{Style.BRIGHT}{Fore.GREEN}New leads (not found by earlier runs): {totals['new_leads']}")
+    print(f"{Style.BRIGHT}{Fore.RED}Total invalid leads: {totals['invalid_leads']}")
+    if budget and budget.stop_reason:
+        not_searched = sum(summary['cities_not_searched'] for summary in summaries)
+        print(f"{Style.BRIGHT}{Fore.YELLOW}Stopped early, {budget.stop_reason}: {not_searched} city searches not started "
+              f"(start them with --resume {batch_id})")
+    print(f"{Style.BRIGHT}{Fore.YELLOW}Details calls saved by place_id reuse: {totals['details_calls_saved']}")
+    for endpoint, counts in totals['requests'].items():
+        print(f"{Style.BRIGHT}{Fore.YELLOW}{endpoint} requests: {counts['calls']} "
+              f"(retries: {counts['retries']}, throttled: {counts['throttled']}, gave up: {counts['gave_up']})")
+    print_websites(totals['websites'])
+    print(f"{Style.BRIGHT}{Fore.YELLOW}Estimated Places API cost: ${totals['estimated_cost']:.2f}"
+          + (f" (${totals['estimated_cost'] / totals['valid_leads']:.3f} per valid lead)" if totals['valid_leads'] else ""))
+    print(f"{Style.BRIGHT}{Fore.YELLOW}Metrics saved as: {totals['metrics_file']} and {totals['prometheus_file']}")
+    print(f"{Style.BRIGHT}{Fore.YELLOW}Leads saved in directory: {leads_directory}")
+    print("\nScript completed successfully.")
+
+
+def worker_argv(argv, workers, args):
+    # The launcher's own arguments minus the launcher options. Workers share
+    # the API key, so each one gets an equal part of the rate limits and budgets.
+    # A --prometheus-file would be overwritten by every worker, so each writes
+    # the default textfile next to its own journal instead.
+    worker_args = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in ('--workers', '--run-id', '--prometheus-file'):
+            skip = True
+        elif not arg.startswith(('--workers=', '--run-id=', '--prometheus-file=')) and arg != '--refresh-keywords':
+            worker_args.append(arg)
+    worker_args += [
+        '--textsearch-qps', str(args.textsearch_qps / workers),
+        '--details-qps', str(args.details_qps / workers),
+    ]
+    # Budgets are split the same way; --min-yield applies to each worker as it is
+    if args.max_api_calls is not None:
+        worker_args += ['--max-api-calls', str(args.max_api_calls // workers)]
+    if args.max_cost is not None:
+        worker_args += ['--max-cost', str(args.max_cost / workers)]
+    return worker_args
+
+
+def print_merge(merged):
+    # Bad leads can gain rows: valid leads duplicated across shards are moved there
+    for path, (rows_read, rows_written) in merged.items():
+        print(f"{Style.BRIGHT}{Fore.YELLOW}{os.path.basename(path)}: {rows_written} rows from {rows_read} shard rows")
+
+
+def run_workers(args, argv):
+    """
+    Run a search as args.workers local shard processes and merge their output.
+    """
+    import asyncio
+    from leadgen import expand_query, load_batch_file
+    from city_index import get_city_index
+    from shard import launch_shards, merge_shards
+
+    run_id = args.run_id or datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    # Build the city index and expand the queries once, so the workers find
+    # them on disk instead of all doing it at the same time
+    get_city_index()
+    if args.batch:
+        niches = load_batch_file(args.batch)
+        expansions = [expand_query(niche['business_type'], niche['keywords'], refresh=args.refresh_keywords) for niche in niches]
+    else:
+        expansions = [expand_query(args.business_type, args.keywords, refresh=args.refresh_keywords)]
+
+    async def expand_all():
+        return await asyncio.gather(*expansions)
+    asyncio.run(expand_all())
+
+    print(f"\n{Fore.GREEN}Starting {args.workers} workers for run {run_id}, logs in {RUNS_DIR}")
+    start_time = datetime.now()
+    exit_codes = launch_shards(worker_argv(argv, args.workers, args), run_id, args.workers, RUNS_DIR)
+    for index, code in enumerate(exit_codes):
+        color = Fore.GREEN if code == 0 else Fore.RED
+        print(f"{color}Shard {index}/{args.workers} finished with exit code {code}")
+    print(f"{Style.BRIGHT}{Fore.YELLOW}Total runtime: {datetime.now() - start_time}")
+
+    print_merge(merge_shards(run_id, LEADS_DIR))
+    if any(exit_codes):
+        print(f"{Fore.RED}Some shards failed; resume them with --resume <shard run ID>, then run --merge {run_id}")
+        sys.exit(1)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    # Initialize colorama
+    init(autoreset=True)
+    configure_logging(args.debug)
+
+    if args.merge:
+        from shard import merge_shards
+        merged = merge_shards(args.merge, LEADS_DIR)
+        if not merged:
+            print(f"Error: no shard output found for run ID {args.merge} in {LEADS_DIR}")
+            sys.exit(1)
+        print_merge(merged)
+        return
+
+    if args.shard:
+        from shard import parse_shard
+        try:
+            args.shard = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.output_format == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error("--output-format parquet needs pyarrow (pip install pyarrow)")
+    if args.workers is not None and (args.workers < 1 or args.shard or args.resume):
+        parser.error("--workers must be at least 1 and can't be combined with --shard or --resume")
+
+    if not GOOGLE_PLACES_API_KEY:
+        print("Error: GOOGLE_PLACES_API_KEY environment variable is not set.")
+        sys.exit(1)
+
+    if not OPENAI_API_KEY and not args.resume:
+        print("Error: OPENAI_API_KEY environment variable is not set.")
+        sys.exit(1)
+
+    logging.debug(f"Startup took {(time.perf_counter() - STARTUP_TIME) * 1000:.1f} ms")
+
+    if args.workers:
+        run_workers(args, argv)
+        return
+
+    import asyncio
+    # A non-zero exit code lets --workers tell an interrupted or crashed shard from a finished one
     try:
-        asyncio.run(main_async())
+        asyncio.run(main_async(args))
+    except KeyboardInterrupt:
+        print(f"\n{Fore.YELLOW}Interrupted. Progress was saved, continue with --resume <run ID>.")
+        sys.exit(130)
     except Exception as e:
         print(f"\n{Fore.RED}An unexpected error occurred: {str(e)}")
-        logging.exception("Unexpected error in main execution")
\ No newline at end of file
+        logging.exception("Unexpected error in main execution")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import re
+
+MATCH_MODES = ('substring', 'word', 'prefix')
+
+
+def _trie_pattern(words):
+    # Builds a regex where keywords sharing a prefix share a branch, e.g.
+    # ['light', 'lighting', 'lamp'] -> 'l(?:a(?:mp)|i(?:ght(?:ing)?))'. The
+    # regex engine then walks a trie instead of trying every keyword in turn.
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+    return _node_pattern(trie)
+
+
+def _node_pattern(node):
+    optional = '' in node
+    branches = [re.escape(char) + _node_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ''
+    if len(branches) == 1 and not optional:
+        return branches[0]
+    pattern = '(?:' + '|'.join(branches) + ')'
+    return pattern + '?' if optional else pattern
+
+
+class KeywordMatcher:
+    """
+    Matches business names against include and exclude keyword lists.
+
+    Both lists are compiled once into a single regex each. Modes:
+    'substring' matches a keyword anywhere in the name (the historical
+    behaviour), 'word' only matches whole words and 'prefix' matches words
+    starting with a keyword. match() returns the matched keyword, or None.
+    """
+
+    def __init__(self, keywords, exclude=None, mode='substring'):
+        if mode not in MATCH_MODES:
+            raise ValueError(f"Unknown match mode: {mode}")
+        self.mode = mode
+        self.keywords = sorted({kw.strip().lower() for kw in keywords if kw.strip()})
+        self.exclude = sorted({kw.strip().lower() for kw in (exclude or []) if kw.strip()})
+        self.include_regex = self._compile(self.keywords)
+        self.exclude_regex = self._compile(self.exclude)
+
+    def _compile(self, words):
+        if not words:
+            return None
+        pattern = _trie_pattern(words)
+        if self.mode == 'word':
+            pattern = rf"\b{pattern}\b"
+        elif self.mode == 'prefix':
+            pattern = rf"\b{pattern}"
+        return re.compile(pattern)
+
+    def match(self, name):
+        # Returns the keyword matched in name, or None if nothing matched
+        if self.include_regex is None:
+            return None
+        match = self.include_regex.search(name.lower())
+        return match.group(0) if match else None
+
+    def excluded(self, name):
+        # Returns the exclude keyword found in name, or None
+        if self.exclude_regex is None:
+            return None
+        match = self.exclude_regex.search(name.lower())
+        return match.group(0) if match else None
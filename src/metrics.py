@@ -0,0 +1,156 @@
+import bisect
+import json
+import os
+import time
+from collections import Counter
+
+# Upper bounds in seconds; requests and cities have very different scales
+REQUEST_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CITY_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+METRIC_PREFIX = 'leadgen'
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One count per bucket plus the +Inf bucket, not cumulative
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, fraction):
+        # Upper bound of the bucket holding the quantile, like Prometheus' histogram_quantile
+        if not self.count:
+            return 0
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0,
+            'p50': self.quantile(0.50),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """
+    In-process counters, gauges and histograms for a run.
+
+    Metrics are keyed by name and a sorted tuple of (label, value) pairs.
+    snapshot() returns them as plain JSON data and prometheus() renders
+    the Prometheus text exposition format, suitable for node_exporter's
+    textfile collector.
+    """
+
+    def __init__(self):
+        self.counters = Counter()
+        self.gauges = {}
+        self.histograms = {}
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        self.counters[(name, _labels(labels))] += value
+
+    def set_total(self, name, value, **labels):
+        # For counters kept elsewhere, such as the scheduler's, copied in at export time
+        self.counters[(name, _labels(labels))] = value
+
+    def set(self, name, value, **labels):
+        self.gauges[(name, _labels(labels))] = value
+
+    def observe(self, name, value, buckets=REQUEST_BUCKETS, **labels):
+        key = (name, _labels(labels))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def snapshot(self):
+        return {
+            'started': self.started,
+            'elapsed': time.time() - self.started,
+            'counters': _grouped((key, value) for key, value in sorted(self.counters.items())),
+            'gauges': _grouped((key, value) for key, value in sorted(self.gauges.items())),
+            'histograms': _grouped((key, histogram.summary()) for key, histogram in sorted(self.histograms.items())),
+        }
+
+    def prometheus(self):
+        lines = []
+        for kind, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+            typed = set()
+            for (name, labels), value in sorted(metrics.items()):
+                full_name = f"{METRIC_PREFIX}_{name}"
+                if full_name not in typed:
+                    lines.append(f"# TYPE {full_name} {kind}")
+                    typed.add(full_name)
+                lines.append(f"{full_name}{_format_labels(labels)} {_format_value(value)}")
+
+        typed = set()
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            full_name = f"{METRIC_PREFIX}_{name}"
+            if full_name not in typed:
+                lines.append(f"# TYPE {full_name} histogram")
+                typed.add(full_name)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                lines.append(f"{full_name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{full_name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+            lines.append(f"{full_name}_count{_format_labels(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, json_path=None, prometheus_path=None):
+        # Files are replaced atomically so scrapers never read a partial file
+        if json_path:
+            _write_atomic(json_path, json.dumps(self.snapshot(), indent=2))
+        if prometheus_path:
+            _write_atomic(prometheus_path, self.prometheus())
+
+
+def _labels(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _grouped(items):
+    grouped = {}
+    for (name, labels), value in items:
+        grouped.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+    return grouped
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        name + '="' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in labels
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _write_atomic(path, content):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.part"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        file.write(content)
+    os.replace(temp_path, path)
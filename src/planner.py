@@ -0,0 +1,206 @@
+import asyncio
+from collections import Counter, deque
+
+from config import PLACES_COST_PER_1000, REPEAT_SEARCH_NEW_SHARE, YIELD_WINDOW
+from grid import Cell
+
+
+def api_calls(requests):
+    # Total calls in a RequestScheduler.summary()
+    return sum(counts['calls'] for counts in requests.values())
+
+
+def estimate_cost(requests):
+    # Estimated Places API cost in USD of a RequestScheduler.summary()
+    return sum(counts['calls'] * PLACES_COST_PER_1000.get(endpoint, 0) / 1000 for endpoint, counts in requests.items())
+
+
+def expected_new_leads(city, history, prior):
+    # history is LeadStore.city_history(): {city: (searches, leads, last_leads, last_new_leads)}
+    if city not in history:
+        return prior
+    searches, leads, last_leads, last_new_leads = history[city]
+    if searches == 1:
+        # A repeat search mostly finds the same businesses again
+        return last_leads * REPEAT_SEARCH_NEW_SHARE
+    return last_new_leads
+
+
+def order_cities(cities, history, populations=None):
+    """
+    Order cities by the number of new leads a search is expected to find.
+
+    Cities never searched for this niche are expected to find the niche's
+    average leads per search, all of them new. A city searched once is
+    expected to find REPEAT_SEARCH_NEW_SHARE of its leads as new again,
+    and one searched more often as many new leads as its last search. Ties,
+    including every city when there is no history, go to the larger
+    population and then to the original order.
+    """
+    populations = populations or {}
+    searches = sum(entry[0] for entry in history.values())
+    prior = sum(entry[1] for entry in history.values()) / searches if searches else 0
+    return sorted(
+        cities,
+        key=lambda city: (expected_new_leads(city, history, prior), populations.get(city) or 0),
+        reverse=True
+    )
+
+
+def city_populations(cities):
+    # {city: population} for "City, ST" names and grid cell keys (the population of the city a cell is named after)
+    from city_index import get_city_index
+
+    city_index = get_city_index()
+    populations = {}
+    for city in cities:
+        if Cell.is_key(city):
+            cell = Cell.from_key(city)
+            name, state = cell.city, cell.state
+        else:
+            name, _, state = city.rpartition(', ')
+        if name and state:
+            populations[city] = city_index.population(name, state)
+    return populations
+
+
+class Budget:
+    """
+    Limits on the API calls or estimated cost of a run, and a floor on how
+    many new leads per dollar its latest cities still find.
+
+    LeadSearch.run() records every completed city and checks the budget
+    before dispatching the next one. A city only starts if the requests
+    made so far plus a whole city for each city in flight and for the next
+    one stay within the limits (fits()), so the cities already started
+    can't push a run past them. A whole city is the most one can cost
+    (city_requests, all pages with details for every result), or the
+    average city so far if retries made that more. Cities vary too much in
+    cost for the average alone to hold the limits. A city that doesn't fit
+    waits for one in flight to complete (wait()), and the run stops
+    once nothing is in flight and the next city still doesn't fit. min_yield
+    is in new leads per estimated dollar over the last `window` completed
+    cities.
+
+    One Budget can be shared by the searches of a batch, which share their
+    scheduler. The next city then goes to the waiting search with the
+    fewest cities in flight, then the fewest started (defers()), so one
+    niche can't take every city the others are waiting for.
+    """
+
+    def __init__(self, max_api_calls=None, max_cost=None, min_yield=None, window=YIELD_WINDOW):
+        self.max_api_calls = max_api_calls
+        self.max_cost = max_cost
+        self.min_yield = min_yield
+        self.window = window
+        self.cities = 0
+        # Cities started and not yet recorded, across every search sharing the budget
+        self.in_flight = 0
+        self.new_leads = 0
+        # (API calls, cost, new leads) after each of the latest completed cities
+        self.history = deque(maxlen=window + 1)
+        self.stop_reason = None
+        # Per search: cities in flight, cities started and the order it first started one in
+        self.running = Counter()
+        self.started = Counter()
+        self.order = {}
+        # Searches waiting to start a city -> future they wait on for a city to complete or their turn
+        self.waiting = {}
+
+    def can_start(self, max_in_flight):
+        return self.in_flight < max_in_flight
+
+    def start(self, search):
+        self.stop_waiting(search)
+        self.in_flight += 1
+        self.running[search] += 1
+        self.started[search] += 1
+        self.order.setdefault(search, len(self.order))
+
+    def record(self, requests, new_leads, search):
+        self.in_flight -= 1
+        self.running[search] -= 1
+        self.cities += 1
+        self.new_leads += new_leads
+        self.history.append((api_calls(requests), estimate_cost(requests), self.new_leads))
+        self.wake()
+
+    def priority(self, search):
+        return self.running[search], self.started[search], self.order.get(search, len(self.order))
+
+    def defers(self, search):
+        # Whether search should leave the next city to a waiting search that comes first
+        return any(self.priority(other) < self.priority(search) for other in self.waiting if other is not search)
+
+    def wake(self):
+        for waiter in self.waiting.values():
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def wait(self, search):
+        # A future done when a city sharing the budget completes or search is woken to take
+        # its turn. search stays waiting until it starts a city or gives up (leave()).
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiting[search] = waiter
+        return waiter
+
+    def join(self, search):
+        # Has search wait for its turn from the start, so the first search of a batch
+        # to dispatch doesn't take every city before the others ask for theirs
+        waiter = asyncio.get_running_loop().create_future()
+        waiter.set_result(None)
+        self.waiting[search] = waiter
+
+    def stop_waiting(self, search):
+        waiter = self.waiting.pop(search, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+        return waiter is not None
+
+    def leave(self, search):
+        if self.stop_waiting(search):
+            # Searches deferring to this one may go ahead now
+            self.wake()
+
+    def marginal_yield(self):
+        # New leads per dollar over the last window cities, or None until there are enough of them
+        if len(self.history) <= self.window:
+            return None
+        _, first_cost, first_leads = self.history[0]
+        _, last_cost, last_leads = self.history[-1]
+        if last_cost <= first_cost:
+            return None
+        return (last_leads - first_leads) / (last_cost - first_cost)
+
+    def reserved(self, requests, city_requests):
+        # (API calls, cost) to hold back for the cities in flight and the next one
+        city_calls, city_cost = api_calls(city_requests), estimate_cost(city_requests)
+        if self.cities:
+            city_calls = max(city_calls, api_calls(requests) / self.cities)
+            city_cost = max(city_cost, estimate_cost(requests) / self.cities)
+        return (self.in_flight + 1) * city_calls, (self.in_flight + 1) * city_cost
+
+    def fits(self, requests, city_requests):
+        # Whether the next city can start; city_requests is the most one city can make, as a
+        # RequestScheduler.summary()
+        reserved_calls, reserved_cost = self.reserved(requests, city_requests)
+        if self.max_api_calls is not None and api_calls(requests) + reserved_calls > self.max_api_calls:
+            return False
+        return self.max_cost is None or estimate_cost(requests) + reserved_cost <= self.max_cost
+
+    def check(self, requests, city_requests):
+        # Returns why no more cities should be dispatched, or None
+        if self.stop_reason:
+            return self.stop_reason
+        if not self.in_flight and not self.fits(requests, city_requests):
+            calls, cost = api_calls(requests), estimate_cost(requests)
+            reserved_calls, _ = self.reserved(requests, city_requests)
+            if self.max_api_calls is not None and calls + reserved_calls > self.max_api_calls:
+                self.stop_reason = f"API call budget of {self.max_api_calls} reached ({calls} calls)"
+            else:
+                self.stop_reason = f"cost budget of ${self.max_cost:.2f} reached (${cost:.2f})"
+        elif self.min_yield is not None:
+            marginal_yield = self.marginal_yield()
+            if marginal_yield is not None and marginal_yield < self.min_yield:
+                self.stop_reason = f"new leads per dollar fell to {marginal_yield:.1f}, below {self.min_yield:g}"
+        return self.stop_reason
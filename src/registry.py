@@ -0,0 +1,45 @@
+import asyncio
+
+
+class PlaceRegistry:
+    """
+    Run-wide registry of place_ids.
+
+    Keeps one details lookup per place_id so businesses returned by several
+    neighbouring cities are only fetched once, and records which place_ids
+    have already been classified so duplicates can be detected before
+    comparing names and phone numbers.
+
+    Passing the details of another registry shares its lookups while keeping
+    a separate set of claimed place_ids, as batch mode does for each niche.
+    """
+
+    def __init__(self, details=None):
+        self.details = details if details is not None else {}
+        self.claimed = set()
+        self.saved_calls = 0
+
+    def get_details(self, place_id, fetch):
+        # Returns a shared future with the details for place_id, starting the
+        # fetch only if no other city has asked for it yet
+        future = self.details.get(place_id)
+        if future is None:
+            future = asyncio.ensure_future(fetch(place_id))
+            future.add_done_callback(lambda f: self._forget_failed(place_id, f))
+            self.details[place_id] = future
+        else:
+            self.saved_calls += 1
+        return future
+
+    def _forget_failed(self, place_id, future):
+        # Failed lookups are not reused, the next city to ask retries them
+        if future.cancelled() or future.exception() is not None:
+            if self.details.get(place_id) is future:
+                del self.details[place_id]
+
+    def claim(self, place_id):
+        # Returns False if place_id was already classified by an earlier result
+        if place_id in self.claimed:
+            return False
+        self.claimed.add(place_id)
+        return True
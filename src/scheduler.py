@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import random
+import time
+from collections import Counter
+
+# HTTP statuses and Places API statuses that are worth retrying
+RETRYABLE_HTTP_STATUSES = {429, 500, 502, 503, 504}
+RETRYABLE_API_STATUSES = {'OVER_QUERY_LIMIT', 'UNKNOWN_ERROR'}
+
+# Only successful responses are stored in the response cache
+CACHEABLE_API_STATUSES = {'OK', 'ZERO_RESULTS'}
+
+
+class RequestFailed(Exception):
+    """Raised when a request is still failing after all retries."""
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Returns True if the caller had to wait for a token
+        throttled = False
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return throttled
+                throttled = True
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class RequestScheduler:
+    """
+    Shared gateway for every Places API call in a run.
+
+    Caps the number of requests in flight, applies a token-bucket QPS limit
+    per endpoint and retries transient failures with jittered exponential
+    backoff. When a ResponseCache is given, cached responses are returned
+    without touching the network. When a Metrics instance is given, the
+    latency and size of every response are recorded per endpoint.
+
+    schedule() is a delayed-task queue for work that must not start before
+    a deadline, such as next_page_token follow-ups: nothing is held while
+    the delay runs, so other cities keep using the in-flight slots.
+    """
+
+    def __init__(self, session, max_in_flight, qps=None, max_retries=3, backoff_time=2, cache=None, metrics=None):
+        self.session = session
+        self.cache = cache
+        self.metrics = metrics
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.buckets = {endpoint: TokenBucket(rate) for endpoint, rate in (qps or {}).items() if rate}
+        self.max_retries = max_retries
+        self.backoff_time = backoff_time
+        self.stats = Counter()
+
+    def backoff_delay(self, attempt):
+        # Equal jitter: half the exponential delay is fixed, the other half random
+        delay = self.backoff_time * (2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def cached(self, endpoint, params):
+        # Returns the cached response for a request without calling the API
+        return self.cache.get(endpoint, params) if self.cache else None
+
+    def schedule(self, delay, factory):
+        # Runs the coroutine returned by factory() after delay seconds.
+        # Cancelling the returned future cancels the coroutine too, even once it has started.
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        started = []
+        self.stats[('delayed', 'scheduled')] += 1
+
+        def start():
+            if future.cancelled():
+                return
+            task = asyncio.ensure_future(factory())
+            task.add_done_callback(lambda t: _copy_result(t, future))
+            started.append(task)
+
+        def cancel(future):
+            if not future.cancelled():
+                return
+            handle.cancel()
+            for task in started:
+                task.cancel()
+
+        handle = loop.call_later(delay, start)
+        future.add_done_callback(cancel)
+        return future
+
+    async def get_json(self, endpoint, url, params=None, cache_params=None, use_cache=True):
+        # cache_params overrides the request parameters used as the cache key,
+        # for requests such as page tokens whose parameters aren't stable
+        import aiohttp
+
+        cache_params = cache_params or params
+        if self.cache and use_cache:
+            cached = self.cache.get(endpoint, cache_params)
+            if cached is not None:
+                return cached
+
+        bucket = self.buckets.get(endpoint)
+        attempt = 0
+        while True:
+            if bucket and await bucket.acquire():
+                self.stats[(endpoint, 'throttled')] += 1
+
+            error = None
+            async with self.semaphore:
+                self.stats[(endpoint, 'calls')] += 1
+                start_time = time.monotonic()
+                try:
+                    async with self.session.get(url, params=params) as response:
+                        if self.metrics:
+                            body = await response.read()
+                            self.metrics.inc('api_response_bytes_total', len(body), endpoint=endpoint)
+                            self.metrics.observe('api_request_seconds', time.monotonic() - start_time, endpoint=endpoint)
+                        if response.status in RETRYABLE_HTTP_STATUSES:
+                            error = f"HTTP {response.status}"
+                        else:
+                            response.raise_for_status()
+                            result = await response.json()
+                            if result.get('status') in RETRYABLE_API_STATUSES:
+                                error = result['status']
+                            else:
+                                if self.cache and result.get('status') in CACHEABLE_API_STATUSES:
+                                    self.cache.set(endpoint, cache_params, result)
+                                return result
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    if isinstance(e, aiohttp.ClientResponseError) and e.status not in RETRYABLE_HTTP_STATUSES:
+                        self.stats[(endpoint, 'gave_up')] += 1
+                        raise RequestFailed(f"{endpoint}: HTTP {e.status}") from e
+                    error = str(e) or type(e).__name__
+
+            if attempt >= self.max_retries:
+                self.stats[(endpoint, 'gave_up')] += 1
+                raise RequestFailed(f"{endpoint}: {error} after {attempt + 1} attempts")
+
+            delay = self.backoff_delay(attempt)
+            attempt += 1
+            self.stats[(endpoint, 'retries')] += 1
+            logging.debug(f"Retrying {endpoint} in {delay:.2f}s ({error}, attempt {attempt}/{self.max_retries})")
+            await asyncio.sleep(delay)
+
+    def summary(self):
+        endpoints = sorted({endpoint for endpoint, _ in self.stats if endpoint != 'delayed'})
+        return {
+            endpoint: {
+                event: self.stats[(endpoint, event)]
+                for event in ('calls', 'retries', 'throttled', 'gave_up')
+            }
+            for endpoint in endpoints
+        }
+
+
+def _copy_result(task, future):
+    if future.done():
+        # Nobody waits for the result any more; retrieve the exception so it isn't reported as lost
+        if not task.cancelled():
+            task.exception()
+        return
+    if task.cancelled():
+        future.cancel()
+    elif task.exception() is not None:
+        future.set_exception(task.exception())
+    else:
+        future.set_result(task.result())
@@ -0,0 +1,124 @@
+import glob
+import hashlib
+import logging
+import os
+import re
+import subprocess
+import sys
+
+from data_handler import LeadStats, LeadWriter, lead_identifier
+from dedup import DuplicateIndex
+from formats import FORMATS, format_for
+
+
+def parse_shard(spec):
+    # "i/N" with 0 <= i < N, e.g. "0/4" is the first of four shards
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', spec or '')
+    if not match:
+        raise ValueError(f"Invalid shard {spec!r}, expected i/N")
+    index, count = int(match.group(1)), int(match.group(2))
+    if count < 1 or index >= count:
+        raise ValueError(f"Invalid shard {spec!r}, i must be between 0 and N-1")
+    return index, count
+
+
+def shard_of(city, count):
+    # A stable hash, unlike hash(), so every machine assigns a city to the same shard
+    digest = hashlib.sha1(city.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count
+
+
+def shard_cities(cities_by_state, index, count):
+    return {
+        state: [city for city in cities if shard_of(city, count) == index]
+        for state, cities in cities_by_state.items()
+    }
+
+
+def shard_run_id(run_id, index, count):
+    return f"{run_id}_shard{index}-{count}"
+
+
+def launch_shards(argv, run_id, workers, log_dir):
+    """
+    Run main.py once per shard in local worker processes and wait for them.
+
+    argv are the command line arguments shared by every worker; each one
+    gets its own --shard and the common --run-id. Worker output goes to
+    <log_dir>/<shard run ID>.log. Returns the exit codes by shard index.
+    """
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    os.makedirs(log_dir, exist_ok=True)
+    processes = []
+    for index in range(workers):
+        log_path = os.path.join(log_dir, f"{shard_run_id(run_id, index, workers)}.log")
+        with open(log_path, 'w', encoding='utf-8') as log_file:
+            processes.append(subprocess.Popen(
+                [sys.executable, main_path, *argv, '--shard', f"{index}/{workers}", '--run-id', run_id],
+                stdout=log_file,
+                stderr=subprocess.STDOUT
+            ))
+    return [process.wait() for process in processes]
+
+
+def merge_shards(run_id, directory):
+    """
+    Combine the lead files of every shard of run_id into one file per kind.
+
+    Shard files are named like leads_<run_id>_shard<i>-<N><suffix>.<ext>,
+    where batch runs add a per-niche suffix; each (kind, suffix) group is
+    merged into <kind>_<run_id><suffix>.<ext> in the same format.
+
+    Duplicates are handled as a single-process run handles them. Valid
+    leads go through a DuplicateIndex, and a near-duplicate of a valid lead
+    from another shard is moved to the bad leads with reason 'duplicate'.
+    New leads keep only the rows still valid. Every file is then written
+    through LeadWriter, which drops rows with the same lead_identifier.
+    Rows are ordered by location, name and phone first, so the output does
+    not depend on the order in which shards or cities finished. The
+    per-state and per-city statistics of the merged files are written to
+    stats_<run_id><suffix>.json.
+    Returns {output path: (rows read, rows written)}.
+    """
+    extensions = '|'.join(re.escape(output_format.extension) for output_format in FORMATS.values())
+    pattern = re.compile(rf'^((?:bad-|new-)?leads)_{re.escape(run_id)}_shard(\d+)-(\d+)((?:_[a-z0-9-]+)?)({extensions})$')
+    groups = {}
+    for path in sorted(glob.glob(os.path.join(directory, f"*_{glob.escape(run_id)}_shard*"))):
+        match = pattern.match(os.path.basename(path))
+        if match:
+            kind, index, count, suffix, extension = match.groups()
+            groups.setdefault((suffix, extension, int(count)), {}).setdefault(kind, []).append(path)
+
+    merged = {}
+    for (suffix, extension, count), kinds in sorted(groups.items()):
+        output_format = format_for(extension)
+        rows = {}
+        for kind, paths in kinds.items():
+            if len(paths) != count:
+                logging.warning(f"Only {len(paths)} of {count} shards found for {kind}_{run_id}{suffix}")
+            rows[kind] = [row for path in paths for row in output_format.read_rows(path)]
+            rows[kind].sort(key=lambda row: (row['STATE/CITY'], row['NAME'].strip().lower(), (row['PHONE'] or '').strip()))
+
+        duplicate_index = DuplicateIndex()
+        output = {kind: [] for kind in rows}
+        valid = set()
+        for row in rows.get('leads', []):
+            if duplicate_index.check(row):
+                output.setdefault('bad-leads', []).append(dict(row, REASON='duplicate'))
+            else:
+                output['leads'].append(row)
+                valid.add(lead_identifier(row))
+        output.setdefault('bad-leads', []).extend(rows.get('bad-leads', []))
+        if 'new-leads' in rows:
+            output['new-leads'] = [row for row in rows['new-leads'] if lead_identifier(row) in valid]
+
+        run_stats = LeadStats()
+        for kind in ('leads', 'bad-leads', 'new-leads'):
+            if kind not in output or (kind not in rows and not output[kind]):
+                continue
+            output_path = os.path.join(directory, f"{kind}_{run_id}{suffix}{extension}")
+            with LeadWriter(output_path, on_row=run_stats.add_new if kind == 'new-leads' else run_stats.add) as writer:
+                writer.write(output[kind])
+            merged[output_path] = (len(rows.get(kind, [])), writer.rows_written)
+        run_stats.write(os.path.join(directory, f"stats_{run_id}{suffix}.json"), run_id=run_id)
+    return merged
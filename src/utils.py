@@ -2,16 +2,33 @@ from colorama import Fore, Style
 from datetime import datetime
 
 def get_location_coordinates(location):
-    # This function is not implemented in the current version
-    # You may want to implement it using a geocoding service if needed
+    # "City, ST" locations come from the city index; anything else is geocoded
+    from city_index import get_city_index
+
+    if location.count(',') == 1:
+        city, state = location.split(',')
+        coordinates = get_city_index().coordinates(city, state)
+        if coordinates:
+            return f"{coordinates[0]},{coordinates[1]}"
+
+    from geopy.geocoders import Nominatim
+
+    geolocator = Nominatim(user_agent="my_app")
+    try:
+        location_data = geolocator.geocode(location)
+        if location_data:
+            return f"{location_data.latitude},{location_data.longitude}"
+    except Exception as e:
+        print(f"Error getting coordinates for {location}: {str(e)}")
     return None
 
 def is_duplicate(business, existing_businesses):
-    return any(
-        b['NAME'].lower() == business['NAME'].lower() and
-        b['CITY/STATE'].lower() == business['CITY/STATE'].lower()
-        for b in existing_businesses
-    )
+    # existing_businesses is a list, scanned in full, or a dedup.DuplicateIndex for repeated checks
+    from dedup import DuplicateIndex, same_business
+
+    if isinstance(existing_businesses, DuplicateIndex):
+        return existing_businesses.find(business) is not None
+    return any(same_business(b, business) for b in existing_businesses)
 
 def save_to_csv(businesses, filename):
     # This function is now handled by write_output_data in src/data_handler.py
@@ -20,7 +37,7 @@ def save_to_csv(businesses, filename):
     write_output_data(businesses, filename)
 
 def print_legend():
-    print(f"Legend: {Fore.RED}0 leads {Fore.YELLOW}1-4 leads {Fore.BLUE}5-14 leads {Fore.GREEN}15+ leads{Style.RESET_ALL}")
+    print(f"\nLegend: {Fore.RED}0 leads {Fore.YELLOW}1-4 leads {Fore.BLUE}5-14 leads {Fore.GREEN}15+ leads{Style.RESET_ALL}")
 
 def display_progress(city, result, start_time, completed_cities, total_cities):
     runtime = (datetime.now() - start_time).total_seconds()